@@ -140,112 +140,6 @@ class LogoutWorker(AsyncWorker):
             print(traceback.format_exc())
             self.error.emit(error_msg)
 
-class FriendsListWorker(AsyncWorker):
-    """好友列表加载工作线程"""
-    
-    def __init__(self):
-        from friends_manager import friends_manager
-        from user_auth import user_auth
-        self.friends_manager = friends_manager
-        self.current_user = user_auth.get_current_user()
-        super().__init__(self._load_friends_with_cache)
-    
-    def _load_friends_with_cache(self):
-        """带缓存的加载好友列表"""
-        if not self.current_user:
-            return {"success": False, "message": "用户未登录"}
-        
-        user_id = str(self.current_user['id'])
-        
-        # 先尝试从缓存获取
-        cached_data = user_cache.get_friends_list(user_id)
-        if cached_data:
-            self.progress.emit("从缓存加载好友列表...")
-            return cached_data
-        
-        # 缓存未命中，从服务器获取
-        self.progress.emit("正在从服务器加载好友列表...")
-        result = self.friends_manager.get_friends_list()
-        
-        # 缓存成功的结果
-        if result.get('success'):
-            user_cache.set_friends_list(user_id, result)
-        
-        return result
-    
-    def run(self):
-        """执行加载好友列表任务"""
-        try:
-            # 执行加载好友列表
-            result = self.task_func(*self.args, **self.kwargs)
-            
-            if result.get('success'):
-                friend_count = len(result.get('friends', []))
-                self.progress.emit(f"加载完成，共 {friend_count} 个好友")
-            else:
-                self.progress.emit("加载失败")
-            
-            self.finished.emit(result)
-            
-        except Exception as e:
-            error_msg = f"加载好友列表失败: {str(e)}"
-            print(f"FriendsListWorker error: {error_msg}")
-            print(traceback.format_exc())
-            self.error.emit(error_msg)
-
-class FriendRequestsWorker(AsyncWorker):
-    """好友请求加载工作线程"""
-    
-    def __init__(self):
-        from friends_manager import friends_manager
-        from user_auth import user_auth
-        self.friends_manager = friends_manager
-        self.current_user = user_auth.get_current_user()
-        super().__init__(self._load_requests_with_cache)
-    
-    def _load_requests_with_cache(self):
-        """带缓存的加载好友请求"""
-        if not self.current_user:
-            return {"success": False, "message": "用户未登录"}
-        
-        user_id = str(self.current_user['id'])
-        
-        # 先尝试从缓存获取
-        cached_data = user_cache.get_friend_requests(user_id)
-        if cached_data:
-            self.progress.emit("从缓存加载好友请求...")
-            return cached_data
-        
-        # 缓存未命中，从服务器获取
-        self.progress.emit("正在从服务器加载好友请求...")
-        result = self.friends_manager.get_friend_requests()
-        
-        # 缓存成功的结果
-        if result.get('success'):
-            user_cache.set_friend_requests(user_id, result)
-        
-        return result
-    
-    def run(self):
-        """执行加载好友请求任务"""
-        try:
-            # 执行加载好友请求
-            result = self.task_func(*self.args, **self.kwargs)
-            
-            if result.get('success'):
-                request_count = len(result.get('requests', []))
-                self.progress.emit(f"加载完成，共 {request_count} 个请求")
-            else:
-                self.progress.emit("加载失败")
-            
-            self.finished.emit(result)
-            
-        except Exception as e:
-            error_msg = f"加载好友请求失败: {str(e)}"
-            print(f"FriendRequestsWorker error: {error_msg}")
-            print(traceback.format_exc())
-            self.error.emit(error_msg)
-
 class SearchUsersWorker(AsyncWorker):
     """搜索用户工作线程"""
     
@@ -256,34 +256,10 @@ class UserDataCache:
         
         # 不同数据类型的缓存时间
         self.ttl_config = {
-            'friends_list': 300,      # 好友列表缓存5分钟
-            'friend_requests': 180,   # 好友请求缓存3分钟
             'user_search': 600,       # 用户搜索缓存10分钟
             'user_profile': 1800,     # 用户资料缓存30分钟
         }
     
-    def get_friends_list(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """获取好友列表缓存"""
-        key = f"friends_list_{user_id}"
-        return self.cache.get(key)
-    
-    def set_friends_list(self, user_id: str, friends_data: Dict[str, Any]) -> bool:
-        """设置好友列表缓存"""
-        key = f"friends_list_{user_id}"
-        ttl = self.ttl_config['friends_list']
-        return self.cache.set(key, friends_data, ttl)
-    
-    def get_friend_requests(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """获取好友请求缓存"""
-        key = f"friend_requests_{user_id}"
-        return self.cache.get(key)
-    
-    def set_friend_requests(self, user_id: str, requests_data: Dict[str, Any]) -> bool:
-        """设置好友请求缓存"""
-        key = f"friend_requests_{user_id}"
-        ttl = self.ttl_config['friend_requests']
-        return self.cache.set(key, requests_data, ttl)
-    
     def get_user_search(self, query: str) -> Optional[Dict[str, Any]]:
         """获取用户搜索缓存"""
         key = f"user_search_{query}"
@@ -295,16 +271,6 @@ class UserDataCache:
         ttl = self.ttl_config['user_search']
         return self.cache.set(key, search_data, ttl)
     
-    def invalidate_user_data(self, user_id: str):
-        """使用户相关缓存失效"""
-        keys_to_delete = [
-            f"friends_list_{user_id}",
-            f"friend_requests_{user_id}",
-        ]
-        
-        for key in keys_to_delete:
-            self.cache.delete(key)
-    
     def clear_all(self) -> bool:
         """清空所有缓存"""
         return self.cache.clear()
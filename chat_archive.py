@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天记录归档模块
+把较早的聊天消息从热库 chat.db 移到冷库 chat_archive.db，保持热库小而常驻缓存
+"""
+
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import List, Optional
+from chat_message import ChatMessage, to_epoch_ms
+from chat_migrations import RANDOM_UID_SQL, epoch_ms_update_sql
+
+class ArchivePolicy:
+    """归档策略
+
+    满足任一条件的已读消息会被归档：
+    - 早于 max_age_days 天
+    - 超出所在会话最新 keep_per_conversation 条之外
+    未读消息始终留在热库，保证未读计数准确；尚未同步到云端的消息默认也留在热库等待上传，
+    不使用云同步时这些消息永远不会上传，可以设置 archive_unsynced 让它们超过 max_age_days 后同样归档。
+    """
+
+    def __init__(self, max_age_days: Optional[int] = 180, keep_per_conversation: Optional[int] = 1000,
+                 batch_size: int = 500, archive_unsynced: bool = False):
+        """
+        Args:
+            max_age_days: 消息保留在热库的最长天数，None表示不按时间归档
+            keep_per_conversation: 每个会话在热库中保留的最新消息数，None表示不按数量归档
+            batch_size: 每一步最多移动的消息数
+            archive_unsynced: 是否按 max_age_days 归档尚未同步的消息（归档后不再上传）
+        """
+        self.max_age_days = max_age_days
+        self.keep_per_conversation = keep_per_conversation
+        self.batch_size = batch_size
+        self.archive_unsynced = archive_unsynced
+
+class ChatArchive:
+    """冷库管理类"""
+
+    # 冷库自身的结构版本（PRAGMA archive.user_version）
+    SCHEMA_VERSION = 2
+
+    def __init__(self, db_path: str, archive_path: str = None):
+        """
+        Args:
+            db_path: 热库路径
+            archive_path: 冷库路径，默认与热库同目录的chat_archive.db
+        """
+        self.db_path = db_path
+        self.archive_path = archive_path or os.path.join(os.path.dirname(db_path), 'chat_archive.db')
+
+    def exists(self) -> bool:
+        """冷库文件是否存在"""
+        return os.path.exists(self.archive_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        """打开热库并附加冷库"""
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+        return conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection) -> List[str]:
+        """创建冷库表，并补齐热库后来新增的列
+
+        Returns:
+            两边共有的列名列表
+        """
+        hot_columns = [row[1] for row in conn.execute("PRAGMA main.table_info(chat_messages)")]
+
+        is_new = conn.execute("""
+            SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'chat_messages'
+        """).fetchone() is None
+        if is_new:
+            conn.execute("PRAGMA archive.auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA archive.journal_mode = WAL")
+            conn.execute("""
+                CREATE TABLE archive.chat_messages (
+                    id INTEGER PRIMARY KEY,
+                    sender_id TEXT NOT NULL,
+                    receiver_id TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    message_type TEXT DEFAULT 'text',
+                    created_at INTEGER,
+                    is_read BOOLEAN DEFAULT 0,
+                    sync_status TEXT DEFAULT 'local',
+                    conversation_key TEXT,
+                    message_uid TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX archive.idx_archive_conversation_key
+                ON chat_messages(conversation_key, created_at)
+            """)
+            conn.execute("""
+                CREATE UNIQUE INDEX archive.idx_archive_message_uid
+                ON chat_messages(message_uid) WHERE message_uid IS NOT NULL
+            """)
+            conn.execute(f"PRAGMA archive.user_version = {self.SCHEMA_VERSION}")
+
+        archive_columns = {row[1] for row in conn.execute("PRAGMA archive.table_info(chat_messages)")}
+        for column in hot_columns:
+            if column not in archive_columns:
+                conn.execute(f"ALTER TABLE archive.chat_messages ADD COLUMN {column}")
+
+        return hot_columns
+
+    def migrate(self):
+        """升级旧版本的冷库
+
+        v1: created_at 转换为毫秒时间戳
+        v2: 补齐消息UID并建立唯一索引
+        """
+        if not self.exists():
+            return
+        try:
+            with sqlite3.connect(self.archive_path) as conn:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version >= self.SCHEMA_VERSION:
+                    return
+                has_table = conn.execute("""
+                    SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_messages'
+                """).fetchone() is not None
+                if has_table and version < 1:
+                    conn.execute(epoch_ms_update_sql('chat_messages'))
+                if has_table and version < 2:
+                    columns = {row[1] for row in conn.execute("PRAGMA table_info(chat_messages)")}
+                    if 'message_uid' not in columns:
+                        conn.execute("ALTER TABLE chat_messages ADD COLUMN message_uid TEXT")
+                    conn.execute(f"""
+                        UPDATE chat_messages SET message_uid = {RANDOM_UID_SQL}
+                        WHERE message_uid IS NULL
+                    """)
+                    conn.execute("""
+                        CREATE UNIQUE INDEX IF NOT EXISTS idx_archive_message_uid
+                        ON chat_messages(message_uid) WHERE message_uid IS NOT NULL
+                    """)
+                conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+                conn.commit()
+        except Exception as e:
+            print(f"升级归档数据库失败: {e}")
+
+    def _select_candidates(self, conn: sqlite3.Connection, policy: ArchivePolicy) -> List[int]:
+        """按策略挑选一批需要归档的消息ID（最旧的优先）"""
+        limit = policy.batch_size
+        ids = []
+
+        if policy.max_age_days is not None:
+            cutoff = to_epoch_ms(datetime.now() - timedelta(days=policy.max_age_days))
+            synced = "" if policy.archive_unsynced else "AND sync_status != 'local'"
+            ids.extend(row[0] for row in conn.execute(f"""
+                SELECT id FROM main.chat_messages
+                WHERE created_at < ? AND is_read = 1 {synced}
+                ORDER BY id
+                LIMIT ?
+            """, (cutoff, limit)))
+
+        if policy.keep_per_conversation is not None and len(ids) < limit:
+            oversized = conn.execute("""
+                SELECT conversation_key FROM main.chat_messages
+                WHERE conversation_key IS NOT NULL
+                GROUP BY conversation_key
+                HAVING COUNT(*) > ?
+            """, (policy.keep_per_conversation,)).fetchall()
+
+            for (key,) in oversized:
+                # 毫秒时间戳可能相同，以(created_at, id)确定先后
+                boundary = conn.execute("""
+                    SELECT created_at, id FROM main.chat_messages
+                    WHERE conversation_key = ?
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT 1 OFFSET ?
+                """, (key, policy.keep_per_conversation)).fetchone()
+                if boundary is None:
+                    continue
+                ids.extend(row[0] for row in conn.execute("""
+                    SELECT id FROM main.chat_messages
+                    WHERE conversation_key = ? AND is_read = 1 AND sync_status != 'local'
+                      AND (created_at < ? OR (created_at = ? AND id <= ?))
+                    ORDER BY created_at, id
+                    LIMIT ?
+                """, (key, boundary[0], boundary[0], boundary[1], limit - len(ids))))
+                if len(ids) >= limit:
+                    break
+
+        return sorted(set(ids))[:limit]
+
+    def archive_step(self, policy: ArchivePolicy) -> int:
+        """执行一步归档
+
+        先在冷库中提交副本，再从热库删除。两步各自是一个短事务，
+        中途崩溃时下一步会重新复制（按ID去重）并完成删除，不会丢失消息。
+
+        Returns:
+            本步移动的消息数
+        """
+        conn = self._connect()
+        try:
+            columns = self._ensure_schema(conn)
+            ids = self._select_candidates(conn, policy)
+            if not ids:
+                return 0
+
+            column_list = ', '.join(columns)
+            placeholders = ', '.join('?' * len(ids))
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO archive.chat_messages ({column_list})
+                    SELECT {column_list} FROM main.chat_messages WHERE id IN ({placeholders})
+                """, ids)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(f"DELETE FROM main.chat_messages WHERE id IN ({placeholders})", ids)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            return len(ids)
+        finally:
+            conn.close()
+
+    def get_conversation_history(self, key: str, limit: int, offset: int = 0) -> List[ChatMessage]:
+        """从冷库按时间倒序读取会话消息"""
+        if not self.exists() or limit <= 0:
+            return []
+        try:
+            with sqlite3.connect(self.archive_path) as conn:
+                cursor = conn.execute(f"""
+                    SELECT {ChatMessage.COLUMNS}
+                    FROM chat_messages
+                    WHERE conversation_key = ?
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ? OFFSET ?
+                """, (key, limit, offset))
+                return [ChatMessage.from_row(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"读取归档聊天记录失败: {e}")
+            return []
+
+    def get_message_page(self, key: str, created_at: int, message_id: int, older: bool,
+                         limit: int) -> List[ChatMessage]:
+        """从冷库读取 (created_at, id) 游标之前或之后的一页会话消息（按时间正序）"""
+        if not self.exists() or limit <= 0:
+            return []
+        try:
+            with sqlite3.connect(self.archive_path) as conn:
+                return query_message_page(conn, "conversation_key = ?", (key,), created_at,
+                                          message_id, older, limit)
+        except Exception as e:
+            print(f"读取归档聊天记录失败: {e}")
+            return []
+    
+    def delete_conversation(self, key: str):
+        """删除冷库中的会话消息"""
+        if not self.exists():
+            return
+        try:
+            with sqlite3.connect(self.archive_path) as conn:
+                conn.execute("DELETE FROM chat_messages WHERE conversation_key = ?", (key,))
+                conn.commit()
+        except Exception as e:
+            print(f"删除归档聊天记录失败: {e}")
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """回收冷库的空闲页"""
+        if not self.exists():
+            return 0
+        return incremental_vacuum(self.archive_path, pages)
+
+def query_message_page(conn: sqlite3.Connection, where: str, params: tuple, created_at: int,
+                       message_id: int, older: bool, limit: int,
+                       created_at_sql: str = 'created_at') -> List[ChatMessage]:
+    """按 (created_at, id) 游标分页查询会话消息（键集分页，代价与翻页深度无关）
+
+    Args:
+        conn: 数据库连接
+        where: 会话查询条件
+        params: 会话查询条件的参数
+        created_at: 游标消息的创建时间
+        message_id: 游标消息的ID
+        older: True读取游标之前的消息，False读取之后的消息
+        limit: 消息数量限制
+        created_at_sql: 消息时间的查询表达式（见 ChatDatabase._created_at_sql）
+
+    Returns:
+        按时间正序排列的消息
+    """
+    if older:
+        condition, order = f"({created_at_sql}, id) < (?, ?)", "DESC"
+    else:
+        condition, order = f"({created_at_sql}, id) > (?, ?)", "ASC"
+    cursor = conn.execute(f"""
+        SELECT {ChatMessage.COLUMNS}
+        FROM chat_messages
+        WHERE {where} AND {condition}
+        ORDER BY {created_at_sql} {order}, id {order}
+        LIMIT ?
+    """, params + (created_at, message_id, limit))
+    messages = [ChatMessage.from_row(row) for row in cursor.fetchall()]
+    return list(reversed(messages)) if older else messages
+
+def incremental_vacuum(db_path: str, pages: int) -> int:
+    """按小步回收数据库空闲页
+
+    只处理创建时已启用 auto_vacuum=INCREMENTAL 的数据库；旧数据库保持原样，
+    切换需要整体 VACUUM 重写文件，不适合在空闲维护中自动进行。
+
+    Args:
+        db_path: 数据库文件路径
+        pages: 本步最多回收的页数
+
+    Returns:
+        回收的页数
+    """
+    conn = sqlite3.connect(db_path, timeout=10, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if before == 0:
+            return 0
+        # executescript会把PRAGMA执行到底；execute只走一步，只回收一页
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return before - after
+    finally:
+        conn.close()
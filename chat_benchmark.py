@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天数据库性能基准
+在临时目录中生成指定规模的合成聊天数据，测量 ChatDatabase 各主要操作的延迟分布；
+另有存储格式对比（旧的ISO字符串+字典行 与 当前的毫秒时间戳+紧凑记录），
+以及打开会话的渲染耗时对比（旧的每条消息一组控件 与 当前的模型/视图）。
+不需要显示器，数据库不使用 QStandardPaths 下的应用数据目录。
+
+用法：
+    python chat_benchmark.py suite [--users 50] [--conversations 200] [--messages 100000]
+                                   [--iterations 50] [--json report.json] [--keep DIR]
+    python chat_benchmark.py formats [--messages 10000] [--repeat 5]
+    python chat_benchmark.py render [--messages 500] [--repeat 5]
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# 渲染对比需要创建控件，保证在没有显示器的环境中也不会尝试连接
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chat_database import ChatDatabase, conversation_key
+from chat_message import ChatMessage, to_epoch_ms
+
+# ---- 合成数据 ----
+
+WORDS = ['你好', '在吗', '今天', '明天', '吃饭', '开会', '周末', '电影', '好的', '收到',
+         '哈哈', '谢谢', '晚安', '早上好', '下班', '项目', '文档', '图片', '链接', '没问题']
+SEARCH_KEYWORD = '稀有关键词'
+
+class SyntheticDataset:
+    """合成聊天数据
+
+    会话之间的消息量按 1/排名 分布（少数会话很长、多数很短），
+    时间戳在 days 天内递增，最近一小部分消息保持未读。
+    """
+
+    def __init__(self, users: int, conversations: int, messages: int, days: int = 365,
+                 unread_ratio: float = 0.01, seed: int = 42):
+        self.users = [f'user{i:05d}' for i in range(max(users, 2))]
+        self.messages = messages
+        self.days = days
+        self.unread_ratio = unread_ratio
+        self.random = random.Random(seed)
+
+        pairs = set()
+        max_pairs = len(self.users) * (len(self.users) - 1) // 2
+        while len(pairs) < min(conversations, max_pairs):
+            a, b = self.random.sample(self.users, 2)
+            pairs.add(tuple(sorted((a, b))))
+        self.conversations: List[Tuple[str, str]] = sorted(pairs)
+        self.random.shuffle(self.conversations)
+        self.weights = [1.0 / (rank + 1) for rank in range(len(self.conversations))]
+
+    @property
+    def busiest(self) -> Tuple[str, str]:
+        """消息最多的会话"""
+        return self.conversations[0]
+
+    def rows(self) -> Iterator[tuple]:
+        """逐行生成 (sender, receiver, content, message_type, created_at, is_read, conversation_key)"""
+        end = int(time.time() * 1000)
+        start = end - self.days * 86400 * 1000
+        step = max((end - start) // max(self.messages, 1), 1)
+        unread_from = int(self.messages * (1 - self.unread_ratio))
+        choose = self.random.choices
+        for i in range(self.messages):
+            a, b = choose(self.conversations, self.weights)[0]
+            sender, receiver = (a, b) if self.random.random() < 0.5 else (b, a)
+            words = choose(WORDS, k=self.random.randint(2, 12))
+            if self.random.random() < 0.001:
+                words.append(SEARCH_KEYWORD)
+            yield (sender, receiver, ' '.join(words), 'text', start + i * step,
+                   0 if i >= unread_from else 1, conversation_key(sender, receiver))
+
+def generate_database(path: str, dataset: SyntheticDataset, batch_size: int = 50000) -> ChatDatabase:
+    """在path生成数据库并写入合成数据（每批一个事务）"""
+    db = ChatDatabase(db_path=path)
+    db.migrator.wait_for_backfills(timeout=60)
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA synchronous = OFF")
+        rows = dataset.rows()
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            conn.execute("BEGIN")
+            conn.executemany("""
+                INSERT INTO chat_messages (sender_id, receiver_id, content, message_type, created_at,
+                                           is_read, conversation_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, batch)
+            conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    return db
+
+# ---- 统计 ----
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    values = sorted(samples)
+    return {
+        'count': len(values),
+        'mean_ms': round(statistics.fmean(values), 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 50), 3),
+        'p90_ms': round(percentile(values, 90), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3) if values else 0.0,
+    }
+
+def time_calls(func: Callable[[], Any], iterations: int, setup: Callable[[], Any] = None) -> List[float]:
+    """多次调用func，返回每次的耗时（毫秒）；setup在每次调用前执行且不计时"""
+    samples = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+# ---- 基准套件 ----
+
+def run_suite(db: ChatDatabase, dataset: SyntheticDataset, iterations: int = 50,
+              depths: Tuple[int, ...] = (0, 1000, 10000), burst_size: int = 100) -> Dict[str, Dict[str, float]]:
+    """对已生成的数据库执行各项测量"""
+    user, friend = dataset.busiest
+    results = {}
+
+    for depth in depths:
+        results[f'get_conversation_history@{depth}'] = summarize(time_calls(
+            lambda: db.get_conversation_history(user, friend, limit=50, offset=depth), iterations))
+
+    results['get_recent_conversations'] = summarize(time_calls(
+        lambda: db.get_recent_conversations(user, limit=20), iterations))
+
+    results['get_unread_count'] = summarize(time_calls(
+        lambda: db.get_unread_count(user), iterations))
+
+    # 每次先写入一批未读消息，再计时标记已读
+    def add_unread():
+        for i in range(20):
+            db.save_message(friend, user, f'未读{i}')
+    results['mark_messages_as_read'] = summarize(time_calls(
+        lambda: db.mark_messages_as_read(friend, user), iterations, setup=add_unread))
+
+    results['search_messages'] = summarize(time_calls(
+        lambda: db.search_messages(user, SEARCH_KEYWORD, limit=50), iterations))
+
+    def save_burst():
+        for i in range(burst_size):
+            db.save_message(user, friend, f'连发{i}')
+    results[f'save_message_burst_{burst_size}'] = summarize(time_calls(
+        save_burst, max(iterations // 10, 3)))
+
+    def save_burst_async():
+        for i in range(burst_size):
+            db.save_message_async(user, friend, f'连发{i}')
+        db.flush_writes(timeout=30)
+    results[f'save_message_async_burst_{burst_size}'] = summarize(time_calls(
+        save_burst_async, max(iterations // 10, 3)))
+
+    return results
+
+def benchmark(users: int, conversations: int, messages: int, iterations: int = 50,
+              keep_dir: str = None, seed: int = 42) -> Dict[str, Any]:
+    """生成数据并运行基准套件，返回报告"""
+    dataset = SyntheticDataset(users, conversations, messages, seed=seed)
+    tmp = None
+    if keep_dir:
+        os.makedirs(keep_dir, exist_ok=True)
+        directory = keep_dir
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        directory = tmp.name
+
+    try:
+        path = os.path.join(directory, 'chat.db')
+        if os.path.exists(path):
+            raise FileExistsError(f"{path} 已存在")
+
+        start = time.perf_counter()
+        db = generate_database(path, dataset)
+        generate_seconds = time.perf_counter() - start
+
+        with sqlite3.connect(path) as conn:
+            busiest_count = conn.execute(
+                "SELECT COUNT(*) FROM chat_messages WHERE conversation_key = ?",
+                (conversation_key(*dataset.busiest),)
+            ).fetchone()[0]
+
+        try:
+            results = run_suite(db, dataset, iterations)
+        finally:
+            db.close()
+
+        return {
+            'config': {
+                'users': len(dataset.users),
+                'conversations': len(dataset.conversations),
+                'messages': messages,
+                'iterations': iterations,
+                'seed': seed,
+            },
+            'dataset': {
+                'path': path if keep_dir else None,
+                'db_size_bytes': os.path.getsize(path),
+                'generate_seconds': round(generate_seconds, 2),
+                'busiest_conversation_messages': busiest_count,
+            },
+            'environment': {
+                'python': sys.version.split()[0],
+                'sqlite': sqlite3.sqlite_version,
+                'platform': sys.platform,
+            },
+            'results': results,
+        }
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+def print_report(report: Dict[str, Any]):
+    config, dataset = report['config'], report['dataset']
+    print(f"用户 {config['users']}，会话 {config['conversations']}，消息 {config['messages']}，"
+          f"生成耗时 {dataset['generate_seconds']}s，数据库 {dataset['db_size_bytes'] / 1048576:.1f}MB")
+    print(f"{'操作':<36}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  (ms)")
+    for name, result in report['results'].items():
+        print(f"{name:<36}{result['p50_ms']:>10.2f}{result['p90_ms']:>10.2f}"
+              f"{result['p99_ms']:>10.2f}{result['max_ms']:>10.2f}")
+
+# ---- 存储格式对比 ----
+
+def make_rows(count: int) -> List[tuple]:
+    """生成测试消息：(sender_id, receiver_id, content, created_at)"""
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    rows = []
+    for i in range(count):
+        sender, receiver = ('me', 'friend') if i % 2 else ('friend', 'me')
+        rows.append((sender, receiver, f'第{i}条测试消息，内容长度大致接近日常聊天',
+                     start + timedelta(seconds=i * 7, microseconds=i * 137)))
+    return rows
+
+def create_legacy_db(path: str, rows: List[tuple]):
+    """按旧格式建库：created_at 为ISO字符串"""
+    with sqlite3.connect(path) as conn:
+        conn.execute("""
+            CREATE TABLE chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender_id TEXT NOT NULL,
+                receiver_id TEXT NOT NULL,
+                content TEXT NOT NULL,
+                message_type TEXT DEFAULT 'text',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_read BOOLEAN DEFAULT 0,
+                sync_status TEXT DEFAULT 'local',
+                conversation_key TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX idx_legacy_conversation_key ON chat_messages(conversation_key, created_at)")
+        conn.executemany("""
+            INSERT INTO chat_messages (sender_id, receiver_id, content, created_at, conversation_key)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(s, r, c, t.isoformat(), conversation_key(s, r)) for s, r, c, t in rows])
+
+def create_current_db(path: str, rows: List[tuple]) -> ChatDatabase:
+    """按当前格式建库：created_at 为毫秒时间戳"""
+    db = ChatDatabase(db_path=path)
+    db.migrator.wait_for_backfills(timeout=30)
+    with sqlite3.connect(path) as conn:
+        conn.executemany("""
+            INSERT INTO chat_messages (sender_id, receiver_id, content, created_at, conversation_key)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(s, r, c, to_epoch_ms(t), conversation_key(s, r)) for s, r, c, t in rows])
+    return db
+
+def load_legacy(path: str, limit: int) -> List[Dict[str, Any]]:
+    """旧格式的读取路径：每行一个字典，显示时逐条解析时间"""
+    with sqlite3.connect(path) as conn:
+        cursor = conn.execute("""
+            SELECT id, sender_id, receiver_id, content, message_type, created_at, is_read
+            FROM chat_messages
+            WHERE conversation_key = ?
+            ORDER BY created_at DESC
+            LIMIT ?
+        """, (conversation_key('me', 'friend'), limit))
+        messages = [{
+            'id': row[0],
+            'sender_id': row[1],
+            'receiver_id': row[2],
+            'content': row[3],
+            'message_type': row[4],
+            'created_at': row[5],
+            'is_read': bool(row[6])
+        } for row in cursor.fetchall()]
+    messages.reverse()
+    for message in messages:
+        datetime.fromisoformat(message['created_at']).strftime("%H:%M")
+    return messages
+
+def load_current(db: ChatDatabase, limit: int) -> List[ChatMessage]:
+    """当前的读取路径：紧凑记录，时间文本按需格式化并缓存"""
+    messages = db.get_conversation_history('me', 'friend', limit=limit)
+    for message in messages:
+        message.time_text
+    return messages
+
+def measure(loader: Callable[[], list], repeat: int) -> Dict[str, float]:
+    """测量耗时（中位数/最小值）和结果占用的内存"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        loader()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    result = loader()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+
+    return {
+        'median_ms': statistics.median(timings),
+        'min_ms': min(timings),
+        'retained_kb': retained / 1024,
+    }
+
+def run_formats(count: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    rows = make_rows(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        create_legacy_db(legacy_path, rows)
+        db = create_current_db(os.path.join(tmp, 'chat.db'), rows)
+
+        results = {
+            'legacy': measure(lambda: load_legacy(legacy_path, count), repeat),
+            'current': measure(lambda: load_current(db, count), repeat),
+        }
+        db.close()
+        return results
+
+# ---- 打开会话的渲染耗时 ----
+
+def make_conversation(count: int) -> List[ChatMessage]:
+    """生成一个会话的消息记录（双方交替发送，约三分之一已读）"""
+    return [ChatMessage(i + 1, s, r, c, created_at=to_epoch_ms(t), is_read=i % 3 == 0,
+                        message_uid=f'bench-{i}')
+            for i, (s, r, c, t) in enumerate(make_rows(count))]
+
+def open_legacy(messages: List[ChatMessage], width: int, height: int):
+    """旧的渲染方式：每条消息一组控件，每个气泡单独设置并解析样式表"""
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtWidgets import QFrame, QHBoxLayout, QLabel, QScrollArea, QVBoxLayout, QWidget
+
+    scroll = QScrollArea()
+    scroll.setWidgetResizable(True)
+    scroll.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+    container = QWidget()
+    layout = QVBoxLayout(container)
+    layout.setSpacing(8)
+    layout.addStretch()
+    scroll.setWidget(container)
+    scroll.resize(width, height)
+
+    for message in messages:
+        is_sent = message.sender_id == 'me'
+        bubble = QFrame()
+        bubble_layout = QVBoxLayout(bubble)
+        bubble_layout.setContentsMargins(5, 5, 5, 5)
+        bubble_layout.setSpacing(2)
+        content_label = QLabel(message.content)
+        content_label.setWordWrap(True)
+        content_label.setStyleSheet("""
+            QLabel {
+                padding: 8px 12px;
+                border-radius: 12px;
+                font-size: 12px;
+                line-height: 1.4;
+            }
+        """)
+        time_text = message.time_text + (" 已读" if is_sent and message.is_read else "")
+        time_label = QLabel(time_text)
+        time_label.setStyleSheet("font-size: 10px; color: #95a5a6;")
+        if is_sent:
+            content_label.setStyleSheet(content_label.styleSheet() + """
+                QLabel {
+                    background-color: #4CAF50;
+                    color: white;
+                }
+            """)
+        else:
+            content_label.setStyleSheet(content_label.styleSheet() + """
+                QLabel {
+                    background-color: white;
+                    color: #333333;
+                    border: 1px solid #e9ecef;
+                }
+            """)
+        time_label.setAlignment(Qt.AlignRight if is_sent else Qt.AlignLeft)
+        bubble_layout.addWidget(content_label)
+        bubble_layout.addWidget(time_label)
+        bubble.setStyleSheet("background: transparent;")
+        content_label.setMaximumWidth(300)
+
+        row = QWidget()
+        row_layout = QHBoxLayout(row)
+        row_layout.setContentsMargins(0, 0, 0, 0)
+        if is_sent:
+            row_layout.addStretch()
+            row_layout.addWidget(bubble)
+        else:
+            row_layout.addWidget(bubble)
+            row_layout.addStretch()
+        layout.insertWidget(layout.count() - 1, row)
+
+    scroll.show()
+    scroll.verticalScrollBar().setValue(scroll.verticalScrollBar().maximum())
+    return scroll
+
+def open_current(messages: List[ChatMessage], width: int, height: int):
+    """当前的渲染方式：模型/视图，委托共用预先生成的画笔并缓存文本排版"""
+    from chat_view import create_message_view
+
+    view, model = create_message_view('me')
+    view.resize(width, height)
+    model.set_messages(messages)
+    view.show()
+    view.scrollToBottom()
+    return view
+
+def measure_open(opener: Callable[[List[ChatMessage], int, int], Any], messages: List[ChatMessage],
+                 repeat: int, width: int = 380, height: int = 400) -> Dict[str, float]:
+    """测量从创建到第一次绘制完成的耗时（每次使用新的控件）"""
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication.instance()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        widget = opener(messages, width, height)
+        app.processEvents()
+        widget.grab()
+        timings.append((time.perf_counter() - start) * 1000)
+        widget.close()
+        widget.deleteLater()
+        app.processEvents()
+    return {
+        'median_ms': statistics.median(timings),
+        'min_ms': min(timings),
+    }
+
+def run_render(count: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    """对比打开一个 count 条消息的会话在两种渲染方式下的耗时"""
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication([sys.argv[0]])
+    messages = make_conversation(count)
+    # 预热字体和样式，避免第一次测量包含一次性的初始化
+    measure_open(open_current, messages[:10], 1)
+    measure_open(open_legacy, messages[:10], 1)
+    return {
+        'legacy': measure_open(open_legacy, messages, repeat),
+        'current': measure_open(open_current, messages, repeat),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天数据库性能基准')
+    subparsers = parser.add_subparsers(dest='command')
+
+    suite_parser = subparsers.add_parser('suite', help='合成数据上的操作延迟')
+    suite_parser.add_argument('--users', type=int, default=50, help='用户数')
+    suite_parser.add_argument('--conversations', type=int, default=200, help='会话数')
+    suite_parser.add_argument('--messages', type=int, default=100000, help='消息总数')
+    suite_parser.add_argument('--iterations', type=int, default=50, help='每项操作的测量次数')
+    suite_parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    suite_parser.add_argument('--json', help='JSON报告输出路径')
+    suite_parser.add_argument('--keep', help='在该目录生成并保留数据库（默认使用临时目录）')
+
+    formats_parser = subparsers.add_parser('formats', help='存储格式对比')
+    formats_parser.add_argument('--messages', type=int, default=10000, help='会话中的消息数')
+    formats_parser.add_argument('--repeat', type=int, default=5, help='每种格式重复加载的次数')
+
+    render_parser = subparsers.add_parser('render', help='打开会话的渲染耗时对比')
+    render_parser.add_argument('--messages', type=int, default=500, help='会话中的消息数')
+    render_parser.add_argument('--repeat', type=int, default=5, help='每种方式重复打开的次数')
+
+    args = parser.parse_args()
+
+    if args.command == 'render':
+        results = run_render(args.messages, args.repeat)
+        print(f"打开 {args.messages} 条消息的会话（重复 {args.repeat} 次）")
+        print(f"{'方式':<10}{'中位数(ms)':>14}{'最小值(ms)':>14}")
+        for name, result in results.items():
+            print(f"{name:<10}{result['median_ms']:>14.1f}{result['min_ms']:>14.1f}")
+        print(f"耗时比: {results['current']['median_ms'] / results['legacy']['median_ms']:.2f}x")
+        return
+
+    if args.command == 'formats':
+        results = run_formats(args.messages, args.repeat)
+        print(f"加载 {args.messages} 条消息（重复 {args.repeat} 次）")
+        print(f"{'格式':<10}{'中位数(ms)':>14}{'最小值(ms)':>14}{'结果内存(KB)':>16}")
+        for name, result in results.items():
+            print(f"{name:<10}{result['median_ms']:>14.1f}{result['min_ms']:>14.1f}{result['retained_kb']:>16.0f}")
+
+        legacy, current = results['legacy'], results['current']
+        print(f"耗时比: {current['median_ms'] / legacy['median_ms']:.2f}x，"
+              f"内存比: {current['retained_kb'] / legacy['retained_kb']:.2f}x")
+        return
+
+    if args.command != 'suite':
+        parser.print_help()
+        return
+
+    report = benchmark(args.users, args.conversations, args.messages, args.iterations,
+                       keep_dir=args.keep, seed=args.seed)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"JSON报告已写入 {args.json}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天会话内存缓存模块
+为每个会话在内存中保存最近N条消息（环形缓冲区），只在第一次访问时从SQLite加载（或登录、
+悬停好友时提前预取），之后随数据库的写入通知原地更新；聊天窗口、未读数和最近会话列表都从内存读取
+"""
+
+import sys
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+from PyQt5.QtCore import QObject, pyqtSignal
+from chat_database import (CONVERSATION_DELETED, MESSAGES_ADDED, MESSAGES_READ, MESSAGES_REMOVED,
+                           MESSAGES_RESET, chat_db, conversation_key)
+from chat_message import ChatMessage
+
+def _order_key(message: ChatMessage):
+    """消息在会话中的排序键（与数据库查询的 created_at, id 一致）"""
+    return (message.created_at, message.id or 0)
+
+# 估算内存占用时每条消息记录本身（不含内容文本）的字节数
+MESSAGE_OVERHEAD_BYTES = 300
+
+def _message_bytes(message: ChatMessage) -> int:
+    """估算一条消息在缓存中占用的字节数"""
+    return MESSAGE_OVERHEAD_BYTES + sys.getsizeof(message.content)
+
+class ConversationCache(QObject):
+    """所有聊天窗口共享的会话缓存
+
+    数据库写入通知可能来自后台写线程或同步线程，内部状态由锁保护；
+    变更信号跨线程发出时会排队到接收者所在的线程。
+    """
+
+    conversation_updated = pyqtSignal(str)  # 会话消息变化信号(会话键)
+    unread_changed = pyqtSignal(str)        # 未读数变化信号(接收者ID)
+
+    def __init__(self, database, capacity: int = 200, conversation_limit: int = 50,
+                 memory_budget: int = 8 * 1024 * 1024):
+        """
+        Args:
+            database: ChatDatabase 实例
+            capacity: 每个会话缓存的最近消息数
+            conversation_limit: 每个用户缓存的最近会话数
+            memory_budget: 会话消息缓存的内存预算（估算字节数），超出时淘汰最久未访问的会话
+        """
+        super().__init__()
+        self.database = database
+        self.capacity = capacity
+        self.conversation_limit = conversation_limit
+        self.memory_budget = memory_budget
+
+        self._lock = threading.RLock()
+        self._buffers: 'OrderedDict[str, Deque[ChatMessage]]' = OrderedDict()
+        self._unread: Dict[str, Dict[str, int]] = {}
+        self._unread_snapshot_ids: Dict[str, int] = {}
+        self._conversations: Dict[str, List[Dict[str, Any]]] = {}
+
+        database.add_listener(self._on_database_event)
+
+    def get_recent(self, user1_id: str, user2_id: str, limit: int = 50) -> List[ChatMessage]:
+        """获取会话最近的消息（按时间升序）
+
+        Args:
+            user1_id: 用户1 ID
+            user2_id: 用户2 ID
+            limit: 消息数量，超过缓存容量时直接查询数据库
+
+        Returns:
+            消息列表
+        """
+        if limit > self.capacity:
+            return self.database.get_conversation_history(user1_id, user2_id, limit=limit)
+
+        with self._lock:
+            buffer = self._load_buffer(user1_id, user2_id)
+            messages = list(buffer)
+        return messages[-limit:] if limit else []
+
+    def peek_recent(self, user1_id: str, user2_id: str, limit: int = 50) -> Optional[List[ChatMessage]]:
+        """只从内存获取会话最近的消息，会话未缓存时返回None（不访问数据库）"""
+        if limit > self.capacity:
+            return None
+        with self._lock:
+            key = conversation_key(user1_id, user2_id)
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                return None
+            self._buffers.move_to_end(key)
+            messages = list(buffer)
+        return messages[-limit:] if limit else []
+
+    def prefetch(self, user1_id: str, user2_id: str) -> bool:
+        """预先把会话加载到内存
+
+        Returns:
+            是否从数据库加载（已缓存时返回False）
+        """
+        with self._lock:
+            if conversation_key(user1_id, user2_id) in self._buffers:
+                return False
+            self._load_buffer(user1_id, user2_id)
+            return True
+
+    def prefetch_recent_conversations(self, user_id: str, count: int = 10) -> int:
+        """预先加载用户最近活跃的会话，预算不足时提前停止
+
+        Returns:
+            从数据库加载的会话数
+        """
+        loaded = 0
+        for conversation in self.get_recent_conversations(user_id, count):
+            if self.memory_usage() >= self.memory_budget:
+                break
+            if self.prefetch(user_id, conversation['other_user_id']):
+                loaded += 1
+        return loaded
+
+    def memory_usage(self) -> int:
+        """会话消息缓存的估算内存占用（字节）"""
+        with self._lock:
+            return sum(_message_bytes(m) for buffer in self._buffers.values() for m in buffer)
+
+    def get_unread_counts(self, receiver_id: str) -> Dict[str, int]:
+        """获取用户来自每个发送者的未读消息数量"""
+        with self._lock:
+            return dict(self._load_unread(receiver_id))
+
+    def get_unread_count(self, receiver_id: str) -> int:
+        """获取用户的未读消息总数"""
+        with self._lock:
+            return sum(self._load_unread(receiver_id).values())
+
+    def get_recent_conversations(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """获取用户的最近聊天会话（格式同 ChatDatabase.get_recent_conversations）"""
+        if limit > self.conversation_limit:
+            return self.database.get_recent_conversations(user_id, limit)
+
+        with self._lock:
+            conversations = self._conversations.get(user_id)
+            if conversations is None:
+                conversations = [
+                    {k: v for k, v in c.items() if k != 'unread_count'}
+                    for c in self.database.get_recent_conversations(user_id, self.conversation_limit)
+                ]
+                self._conversations[user_id] = conversations
+
+            unread = self._load_unread(user_id)
+            return [dict(c, unread_count=unread.get(c['other_user_id'], 0))
+                    for c in conversations[:limit]]
+
+    def invalidate(self, user1_id: str, user2_id: str):
+        """丢弃一个会话的缓存，下次访问时重新加载"""
+        with self._lock:
+            self._buffers.pop(conversation_key(user1_id, user2_id), None)
+
+    def clear(self):
+        """清空全部缓存（如退出登录时）"""
+        with self._lock:
+            self._buffers.clear()
+            self._unread.clear()
+            self._unread_snapshot_ids.clear()
+            self._conversations.clear()
+
+    def _load_buffer(self, user1_id: str, user2_id: str) -> Deque[ChatMessage]:
+        """获取会话的缓冲区，未缓存时从数据库加载（调用方持有锁）"""
+        key = conversation_key(user1_id, user2_id)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            # 持锁加载：加载期间到达的写入通知会在加载完成后再应用
+            messages = self.database.get_conversation_history(user1_id, user2_id, limit=self.capacity)
+            buffer = deque(messages, maxlen=self.capacity)
+            self._buffers[key] = buffer
+            self._enforce_budget()
+        else:
+            self._buffers.move_to_end(key)
+        return buffer
+
+    def _enforce_budget(self):
+        """超出内存预算时淘汰最久未访问的会话，最近访问的会话总是保留（调用方持有锁）"""
+        usage = self.memory_usage()
+        while usage > self.memory_budget and len(self._buffers) > 1:
+            _, buffer = self._buffers.popitem(last=False)
+            usage -= sum(_message_bytes(m) for m in buffer)
+
+    def _load_unread(self, receiver_id: str) -> Dict[str, int]:
+        """获取用户的未读数，未缓存时从数据库加载（调用方持有锁）
+
+        写线程在加载之后才投递的写入通知可能已经包含在快照里，
+        因此同时记下快照时的最大消息ID，不大于它的新消息不再累加。
+        """
+        counts = self._unread.get(receiver_id)
+        if counts is None:
+            counts, snapshot_id = self.database.get_unread_snapshot(receiver_id)
+            self._unread[receiver_id] = counts
+            self._unread_snapshot_ids[receiver_id] = snapshot_id
+        return counts
+
+    def _on_database_event(self, event: str, payload: Any):
+        """处理数据库写入通知"""
+        updated_keys = set()
+        unread_users = set()
+
+        with self._lock:
+            if event == MESSAGES_ADDED:
+                for message in payload:
+                    key = conversation_key(message.sender_id, message.receiver_id)
+                    # 未缓存（或已因内存预算被淘汰）的会话同样通知，打开的窗口会重新加载
+                    if key not in self._buffers or self._add_to_buffer(key, message):
+                        updated_keys.add(key)
+                    if (not message.is_read and message.receiver_id in self._unread
+                            and (message.id is None
+                                 or message.id > self._unread_snapshot_ids.get(message.receiver_id, 0))):
+                        counts = self._unread[message.receiver_id]
+                        counts[message.sender_id] = counts.get(message.sender_id, 0) + 1
+                        unread_users.add(message.receiver_id)
+                    self._update_conversations(message)
+
+            elif event == MESSAGES_READ:
+                sender_id, receiver_id, up_to_id, remaining = payload
+                key = conversation_key(sender_id, receiver_id)
+                for message in self._buffers.get(key, ()):
+                    if message.sender_id == sender_id and message.receiver_id == receiver_id and (
+                            up_to_id is None or (message.id is not None and message.id <= up_to_id)):
+                        message.is_read = True
+                counts = self._unread.get(receiver_id)
+                if counts is not None and counts.get(sender_id, 0) != remaining:
+                    if remaining:
+                        counts[sender_id] = remaining
+                    else:
+                        counts.pop(sender_id, None)
+                    unread_users.add(receiver_id)
+
+            elif event == CONVERSATION_DELETED:
+                user1_id, user2_id = payload
+                key = conversation_key(user1_id, user2_id)
+                if self._buffers.pop(key, None) is not None:
+                    updated_keys.add(key)
+                for receiver_id, sender_id in ((user1_id, user2_id), (user2_id, user1_id)):
+                    counts = self._unread.get(receiver_id)
+                    if counts is not None and counts.pop(sender_id, None):
+                        unread_users.add(receiver_id)
+                    conversations = self._conversations.get(receiver_id)
+                    if conversations is not None:
+                        conversations[:] = [c for c in conversations if c['other_user_id'] != sender_id]
+
+            elif event == MESSAGES_REMOVED:
+                # 保留策略只清理已读消息，未读数不受影响
+                updated_keys.update(self._buffers)
+                self._buffers.clear()
+                self._conversations.clear()
+
+            elif event == MESSAGES_RESET:
+                updated_keys.update(self._buffers)
+                unread_users.update(self._unread)
+                self.clear()
+
+        for key in updated_keys:
+            self.conversation_updated.emit(key)
+        for receiver_id in unread_users:
+            self.unread_changed.emit(receiver_id)
+
+    def _add_to_buffer(self, key: str, message: ChatMessage) -> bool:
+        """把新消息按时间顺序放入已缓存的会话（调用方持有锁）
+
+        Returns:
+            缓冲区是否变化
+        """
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            return False
+
+        for existing in buffer:
+            if existing.id == message.id or (
+                    message.message_uid and existing.message_uid == message.message_uid):
+                return False
+
+        order = _order_key(message)
+        if not buffer or _order_key(buffer[-1]) <= order:
+            buffer.append(message)
+            return True
+
+        # 乱序到达（如同步拉取到较早的消息）
+        if len(buffer) == buffer.maxlen and order < _order_key(buffer[0]):
+            return False
+        index = len(buffer)
+        while index > 0 and _order_key(buffer[index - 1]) > order:
+            index -= 1
+        if len(buffer) == buffer.maxlen:
+            buffer.popleft()
+            index -= 1
+        buffer.insert(index, message)
+        return True
+
+    def _update_conversations(self, message: ChatMessage):
+        """用新消息更新双方已缓存的最近会话列表（调用方持有锁）"""
+        for user_id, other_user_id in ((message.sender_id, message.receiver_id),
+                                       (message.receiver_id, message.sender_id)):
+            conversations = self._conversations.get(user_id)
+            if conversations is None:
+                continue
+
+            previous = next((c for c in conversations if c['other_user_id'] == other_user_id), None)
+            if previous is not None:
+                if previous['last_message_time'] > message.created_at:
+                    continue
+                conversations.remove(previous)
+
+            index = 0
+            while index < len(conversations) and conversations[index]['last_message_time'] > message.created_at:
+                index += 1
+            conversations.insert(index, {
+                'other_user_id': other_user_id,
+                'last_message': message.content,
+                'last_message_time': message.created_at,
+                'is_last_sent': message.sender_id == user_id
+            })
+            del conversations[self.conversation_limit:]
+
+# 全局会话缓存实例
+conversation_cache = ConversationCache(chat_db)
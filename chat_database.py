@@ -7,96 +7,579 @@
 
 import sqlite3
 import os
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
 from PyQt5.QtCore import QStandardPaths
+from chat_message import ChatMessage, new_message_uid, now_ms
+from chat_migrations import MIXED_CREATED_AT_SQL, ChatMigrator
+from chat_archive import ArchivePolicy, ChatArchive, incremental_vacuum, query_message_page
+
+def conversation_key(user1_id: str, user2_id: str) -> str:
+    """两个用户之间会话的键，与双方顺序无关"""
+    low, high = sorted((str(user1_id), str(user2_id)))
+    return f"{low}|{high}"
+
+# 消息UID已存在时忽略插入（重复到达的消息不产生新行）
+INSERT_MESSAGE_SQL = """
+    INSERT INTO chat_messages (sender_id, receiver_id, content, message_type, created_at,
+                               conversation_key, message_uid)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT DO NOTHING
+"""
+
+def insert_message(conn: sqlite3.Connection, row: tuple) -> Tuple[Optional[int], bool]:
+    """写入一条消息
+    
+    Args:
+        conn: 数据库连接
+        row: 按 INSERT_MESSAGE_SQL 列顺序排列的值，最后一项为消息UID
+        
+    Returns:
+        (消息ID, 是否新写入)；消息UID已存在时返回已有消息的ID
+    """
+    cursor = conn.execute(INSERT_MESSAGE_SQL, row)
+    if cursor.rowcount:
+        return cursor.lastrowid, True
+    existing = conn.execute("SELECT id FROM chat_messages WHERE message_uid = ?", (row[-1],)).fetchone()
+    return (existing[0] if existing else None), False
+
+def _message_from_insert_row(message_id: int, row: tuple) -> ChatMessage:
+    """由 INSERT_MESSAGE_SQL 的参数构造刚写入的（未读）消息记录"""
+    return ChatMessage(message_id, row[0], row[1], row[2], row[3], row[4], False, row[6])
+
+# 数据变更事件（见 ChatDatabase.add_listener）
+MESSAGES_ADDED = 'messages_added'              # 载荷：新写入的 ChatMessage 列表
+MESSAGES_READ = 'messages_read'                # 载荷：(发送者ID, 接收者ID, 已读到的消息ID或None表示全部, 剩余未读数)
+CONVERSATION_DELETED = 'conversation_deleted'  # 载荷：(用户1 ID, 用户2 ID)
+MESSAGES_REMOVED = 'messages_removed'          # 载荷：删除的消息数（保留策略清理）
+MESSAGES_RESET = 'messages_reset'              # 载荷：None（批量导入等无法逐条描述的变更）
+
+class RetentionPolicy:
+    """聊天记录保留策略
+    
+    超出任一限制的消息会被永久删除（热库和冷库都算在内，最旧的优先）：
+    - 早于 max_age_days 天
+    - 超出所在会话最新 max_per_conversation 条之外
+    - 热库与冷库实际占用的空间超过 max_db_bytes
+    未读消息和尚未同步到云端的消息始终保留（不使用云同步时自己发送的消息因此不会被清理，
+    可用 ArchivePolicy.archive_unsynced 把它们移到冷库）。所有限制默认关闭。
+    """
+    
+    def __init__(self, max_age_days: Optional[int] = None, max_per_conversation: Optional[int] = None,
+                 max_db_bytes: Optional[int] = None, batch_size: int = 500, batch_pause: float = 0.02):
+        """
+        Args:
+            max_age_days: 消息保留的最长天数，None表示不限
+            max_per_conversation: 每个会话保留的最新消息数，None表示不限
+            max_db_bytes: 数据库占用空间上限（字节），None表示不限
+            batch_size: 每个删除事务最多删除的消息数
+            batch_pause: 两批之间让出写锁的时间（秒）
+        """
+        self.max_age_days = max_age_days
+        self.max_per_conversation = max_per_conversation
+        self.max_db_bytes = max_db_bytes
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+    
+    def is_enabled(self) -> bool:
+        return any(limit is not None for limit in
+                   (self.max_age_days, self.max_per_conversation, self.max_db_bytes))
+
+class MessageWriteQueue:
+    """聊天消息写入队列
+    
+    由独立的写线程持有一个长连接，把短时间窗口内提交的多条消息合并到
+    同一个事务中提交（组提交），一次 fsync 即可落盘一批消息。
+    调用方通过返回的 Future 异步获得消息ID。
+    """
+    
+    def __init__(self, db_path: str, max_queue_size: int = 1000,
+                 batch_window: float = 0.01, max_batch_size: int = 200,
+                 on_written: Callable[[List[ChatMessage]], None] = None,
+                 local_write: Callable[[], ContextManager] = nullcontext):
+        """
+        初始化写入队列
+        
+        Args:
+            db_path: 数据库文件路径
+            max_queue_size: 队列最大长度，队列满时提交方会被短暂阻塞
+            batch_window: 组提交时间窗口（秒）
+            max_batch_size: 单个事务最多写入的消息数
+            on_written: 每批提交后在写线程中调用，参数为新写入的消息
+            local_write: 包裹每次提交的上下文（见 ChatDatabase.local_write）
+        """
+        self.db_path = db_path
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.on_written = on_written
+        self.local_write = local_write
+        
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        # 保证关闭后不会再有消息进入队列（否则其Future永远不会完成）
+        self._submit_lock = threading.Lock()
+        self.last_write_time = 0.0
+        self._thread = threading.Thread(target=self._run, name='ChatWriter', daemon=True)
+        self._thread.start()
+    
+    def submit(self, sender_id: str, receiver_id: str, content: str,
+               message_type: str = 'text', created_at: int = None,
+               message_uid: str = None, timeout: float = 1.0) -> Future:
+        """提交一条待写入的消息
+        
+        Args:
+            sender_id: 发送者ID
+            receiver_id: 接收者ID
+            content: 消息内容
+            message_type: 消息类型
+            created_at: 创建时间（毫秒时间戳），默认当前时间
+            message_uid: 消息UID，默认新生成
+            timeout: 队列满时最多等待的秒数
+            
+        Returns:
+            写入完成后结果为消息ID的Future；完成回调在写线程中执行，
+            只能通过Qt信号等线程安全的方式通知界面
+        """
+        future = Future()
+        row = (sender_id, receiver_id, content, message_type,
+               created_at or now_ms(),
+               conversation_key(sender_id, receiver_id),
+               message_uid or new_message_uid())
+        with self._submit_lock:
+            if self._closed:
+                future.set_exception(RuntimeError("写入队列已关闭"))
+                return future
+            try:
+                self._queue.put(('insert', row, future), timeout=timeout)
+            except queue.Full:
+                future.set_exception(RuntimeError("写入队列已满"))
+        return future
+    
+    def flush(self, timeout: float = 2.0) -> bool:
+        """等待此前提交的消息全部写入
+        
+        Args:
+            timeout: 最长等待秒数
+            
+        Returns:
+            是否在超时前完成
+        """
+        if not self._thread.is_alive():
+            return self._queue.empty()
+        
+        done = threading.Event()
+        try:
+            self._queue.put(('flush', None, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+    
+    def close(self, timeout: float = 2.0) -> bool:
+        """停止写线程，最多等待timeout秒把剩余消息写完
+        
+        Returns:
+            是否在超时前完全退出
+        """
+        deadline = time.monotonic() + timeout
+        with self._submit_lock:
+            if self._closed:
+                return not self._thread.is_alive()
+            self._closed = True
+            try:
+                self._queue.put(('stop', None, None), timeout=timeout)
+            except queue.Full:
+                pass
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+        return not self._thread.is_alive()
+    
+    def _run(self):
+        """写线程主循环"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            running = True
+            while running:
+                kind, payload, waiter = self._queue.get()
+                batch = []
+                markers = []
+                
+                # 在时间窗口内尽量多收集消息，合并为一个事务
+                deadline = time.monotonic() + self.batch_window
+                while True:
+                    if kind == 'insert':
+                        batch.append((payload, waiter))
+                    elif kind == 'flush':
+                        markers.append(waiter)
+                    else:
+                        running = False
+                    
+                    if not running or len(batch) >= self.max_batch_size:
+                        break
+                    remaining = deadline - time.monotonic()
+                    try:
+                        if remaining > 0:
+                            kind, payload, waiter = self._queue.get(timeout=remaining)
+                        else:
+                            kind, payload, waiter = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                
+                if batch:
+                    self._write_batch(conn, batch)
+                for marker in markers:
+                    marker.set()
+            
+            # 退出前写完队列中残留的消息
+            leftover = []
+            while True:
+                try:
+                    kind, payload, waiter = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == 'insert':
+                    leftover.append((payload, waiter))
+                elif kind == 'flush':
+                    waiter.set()
+            if leftover:
+                self._write_batch(conn, leftover)
+        finally:
+            conn.close()
+            self._fail_pending()
+    
+    def _fail_pending(self):
+        """写线程退出后，让队列中仍未处理的请求结束等待"""
+        while True:
+            try:
+                kind, payload, waiter = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'insert':
+                waiter.set_exception(RuntimeError("写入队列已关闭"))
+            elif kind == 'flush':
+                waiter.set()
+    
+    def _write_batch(self, conn: sqlite3.Connection, batch):
+        """在一个事务中写入一批消息"""
+        written = []
+        try:
+            results = []
+            with self.local_write(), conn:
+                for row, _ in batch:
+                    results.append(insert_message(conn, row))
+            self.last_write_time = time.monotonic()
+            for (row, future), (message_id, inserted) in zip(batch, results):
+                if inserted:
+                    written.append(_message_from_insert_row(message_id, row))
+                future.set_result(message_id)
+        except Exception as e:
+            print(f"批量写入聊天消息失败，改为逐条写入: {e}")
+            # 整批失败时逐条重试，避免一条坏数据拖累整批
+            for row, future in batch:
+                try:
+                    with self.local_write(), conn:
+                        message_id, inserted = insert_message(conn, row)
+                    if inserted:
+                        written.append(_message_from_insert_row(message_id, row))
+                    future.set_result(message_id)
+                except Exception as row_error:
+                    future.set_exception(row_error)
+        
+        if written and self.on_written:
+            try:
+                self.on_written(written)
+            except Exception as e:
+                print(f"处理写入通知失败: {e}")
+
+class ChatMaintenance:
+    """聊天数据库空闲维护线程
+    
+    定期检查数据库是否空闲（最近一段时间没有写入），空闲时执行一小步维护：
+    归档一批旧消息、回收少量空闲页；启用了保留策略时再分批清理超出限制的消息，
+    一旦有新的写入就暂停。每一步都很短，不会长时间占用写锁。
+    """
+    
+    def __init__(self, database: 'ChatDatabase', interval: float = 60.0, idle_seconds: float = 5.0):
+        """
+        Args:
+            database: 聊天数据库
+            interval: 两次检查之间的间隔（秒）
+            idle_seconds: 距离上次写入超过该秒数才视为空闲
+        """
+        self.database = database
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ChatMaintenance', daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self, timeout: float = 2.0) -> bool:
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        return not self._thread.is_alive()
+    
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            if not self.database.is_idle(self.idle_seconds):
+                continue
+            try:
+                self.database.run_maintenance_step()
+                if self.database.retention_policy.is_enabled():
+                    self.database.enforce_retention(should_continue=self._should_continue)
+            except Exception as e:
+                print(f"聊天数据库维护失败: {e}")
+    
+    def _should_continue(self) -> bool:
+        return not self._stop_event.is_set() and self.database.is_idle(self.idle_seconds)
 
 class ChatDatabase:
     """聊天数据库管理类"""
     
-    def __init__(self):
-        """初始化数据库连接"""
-        # 使用用户数据目录存储数据库
-        base_dir = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
-        if not base_dir:
-            base_dir = os.path.expanduser('~/.desktop_pet')
-        os.makedirs(base_dir, exist_ok=True)
+    def __init__(self, db_path: str = None):
+        """初始化数据库
+        
+        指定路径时立即初始化；使用默认路径时（导入模块时创建的全局实例）在第一次访问
+        db_path 时才创建并迁移数据库，只导入模块不会触碰用户数据目录。
         
-        self.db_path = os.path.join(base_dir, 'chat.db')
-        self.init_database()
+        Args:
+            db_path: 数据库文件路径，默认使用用户数据目录下的chat.db
+        """
+        lazy = db_path is None
+        if db_path is None:
+            # 使用用户数据目录存储数据库
+            base_dir = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
+            if not base_dir:
+                base_dir = os.path.expanduser('~/.desktop_pet')
+            db_path = os.path.join(base_dir, 'chat.db')
+        
+        self._db_path = db_path
+        self._opened = False
+        self._open_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self.migrator = ChatMigrator(db_path)
+        self.archive = ChatArchive(db_path)
+        self.archive_policy = ArchivePolicy()
+        self.retention_policy = RetentionPolicy()
+        self.last_retention_report = None
+        self._listeners = []
+        self._write_observers = []
+        self._write_start_observers = []
+        self._write_state_lock = threading.Lock()
+        self._active_writes = 0
+        self.vacuum_pages_per_step = 256
+        self._maintenance = None
+        self._last_write_time = 0.0
+        if not lazy:
+            self._open()
+    
+    @property
+    def db_path(self) -> str:
+        """数据库文件路径（第一次访问时初始化数据库）"""
+        if not self._opened:
+            self._open()
+        return self._db_path
+    
+    def _open(self):
+        """初始化数据库（只执行一次）"""
+        with self._open_lock:
+            if not self._opened:
+                self.init_database()
+                self._opened = True
     
     def init_database(self):
-        """初始化数据库表结构"""
+        """初始化数据库表结构
+        
+        按 PRAGMA user_version 执行未完成的迁移，耗时的数据回填在后台分批进行，
+        进度可通过 self.migrator.progress 信号获取。
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # 创建聊天消息表
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS chat_messages (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        sender_id TEXT NOT NULL,
-                        receiver_id TEXT NOT NULL,
-                        content TEXT NOT NULL,
-                        message_type TEXT DEFAULT 'text',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        is_read BOOLEAN DEFAULT 0,
-                        sync_status TEXT DEFAULT 'local'
-                    )
-                """)
-                
-                # 创建索引
-                cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_chat_messages_conversation 
-                    ON chat_messages(sender_id, receiver_id, created_at)
-                """)
-                
-                cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_chat_messages_unread 
-                    ON chat_messages(receiver_id, is_read)
-                """)
-                
-                cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_chat_messages_sync 
-                    ON chat_messages(sync_status)
-                """)
-                
-                conn.commit()
+            os.makedirs(os.path.dirname(os.path.abspath(self._db_path)), exist_ok=True)
+            with sqlite3.connect(self._db_path) as conn:
+                # 只对新建的数据库生效；已有数据库保持原来的模式，维护时不回收空闲页
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                # WAL模式下写线程提交时不阻塞界面线程的读取
+                conn.execute("PRAGMA journal_mode=WAL")
+            
+            self.migrator.migrate()
+            self.archive.migrate()
+            self.migrator.start_backfills()
                 
         except Exception as e:
             print(f"初始化聊天数据库失败: {e}")
     
+    def add_listener(self, callback: Callable[[str, Any], None]):
+        """注册数据变更监听
+        
+        回调在执行写入的线程中调用（可能是后台写线程或同步线程），
+        参数为事件名（MESSAGES_ADDED等）和事件载荷。
+        """
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+    
+    def remove_listener(self, callback: Callable[[str, Any], None]):
+        """取消数据变更监听"""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+    
+    @contextmanager
+    def local_write(self):
+        """标记本进程的一次写入
+        
+        写入开始前（尚未计为进行中时）和写入结束后（仍计为进行中时）分别调用写入观察者。
+        变更监视借此把本进程的写入（已经逐条通知过）与其他进程的写入区分开。
+        """
+        for observer in list(self._write_start_observers):
+            try:
+                observer()
+            except Exception as e:
+                print(f"处理本地写入通知失败: {e}")
+        with self._write_state_lock:
+            self._active_writes += 1
+        try:
+            yield
+        finally:
+            for observer in list(self._write_observers):
+                try:
+                    observer()
+                except Exception as e:
+                    print(f"处理本地写入通知失败: {e}")
+            with self._write_state_lock:
+                self._active_writes -= 1
+    
+    def add_write_start_observer(self, callback: Callable[[], None]):
+        """注册本进程写入开始前的回调（在执行写入的线程中调用）"""
+        if callback not in self._write_start_observers:
+            self._write_start_observers.append(callback)
+    
+    def remove_write_start_observer(self, callback: Callable[[], None]):
+        """取消本进程写入开始前的回调"""
+        if callback in self._write_start_observers:
+            self._write_start_observers.remove(callback)
+    
+    def add_write_observer(self, callback: Callable[[], None]):
+        """注册本进程写入结束时的回调（在执行写入的线程中调用）"""
+        if callback not in self._write_observers:
+            self._write_observers.append(callback)
+    
+    def remove_write_observer(self, callback: Callable[[], None]):
+        """取消本进程写入结束时的回调"""
+        if callback in self._write_observers:
+            self._write_observers.remove(callback)
+    
+    def has_active_writes(self) -> bool:
+        """本进程是否有正在进行的写入"""
+        with self._write_state_lock:
+            return self._active_writes > 0
+    
+    def notify_listeners(self, event: str, payload: Any = None):
+        """通知所有监听者（单个监听者出错不影响其他监听者）"""
+        for callback in list(self._listeners):
+            try:
+                callback(event, payload)
+            except Exception as e:
+                print(f"聊天数据变更通知失败: {e}")
+    
+    def _conversation_filter(self, user1_id: str, user2_id: str):
+        """构造会话查询条件
+        
+        会话键回填完成前退回到按收发双方匹配的旧条件。
+        
+        Returns:
+            (WHERE子句, 参数元组)
+        """
+        if self.migrator.is_backfill_complete('conversation_key'):
+            return "conversation_key = ?", (conversation_key(user1_id, user2_id),)
+        return ("((sender_id = ? AND receiver_id = ?) OR (sender_id = ? AND receiver_id = ?))",
+                (user1_id, user2_id, user2_id, user1_id))
+    
+    def _created_at_sql(self) -> str:
+        """消息时间的查询表达式
+        
+        时间格式回填完成前新旧两种格式混存，退回到兼容两种格式的表达式（不使用时间索引）。
+        """
+        if self.migrator.is_backfill_complete('epoch_ms'):
+            return "created_at"
+        return MIXED_CREATED_AT_SQL
+    
     def save_message(self, sender_id: str, receiver_id: str, content: str, 
-                    message_type: str = 'text') -> Optional[int]:
+                    message_type: str = 'text', message_uid: str = None) -> Optional[int]:
         """保存聊天消息
         
+        同一消息UID重复保存时不会产生新记录，返回已有消息的ID。
+        
         Args:
             sender_id: 发送者ID
             receiver_id: 接收者ID
             content: 消息内容
             message_type: 消息类型
+            message_uid: 消息UID，默认新生成
             
         Returns:
             消息ID或None
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    INSERT INTO chat_messages (sender_id, receiver_id, content, message_type, created_at)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (sender_id, receiver_id, content, message_type, datetime.now().isoformat()))
-                
+            row = (sender_id, receiver_id, content, message_type, now_ms(),
+                   conversation_key(sender_id, receiver_id), message_uid or new_message_uid())
+            with self.local_write(), sqlite3.connect(self.db_path) as conn:
+                message_id, inserted = insert_message(conn, row)
                 conn.commit()
-                return cursor.lastrowid
+            
+            self._last_write_time = time.monotonic()
+            if inserted:
+                self.notify_listeners(MESSAGES_ADDED, [_message_from_insert_row(message_id, row)])
+            return message_id
                 
         except Exception as e:
             print(f"保存聊天消息失败: {e}")
             return None
     
+    def save_message_async(self, sender_id: str, receiver_id: str, content: str,
+                           message_type: str = 'text', created_at: int = None,
+                           message_uid: str = None) -> Future:
+        """异步保存聊天消息（组提交）
+        
+        消息进入后台写入队列，与同一时间窗口内的其他消息合并为一次提交。
+        
+        Args:
+            sender_id: 发送者ID
+            receiver_id: 接收者ID
+            content: 消息内容
+            message_type: 消息类型
+            created_at: 创建时间（毫秒时间戳），默认当前时间
+            message_uid: 消息UID，默认新生成；重复提交同一UID时结果为已有消息的ID
+            
+        Returns:
+            结果为消息ID的Future
+        """
+        return self._get_writer().submit(sender_id, receiver_id, content, message_type,
+                                         created_at, message_uid)
+    
+    def flush_writes(self, timeout: float = 2.0) -> bool:
+        """等待写入队列中的消息全部落盘"""
+        if self._writer is None:
+            return True
+        return self._writer.flush(timeout)
+    
+    def _get_writer(self) -> MessageWriteQueue:
+        """获取（必要时创建）后台写入队列"""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = MessageWriteQueue(
+                    self.db_path,
+                    on_written=lambda messages: self.notify_listeners(MESSAGES_ADDED, messages),
+                    local_write=self.local_write
+                )
+            return self._writer
+    
     def get_conversation_history(self, user1_id: str, user2_id: str, 
-                               limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+                               limit: int = 50, offset: int = 0) -> List[ChatMessage]:
         """获取两个用户之间的聊天记录
         
         Args:
@@ -112,25 +595,26 @@ class ChatDatabase:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute("""
-                    SELECT id, sender_id, receiver_id, content, message_type, created_at, is_read
+                # 未读和未同步的消息不论多旧都留在热库，冷库的消息不一定都比热库的早，
+                # 有冷库时两边各取前 offset+limit 条按 (created_at, id) 合并后再截取
+                archived = self.archive.exists()
+                where, params = self._conversation_filter(user1_id, user2_id)
+                cursor.execute(f"""
+                    SELECT {ChatMessage.COLUMNS}
                     FROM chat_messages
-                    WHERE (sender_id = ? AND receiver_id = ?) OR (sender_id = ? AND receiver_id = ?)
-                    ORDER BY created_at DESC
+                    WHERE {where}
+                    ORDER BY {self._created_at_sql()} DESC, id DESC
                     LIMIT ? OFFSET ?
-                """, (user1_id, user2_id, user2_id, user1_id, limit, offset))
-                
-                messages = []
-                for row in cursor.fetchall():
-                    messages.append({
-                        'id': row[0],
-                        'sender_id': row[1],
-                        'receiver_id': row[2],
-                        'content': row[3],
-                        'message_type': row[4],
-                        'created_at': row[5],
-                        'is_read': bool(row[6])
-                    })
+                """, params + ((offset + limit, 0) if archived else (limit, offset)))
+                
+                messages = [ChatMessage.from_row(row) for row in cursor.fetchall()]
+                
+                if archived:
+                    # 归档中断时同一消息可能同时存在于两个库，按ID去重
+                    merged = {m.id: m for m in self.archive.get_conversation_history(
+                        conversation_key(user1_id, user2_id), offset + limit) + messages}
+                    messages = sorted(merged.values(), key=lambda m: (m.created_at, m.id), reverse=True)
+                    messages = messages[offset:offset + limit]
                 
                 # 按时间正序返回（最新的在最后）
                 return list(reversed(messages))
@@ -139,6 +623,105 @@ class ChatDatabase:
             print(f"获取聊天记录失败: {e}")
             return []
     
+    def get_messages_in_range(self, user1_id: str, user2_id: str, start_ms: int,
+                              end_ms: int = None, limit: int = 500) -> List[ChatMessage]:
+        """按时间范围获取两个用户之间的聊天记录（走会话+时间索引）
+        
+        Args:
+            user1_id: 用户1 ID
+            user2_id: 用户2 ID
+            start_ms: 起始时间（毫秒时间戳，包含）
+            end_ms: 结束时间（毫秒时间戳，不包含），None表示不限
+            limit: 消息数量限制
+            
+        Returns:
+            按时间正序排列的聊天记录
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                where, params = self._conversation_filter(user1_id, user2_id)
+                created_at = self._created_at_sql()
+                where += f" AND {created_at} >= ?"
+                params += (start_ms,)
+                if end_ms is not None:
+                    where += f" AND {created_at} < ?"
+                    params += (end_ms,)
+                
+                cursor = conn.execute(f"""
+                    SELECT {ChatMessage.COLUMNS}
+                    FROM chat_messages
+                    WHERE {where}
+                    ORDER BY {created_at}, id
+                    LIMIT ?
+                """, params + (limit,))
+                return [ChatMessage.from_row(row) for row in cursor.fetchall()]
+                
+        except Exception as e:
+            print(f"按时间获取聊天记录失败: {e}")
+            return []
+    
+    def get_message_page(self, user1_id: str, user2_id: str, created_at: int, message_id: int,
+                         older: bool = True, limit: int = 50) -> List[ChatMessage]:
+        """以某条消息为游标读取相邻的一页聊天记录（热库和冷库合并）
+        
+        Args:
+            user1_id: 用户1 ID
+            user2_id: 用户2 ID
+            created_at: 游标消息的创建时间（毫秒时间戳）
+            message_id: 游标消息的ID
+            older: True读取更早的消息，False读取更新的消息
+            limit: 消息数量限制
+            
+        Returns:
+            按时间正序排列的聊天记录
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                where, params = self._conversation_filter(user1_id, user2_id)
+                messages = query_message_page(conn, where, params, created_at, message_id, older, limit,
+                                              self._created_at_sql())
+            
+            # 冷库中的消息通常更早，但未读消息会留在热库，两边都查询后合并
+            archived = self.archive.get_message_page(
+                conversation_key(user1_id, user2_id), created_at, message_id, older, limit
+            )
+            if archived:
+                # 归档中断时同一消息可能同时存在于两个库，按ID去重
+                merged = {m.id: m for m in archived + messages}
+                messages = sorted(merged.values(), key=lambda m: (m.created_at, m.id))
+                messages = messages[-limit:] if older else messages[:limit]
+            return messages
+                
+        except Exception as e:
+            print(f"分页获取聊天记录失败: {e}")
+            return []
+    
+    def get_max_message_id_since(self, user1_id: str, user2_id: str, since_id: int) -> Optional[int]:
+        """检查会话中是否有ID大于since_id的新消息
+        
+        按主键范围扫描，只读取since_id之后写入的行，代价与新消息数成正比而不是与会话长度成正比。
+        
+        Args:
+            user1_id: 用户1 ID
+            user2_id: 用户2 ID
+            since_id: 已知的最大消息ID
+            
+        Returns:
+            新消息中最大的ID，没有新消息时返回None
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                where, params = self._conversation_filter(user1_id, user2_id)
+                row = conn.execute(f"""
+                    SELECT MAX(id) FROM chat_messages NOT INDEXED
+                    WHERE id > ? AND {where}
+                """, (since_id,) + params).fetchone()
+                return row[0]
+                
+        except Exception as e:
+            print(f"检查新消息失败: {e}")
+            return None
+    
     def mark_messages_as_read(self, sender_id: str, receiver_id: str) -> bool:
         """标记消息为已读
         
@@ -150,7 +733,7 @@ class ChatDatabase:
             是否成功
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.local_write(), sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
@@ -158,14 +741,55 @@ class ChatDatabase:
                     SET is_read = 1 
                     WHERE sender_id = ? AND receiver_id = ? AND is_read = 0
                 """, (sender_id, receiver_id))
+                changed = cursor.rowcount
                 
                 conn.commit()
-                return True
+            
+            if changed:
+                self.notify_listeners(MESSAGES_READ, (sender_id, receiver_id, None, 0))
+            return True
                 
         except Exception as e:
             print(f"标记消息已读失败: {e}")
             return False
     
+    def mark_messages_read_up_to(self, watermarks: Dict[Tuple[str, str], int]) -> int:
+        """按已读水位批量标记消息为已读（一次提交）
+        
+        Args:
+            watermarks: {(发送者ID, 接收者ID): 已读到的消息ID}，ID不大于水位的消息标记为已读
+            
+        Returns:
+            标记为已读的消息数
+        """
+        try:
+            changed = 0
+            events = []
+            with self.local_write(), sqlite3.connect(self.db_path) as conn:
+                for (sender_id, receiver_id), message_id in watermarks.items():
+                    cursor = conn.execute("""
+                        UPDATE chat_messages 
+                        SET is_read = 1 
+                        WHERE receiver_id = ? AND is_read = 0 AND sender_id = ? AND id <= ?
+                    """, (receiver_id, sender_id, message_id))
+                    if not cursor.rowcount:
+                        continue
+                    changed += cursor.rowcount
+                    remaining = conn.execute("""
+                        SELECT COUNT(*) FROM chat_messages
+                        WHERE receiver_id = ? AND is_read = 0 AND sender_id = ?
+                    """, (receiver_id, sender_id)).fetchone()[0]
+                    events.append((sender_id, receiver_id, message_id, remaining))
+                conn.commit()
+            
+            for payload in events:
+                self.notify_listeners(MESSAGES_READ, payload)
+            return changed
+                
+        except Exception as e:
+            print(f"标记消息已读失败: {e}")
+            return 0
+    
     def get_unread_count(self, user_id: str) -> int:
         """获取用户的未读消息数量
         
@@ -180,8 +804,8 @@ class ChatDatabase:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
-                    SELECT COUNT(*) FROM chat_messages 
-                    WHERE receiver_id = ? AND is_read = 0
+                    SELECT COALESCE(SUM(count), 0) FROM unread_counters 
+                    WHERE receiver_id = ?
                 """, (user_id,))
                 
                 result = cursor.fetchone()
@@ -206,8 +830,8 @@ class ChatDatabase:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
-                    SELECT COUNT(*) FROM chat_messages 
-                    WHERE receiver_id = ? AND sender_id = ? AND is_read = 0
+                    SELECT count FROM unread_counters 
+                    WHERE receiver_id = ? AND sender_id = ?
                 """, (receiver_id, sender_id))
                 
                 result = cursor.fetchone()
@@ -217,6 +841,58 @@ class ChatDatabase:
             print(f"获取特定发送者未读消息数量失败: {e}")
             return 0
     
+    def get_unread_counts(self, receiver_id: str) -> Dict[str, int]:
+        """一次性获取用户来自每个发送者的未读消息数量
+        
+        Args:
+            receiver_id: 接收者ID（当前用户）
+            
+        Returns:
+            {发送者ID: 未读消息数量}，没有未读消息的发送者不出现在结果中
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    SELECT sender_id, count FROM unread_counters 
+                    WHERE receiver_id = ? AND count > 0
+                """, (receiver_id,))
+                
+                return {row[0]: row[1] for row in cursor.fetchall()}
+                
+        except Exception as e:
+            print(f"获取未读消息数量失败: {e}")
+            return {}
+    
+    def get_unread_snapshot(self, receiver_id: str) -> Tuple[Dict[str, int], int]:
+        """在同一个读事务里获取未读数和当时已提交的最大消息ID
+        
+        缓存以此为起点应用后续的写入通知：ID不大于快照ID的新消息已经计入未读数，不能再累加一次。
+        
+        Args:
+            receiver_id: 接收者ID（当前用户）
+            
+        Returns:
+            ({发送者ID: 未读消息数量}, 最大消息ID)，没有消息时最大ID为0
+        """
+        try:
+            with sqlite3.connect(self.db_path, isolation_level=None) as conn:
+                conn.execute("BEGIN")
+                try:
+                    rows = conn.execute("""
+                        SELECT sender_id, count FROM unread_counters 
+                        WHERE receiver_id = ? AND count > 0
+                    """, (receiver_id,)).fetchall()
+                    max_id = conn.execute("SELECT MAX(id) FROM chat_messages").fetchone()[0]
+                finally:
+                    conn.execute("COMMIT")
+                return {row[0]: row[1] for row in rows}, max_id or 0
+                
+        except Exception as e:
+            print(f"获取未读消息快照失败: {e}")
+            return {}, 0
+    
     def get_recent_conversations(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
         """获取用户的最近聊天会话
         
@@ -225,40 +901,43 @@ class ChatDatabase:
             limit: 会话数量限制
             
         Returns:
-            最近会话列表
+            最近会话列表（last_message_time 为毫秒时间戳）
         """
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
                 
                 # 获取最近的聊天对象和最后一条消息
-                cursor.execute("""
+                created_at = self._created_at_sql()
+                cursor.execute(f"""
                     SELECT 
                         CASE 
                             WHEN sender_id = ? THEN receiver_id 
                             ELSE sender_id 
                         END as other_user_id,
                         content,
-                        created_at,
+                        {created_at},
                         sender_id = ? as is_sent
                     FROM chat_messages 
                     WHERE sender_id = ? OR receiver_id = ?
                     GROUP BY other_user_id
-                    ORDER BY MAX(created_at) DESC
+                    ORDER BY MAX({created_at}) DESC
                     LIMIT ?
                 """, (user_id, user_id, user_id, user_id, limit))
                 
+                rows = cursor.fetchall()
+                unread_counts = self.get_unread_counts(user_id)
+                
                 conversations = []
-                for row in cursor.fetchall():
+                for row in rows:
                     other_user_id = row[0]
-                    unread_count = self.get_unread_count_by_sender(user_id, other_user_id)
                     
                     conversations.append({
                         'other_user_id': other_user_id,
                         'last_message': row[1],
                         'last_message_time': row[2],
                         'is_last_sent': row[3],
-                        'unread_count': unread_count
+                        'unread_count': unread_counts.get(other_user_id, 0)
                     })
                 
                 return conversations
@@ -278,22 +957,27 @@ class ChatDatabase:
             是否成功
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    DELETE FROM chat_messages
-                    WHERE (sender_id = ? AND receiver_id = ?) OR (sender_id = ? AND receiver_id = ?)
-                """, (user1_id, user2_id, user2_id, user1_id))
+            with self.local_write():
+                with sqlite3.connect(self.db_path) as conn:
+                    cursor = conn.cursor()
+                    
+                    where, params = self._conversation_filter(user1_id, user2_id)
+                    cursor.execute(f"""
+                        DELETE FROM chat_messages
+                        WHERE {where}
+                    """, params)
+                    
+                    conn.commit()
                 
-                conn.commit()
-                return True
+                self.archive.delete_conversation(conversation_key(user1_id, user2_id))
+            self.notify_listeners(CONVERSATION_DELETED, (user1_id, user2_id))
+            return True
                 
         except Exception as e:
             print(f"删除聊天记录失败: {e}")
             return False
     
-    def search_messages(self, user_id: str, keyword: str, limit: int = 50) -> List[Dict[str, Any]]:
+    def search_messages(self, user_id: str, keyword: str, limit: int = 50) -> List[ChatMessage]:
         """搜索聊天消息
         
         Args:
@@ -308,35 +992,387 @@ class ChatDatabase:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute("""
-                    SELECT id, sender_id, receiver_id, content, message_type, created_at
+                cursor.execute(f"""
+                    SELECT {ChatMessage.COLUMNS}
                     FROM chat_messages
                     WHERE (sender_id = ? OR receiver_id = ?) AND content LIKE ?
-                    ORDER BY created_at DESC
+                    ORDER BY {self._created_at_sql()} DESC
                     LIMIT ?
                 """, (user_id, user_id, f'%{keyword}%', limit))
                 
-                messages = []
-                for row in cursor.fetchall():
-                    messages.append({
-                        'id': row[0],
-                        'sender_id': row[1],
-                        'receiver_id': row[2],
-                        'content': row[3],
-                        'message_type': row[4],
-                        'created_at': row[5]
-                    })
-                
-                return messages
+                return [ChatMessage.from_row(row) for row in cursor.fetchall()]
                 
         except Exception as e:
             print(f"搜索聊天消息失败: {e}")
             return []
     
-    def close(self):
-        """关闭数据库连接"""
-        # SQLite连接在with语句中自动关闭，这里不需要特别处理
-        pass
+    def get_sync_value(self, key: str) -> Optional[str]:
+        """读取同步状态值（如拉取游标、设备ID）"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            print(f"读取同步状态失败: {e}")
+            return None
+    
+    def set_sync_value(self, key: str, value: str) -> bool:
+        """写入同步状态值"""
+        try:
+            with self.local_write(), sqlite3.connect(self.db_path) as conn:
+                conn.execute("""
+                    INSERT INTO sync_state (key, value) VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                """, (key, value))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"写入同步状态失败: {e}")
+            return False
+    
+    def get_unsynced_messages(self, sender_id: str, limit: int = 200) -> List[ChatMessage]:
+        """获取尚未上传到云端的本地消息（按ID升序）
+        
+        Args:
+            sender_id: 发送者ID（当前用户）
+            limit: 最多返回的消息数
+            
+        Returns:
+            消息列表
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(f"""
+                    SELECT {ChatMessage.COLUMNS}
+                    FROM chat_messages
+                    WHERE sync_status = 'local' AND sender_id = ?
+                    ORDER BY id
+                    LIMIT ?
+                """, (sender_id, limit))
+                
+                return [ChatMessage.from_row(row) for row in cursor.fetchall()]
+                
+        except Exception as e:
+            print(f"获取待同步消息失败: {e}")
+            return []
+    
+    def mark_messages_synced(self, server_ids: Dict[int, int]) -> bool:
+        """在一个事务中把一批消息标记为已同步
+        
+        Args:
+            server_ids: {本地消息ID: 服务器消息ID}
+            
+        Returns:
+            是否成功
+        """
+        if not server_ids:
+            return True
+        try:
+            with self.local_write(), sqlite3.connect(self.db_path) as conn:
+                conn.executemany("""
+                    UPDATE chat_messages SET sync_status = 'synced', server_id = ?
+                    WHERE id = ?
+                """, [(server_id, local_id) for local_id, server_id in server_ids.items()])
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"标记消息已同步失败: {e}")
+            return False
+    
+    def save_inbound_messages(self, messages: List[Dict[str, Any]], cursor_key: str,
+                              cursor_value: str) -> int:
+        """保存从云端拉取的消息，并在同一事务中推进拉取游标
+        
+        已存在相同服务器ID或消息UID的消息会被跳过，重复拉取不会产生重复记录。
+        
+        Args:
+            messages: 消息列表，需包含server_id、sender_id、receiver_id、content、message_type、
+                created_at（毫秒时间戳），可选message_uid
+            cursor_key: 游标在sync_state中的键
+            cursor_value: 新的游标值
+            
+        Returns:
+            实际新增的消息数
+        """
+        try:
+            with self.local_write(), sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                
+                added = []
+                for m in messages:
+                    row = (m['sender_id'], m['receiver_id'], m['content'], m.get('message_type') or 'text',
+                           m['created_at'], conversation_key(m['sender_id'], m['receiver_id']),
+                           m.get('message_uid') or new_message_uid(), m['server_id'])
+                    cursor.execute("""
+                        INSERT INTO chat_messages
+                            (sender_id, receiver_id, content, message_type, created_at,
+                             conversation_key, message_uid, server_id, sync_status)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'synced')
+                        ON CONFLICT DO NOTHING
+                    """, row)
+                    if cursor.rowcount:
+                        added.append(_message_from_insert_row(cursor.lastrowid, row))
+                
+                cursor.execute("""
+                    INSERT INTO sync_state (key, value) VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                """, (cursor_key, cursor_value))
+                
+                conn.commit()
+            
+            self._last_write_time = time.monotonic()
+            if added:
+                self.notify_listeners(MESSAGES_ADDED, added)
+            return len(added)
+                
+        except Exception as e:
+            print(f"保存云端消息失败: {e}")
+            return 0
+    
+    def is_idle(self, seconds: float) -> bool:
+        """最近seconds秒内是否没有写入"""
+        last_write = self._last_write_time
+        if self._writer is not None:
+            last_write = max(last_write, self._writer.last_write_time)
+        return time.monotonic() - last_write >= seconds
+    
+    def run_maintenance_step(self) -> Dict[str, int]:
+        """执行一小步维护：归档一批旧消息并回收少量空闲页
+        
+        Returns:
+            本步归档的消息数和回收的页数
+        """
+        archived = 0
+        with self.local_write():
+            # 冷库按会话键组织并按消息UID去重，相关回填全部完成后才开始归档
+            if not self.migrator.has_pending_backfills():
+                archived = self.archive.archive_step(self.archive_policy)
+            
+            vacuumed = incremental_vacuum(self.db_path, self.vacuum_pages_per_step)
+            vacuumed += self.archive.incremental_vacuum(self.vacuum_pages_per_step)
+        return {'archived': archived, 'vacuumed_pages': vacuumed}
+    
+    def _retention_connection(self) -> sqlite3.Connection:
+        """打开用于清理的连接，并建立覆盖热库和冷库的临时视图 all_messages"""
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        sources = ["SELECT 'main' AS store, id, conversation_key, created_at, is_read, sync_status "
+                   "FROM main.chat_messages"]
+        if self.archive.exists():
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive.archive_path,))
+            if conn.execute("""
+                SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'chat_messages'
+            """).fetchone():
+                sources.insert(0, "SELECT 'archive' AS store, id, conversation_key, created_at, is_read, "
+                                  "sync_status FROM archive.chat_messages")
+        conn.execute(f"CREATE TEMP VIEW all_messages AS {' UNION ALL '.join(sources)}")
+        return conn
+    
+    @staticmethod
+    def _used_bytes(conn: sqlite3.Connection) -> int:
+        """已附加的各数据库中实际存放数据的字节数（不含空闲页）"""
+        total = 0
+        for _, schema, _ in conn.execute("PRAGMA database_list").fetchall():
+            if schema == 'temp':
+                continue
+            page_size = conn.execute(f"PRAGMA {schema}.page_size").fetchone()[0]
+            pages = conn.execute(f"PRAGMA {schema}.page_count").fetchone()[0]
+            free = conn.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+            total += (pages - free) * page_size
+        return total
+    
+    def _select_expired(self, conn: sqlite3.Connection, policy: RetentionPolicy) -> List[tuple]:
+        """按保留策略挑选一批需要删除的消息 (库名, ID)，最旧的优先"""
+        limit = policy.batch_size
+        deletable = "is_read = 1 AND sync_status != 'local'"
+        
+        if policy.max_age_days is not None:
+            cutoff = now_ms() - int(policy.max_age_days * 86400 * 1000)
+            rows = conn.execute(f"""
+                SELECT store, id FROM all_messages
+                WHERE created_at < ? AND {deletable}
+                ORDER BY created_at, id
+                LIMIT ?
+            """, (cutoff, limit)).fetchall()
+            if rows:
+                return rows
+        
+        if policy.max_per_conversation is not None:
+            oversized = conn.execute("""
+                SELECT conversation_key FROM all_messages
+                WHERE conversation_key IS NOT NULL
+                GROUP BY conversation_key
+                HAVING COUNT(*) > ?
+            """, (policy.max_per_conversation,)).fetchall()
+            
+            rows = []
+            for (key,) in oversized:
+                boundary = conn.execute("""
+                    SELECT created_at, id FROM all_messages
+                    WHERE conversation_key = ?
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT 1 OFFSET ?
+                """, (key, policy.max_per_conversation)).fetchone()
+                rows.extend(conn.execute(f"""
+                    SELECT store, id FROM all_messages
+                    WHERE conversation_key = ? AND {deletable}
+                      AND (created_at < ? OR (created_at = ? AND id <= ?))
+                    ORDER BY created_at, id
+                    LIMIT ?
+                """, (key, boundary[0], boundary[0], boundary[1], limit - len(rows))).fetchall())
+                if len(rows) >= limit:
+                    break
+            if rows:
+                return rows
+        
+        if policy.max_db_bytes is not None and self._used_bytes(conn) > policy.max_db_bytes:
+            return conn.execute(f"""
+                SELECT store, id FROM all_messages
+                WHERE {deletable}
+                ORDER BY created_at, id
+                LIMIT ?
+            """, (limit,)).fetchall()
+        
+        return []
+    
+    def prune_step(self, policy: RetentionPolicy = None) -> int:
+        """按保留策略删除一批消息（每个库一个短事务）
+        
+        Returns:
+            本步删除的消息数
+        """
+        policy = policy or self.retention_policy
+        if not policy.is_enabled():
+            return 0
+        # 时间格式转换完成前新旧格式混存，按时间挑选要删除的消息会出错
+        if not self.migrator.is_backfill_complete('epoch_ms'):
+            return 0
+        
+        deleted = 0
+        conn = self._retention_connection()
+        try:
+            by_store: Dict[str, List[int]] = {}
+            for store, message_id in self._select_expired(conn, policy):
+                by_store.setdefault(store, []).append(message_id)
+            
+            for store, ids in by_store.items():
+                placeholders = ', '.join('?' * len(ids))
+                with self.local_write():
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        deleted += conn.execute(
+                            f"DELETE FROM {store}.chat_messages WHERE id IN ({placeholders})", ids
+                        ).rowcount
+                        conn.execute("COMMIT")
+                    except Exception:
+                        conn.execute("ROLLBACK")
+                        raise
+        finally:
+            conn.close()
+        
+        if deleted:
+            self.notify_listeners(MESSAGES_REMOVED, deleted)
+        return deleted
+    
+    def _file_bytes(self) -> int:
+        """热库和冷库文件（含WAL）的总大小"""
+        paths = [self.db_path, self.db_path + '-wal', self.archive.archive_path,
+                 self.archive.archive_path + '-wal']
+        return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+    
+    def enforce_retention(self, policy: RetentionPolicy = None,
+                          should_continue: Callable[[], bool] = None) -> Dict[str, Any]:
+        """分批执行保留策略，直到没有超出限制的消息或should_continue返回False
+        
+        每批删除之间暂停policy.batch_pause秒让出写锁，删除完成后分步回收空闲页。
+        
+        Returns:
+            {'deleted': 删除的消息数, 'batches': 批次数, 'freed_bytes': 释放的数据空间,
+             'reclaimed_bytes': 文件缩小的字节数, 'seconds': 耗时, 'completed': 是否全部完成}
+        """
+        policy = policy or self.retention_policy
+        should_continue = should_continue or (lambda: True)
+        started = time.monotonic()
+        files_before = self._file_bytes()
+        
+        conn = self._retention_connection()
+        try:
+            used_before = self._used_bytes(conn)
+        finally:
+            conn.close()
+        
+        deleted = batches = 0
+        completed = False
+        while should_continue():
+            count = self.prune_step(policy)
+            if not count:
+                completed = True
+                break
+            deleted += count
+            batches += 1
+            time.sleep(policy.batch_pause)
+        
+        conn = self._retention_connection()
+        try:
+            used_after = self._used_bytes(conn)
+        finally:
+            conn.close()
+        
+        # 分步回收删除后留下的空闲页
+        while deleted and should_continue():
+            with self.local_write():
+                vacuumed = incremental_vacuum(self.db_path, self.vacuum_pages_per_step)
+                vacuumed += self.archive.incremental_vacuum(self.vacuum_pages_per_step)
+            if not vacuumed:
+                break
+            time.sleep(policy.batch_pause)
+        
+        if deleted:
+            # 回收的页先写入WAL，检查点之后文件才真正变小
+            for path in (self.db_path, self.archive.archive_path):
+                if os.path.exists(path):
+                    with self.local_write(), sqlite3.connect(path, timeout=10) as checkpoint_conn:
+                        checkpoint_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        
+        report = {
+            'deleted': deleted,
+            'batches': batches,
+            'freed_bytes': max(used_before - used_after, 0),
+            'reclaimed_bytes': max(files_before - self._file_bytes(), 0),
+            'seconds': round(time.monotonic() - started, 3),
+            'completed': completed,
+        }
+        self.last_retention_report = report
+        if deleted:
+            print(f"聊天记录清理：删除 {deleted} 条消息，释放 {report['freed_bytes'] // 1024}KB，"
+                  f"文件缩小 {report['reclaimed_bytes'] // 1024}KB")
+        return report
+    
+    def start_maintenance(self, interval: float = 60.0, idle_seconds: float = 5.0):
+        """启动空闲维护线程"""
+        if self._maintenance is None:
+            self._maintenance = ChatMaintenance(self, interval, idle_seconds)
+            self._maintenance.start()
+    
+    def close(self, timeout: float = 2.0) -> bool:
+        """关闭数据库连接
+        
+        读操作的连接在with语句中自动关闭；后台回填和维护线程会停止（下次启动继续），
+        后台写入队列最多等待timeout秒写完剩余消息。
+        
+        Returns:
+            写入队列是否在超时前退出
+        """
+        self.migrator.stop(timeout)
+        if self._maintenance is not None:
+            self._maintenance.stop(timeout)
+            self._maintenance = None
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is None:
+            return True
+        return writer.close(timeout)
 
 # 全局聊天数据库实例
 chat_db = ChatDatabase()
\ No newline at end of file
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天记录导出/导入模块
+以 JSONL（每行一条消息，可gzip压缩）流式导出和导入聊天记录，内存占用与记录总数无关
+
+用法：
+    python chat_export.py export backup.jsonl.gz [--db chat.db] [--user1 A --user2 B]
+    python chat_export.py import backup.jsonl.gz [--db chat.db] [--batch-size 1000]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import sys
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chat_database import MESSAGES_RESET, ChatDatabase, conversation_key
+from chat_message import legacy_to_epoch_ms, new_message_uid, now_ms
+
+# 导出的字段（顺序即JSON中的顺序）
+EXPORT_FIELDS = ('message_uid', 'sender_id', 'receiver_id', 'content', 'message_type', 'created_at',
+                 'is_read', 'sync_status', 'server_id')
+
+def _open_text(path: str, mode: str) -> IO[str]:
+    """打开文本文件，.gz 后缀或gzip文件头时按gzip处理"""
+    compressed = path.endswith('.gz')
+    if 'r' in mode and not compressed and os.path.exists(path):
+        with open(path, 'rb') as f:
+            compressed = f.read(2) == b'\x1f\x8b'
+    if compressed:
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8', newline='\n')
+
+def _iter_table(db_path: str, key: Optional[str], batch_size: int) -> Iterator[Dict[str, Any]]:
+    """逐批读取一个数据库文件中的消息"""
+    conn = sqlite3.connect(db_path)
+    try:
+        if conn.execute("""
+            SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_messages'
+        """).fetchone() is None:
+            return
+
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chat_messages)")}
+        select = ', '.join(f if f in columns else 'NULL' for f in EXPORT_FIELDS)
+        if key is None:
+            cursor = conn.execute(f"SELECT {select} FROM chat_messages ORDER BY id")
+        else:
+            cursor = conn.execute(f"""
+                SELECT {select} FROM chat_messages
+                WHERE conversation_key = ?
+                ORDER BY created_at, id
+            """, (key,))
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                message = dict(zip(EXPORT_FIELDS, row))
+                message['is_read'] = bool(message['is_read'])
+                # 时间格式回填完成前可能读到旧的ISO字符串
+                message['created_at'] = legacy_to_epoch_ms(message['created_at'])
+                yield message
+    finally:
+        conn.close()
+
+def iter_messages(db: ChatDatabase, user1_id: str = None, user2_id: str = None,
+                  batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """流式读取聊天记录（冷库中较早的消息在前，热库在后）
+
+    旧数据库的会话键和时间格式由后台回填补齐，读取前先等待回填结束，
+    否则按会话读取会漏掉还没有会话键的消息。
+
+    Args:
+        db: 聊天数据库
+        user1_id: 用户1 ID，与user2_id同时为None时读取全部会话
+        user2_id: 用户2 ID
+        batch_size: 每次从数据库取出的行数
+
+    Yields:
+        消息字典，字段见 EXPORT_FIELDS
+    """
+    key = None
+    if user1_id is not None and user2_id is not None:
+        key = conversation_key(user1_id, user2_id)
+
+    db_path = db.db_path  # 打开数据库时启动回填
+    db.migrator.wait_for_backfills()
+    if db.archive.exists():
+        yield from _iter_table(db.archive.archive_path, key, batch_size)
+    yield from _iter_table(db_path, key, batch_size)
+
+def export_messages(db: ChatDatabase, path: str, user1_id: str = None, user2_id: str = None,
+                    batch_size: int = 1000) -> int:
+    """导出聊天记录到JSONL文件（路径以 .gz 结尾时gzip压缩）
+
+    Returns:
+        导出的消息数
+    """
+    count = 0
+    with _open_text(path, 'w') as f:
+        for message in iter_messages(db, user1_id, user2_id, batch_size):
+            f.write(json.dumps(message, ensure_ascii=False))
+            f.write('\n')
+            count += 1
+    return count
+
+def read_messages(path: str) -> Iterator[Dict[str, Any]]:
+    """流式读取JSONL文件中的消息（跳过空行）"""
+    with _open_text(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"第{line_number}行不是有效的JSON: {e}")
+
+def _batches(items: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _archive_attached(conn: sqlite3.Connection, db: ChatDatabase) -> bool:
+    """附加冷库以便一并去重，冷库不存在或没有消息表时返回False"""
+    if not db.archive.exists():
+        return False
+    conn.execute("ATTACH DATABASE ? AS archive", (db.archive.archive_path,))
+    return conn.execute("""
+        SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'chat_messages'
+    """).fetchone() is not None
+
+def import_messages(db: ChatDatabase, messages: Iterable[Dict[str, Any]],
+                    batch_size: int = 1000) -> Dict[str, int]:
+    """分批导入聊天记录
+
+    消息以消息UID作为身份去重；旧版本导出的文件没有UID，改用
+    (发送者, 接收者, 创建时间, 内容) 判断。热库或冷库中已存在的消息以及服务器ID
+    已存在的消息会被跳过，因此同一份备份重复导入不会产生重复记录。
+    每批一个事务，中途失败时已提交的批次保留。
+    创建时间为旧版本的ISO字符串时按本地时间转换；为空或无法解析时（旧数据中损坏的时间
+    导出为null）使用文件中前一条消息的时间，与时间格式回填的处理一致。
+
+    Returns:
+        {'read': 读取的消息数, 'inserted': 新增数, 'skipped': 跳过数}
+    """
+    stats = {'read': 0, 'inserted': 0, 'skipped': 0}
+    conn = sqlite3.connect(db.db_path, timeout=10, isolation_level=None)
+    try:
+        # ?10 为文件中的消息UID（可能为空），?11 为实际写入的UID
+        archive_check = ""
+        if _archive_attached(conn, db):
+            archive_check = """
+                AND CASE WHEN ?10 IS NULL THEN NOT EXISTS (
+                    SELECT 1 FROM archive.chat_messages
+                    WHERE conversation_key = ?5 AND created_at = ?4
+                      AND sender_id = ?1 AND receiver_id = ?2 AND content = ?3
+                ) ELSE NOT EXISTS (
+                    SELECT 1 FROM archive.chat_messages WHERE message_uid = ?10
+                ) END
+            """
+        insert_sql = f"""
+            INSERT INTO main.chat_messages
+                (sender_id, receiver_id, content, created_at, conversation_key,
+                 message_type, is_read, sync_status, server_id, message_uid)
+            SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?11
+            WHERE CASE WHEN ?10 IS NULL THEN NOT EXISTS (
+                SELECT 1 FROM main.chat_messages
+                WHERE sender_id = ?1 AND receiver_id = ?2 AND created_at = ?4 AND content = ?3
+            ) ELSE 1 END
+            {archive_check}
+            ON CONFLICT DO NOTHING
+        """
+
+        previous_created_at = None
+        for batch in _batches(messages, batch_size):
+            rows = []
+            for m in batch:
+                created_at = legacy_to_epoch_ms(m.get('created_at'))
+                if created_at is None:
+                    created_at = previous_created_at if previous_created_at is not None else now_ms()
+                previous_created_at = created_at = int(created_at)
+                rows.append((
+                    str(m['sender_id']), str(m['receiver_id']), m['content'], created_at,
+                    conversation_key(m['sender_id'], m['receiver_id']),
+                    m.get('message_type') or 'text', 1 if m.get('is_read') else 0,
+                    m.get('sync_status') or 'local', m.get('server_id'),
+                    m.get('message_uid'), m.get('message_uid') or new_message_uid()
+                ))
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = conn.executemany(insert_sql, rows)
+                inserted = max(cursor.rowcount, 0)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            stats['read'] += len(rows)
+            stats['inserted'] += inserted
+            stats['skipped'] += len(rows) - inserted
+    finally:
+        conn.close()
+        if stats['inserted']:
+            db.notify_listeners(MESSAGES_RESET)
+    return stats
+
+def import_file(db: ChatDatabase, path: str, batch_size: int = 1000) -> Dict[str, int]:
+    """从JSONL文件导入聊天记录"""
+    return import_messages(db, read_messages(path), batch_size)
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天记录导出/导入')
+    parser.add_argument('action', choices=['export', 'import'], help='导出或导入')
+    parser.add_argument('path', help='JSONL文件路径（.gz结尾时压缩）')
+    parser.add_argument('--db', help='聊天数据库路径，默认使用应用数据目录下的chat.db')
+    parser.add_argument('--user1', help='只导出与该用户相关的会话（需同时指定--user2）')
+    parser.add_argument('--user2', help='会话的另一方')
+    parser.add_argument('--batch-size', type=int, default=1000, help='每批处理的消息数')
+    args = parser.parse_args()
+
+    if (args.user1 is None) != (args.user2 is None):
+        parser.error('--user1 和 --user2 需要同时指定')
+
+    db = ChatDatabase(db_path=args.db)
+    try:
+        if args.action == 'export':
+            count = export_messages(db, args.path, args.user1, args.user2, args.batch_size)
+            print(f"已导出 {count} 条消息到 {args.path}")
+        else:
+            stats = import_file(db, args.path, args.batch_size)
+            print(f"读取 {stats['read']} 条，新增 {stats['inserted']} 条，跳过重复 {stats['skipped']} 条")
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
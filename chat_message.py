@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天消息记录模块
+消息时间统一以整数毫秒时间戳（Unix epoch）存储和传递
+"""
+
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+def new_message_uid() -> str:
+    """生成全局唯一的消息UID"""
+    return uuid.uuid4().hex
+
+def now_ms() -> int:
+    """当前时间的毫秒时间戳"""
+    return time.time_ns() // 1_000_000
+
+def to_epoch_ms(value: datetime) -> int:
+    """把datetime转换为毫秒时间戳（无时区的datetime按本地时间处理）"""
+    return int(round(value.timestamp() * 1000))
+
+def legacy_to_epoch_ms(value: Any) -> Optional[int]:
+    """把旧版本保存的本地时间ISO字符串转换为毫秒时间戳（时间格式回填完成前读取到的旧行）
+
+    Returns:
+        毫秒时间戳；已是整数时原样返回，无法解析时为None
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        return to_epoch_ms(datetime.fromisoformat(value.replace(' ', 'T', 1)))
+    except ValueError:
+        return None
+
+def from_epoch_ms(value: int) -> datetime:
+    """把毫秒时间戳转换为本地时间的datetime"""
+    return datetime.fromtimestamp(value / 1000)
+
+# 按分钟缓存的时间文本；同一会话的消息往往集中在相邻的几分钟内
+_time_text_cache: Dict[int, str] = {}
+_TIME_TEXT_CACHE_SIZE = 4096
+
+def format_time_text(value: int) -> str:
+    """把毫秒时间戳格式化为本地时间的 HH:MM"""
+    minute = value // 60000
+    text = _time_text_cache.get(minute)
+    if text is None:
+        local = time.localtime(minute * 60)
+        text = f"{local.tm_hour:02d}:{local.tm_min:02d}"
+        if len(_time_text_cache) >= _TIME_TEXT_CACHE_SIZE:
+            _time_text_cache.clear()
+        _time_text_cache[minute] = text
+    return text
+
+class ChatMessage:
+    """聊天消息记录
+
+    使用 __slots__ 的紧凑对象代替每行一个字典；显示用的时间文本在第一次
+    访问时格式化并缓存。为兼容旧代码，也支持 message['content'] 形式的读取。
+    """
+
+    __slots__ = ('id', 'sender_id', 'receiver_id', 'content', 'message_type',
+                 'created_at', 'is_read', 'message_uid', '_time_text')
+
+    # 与 from_row 对应的查询列
+    COLUMNS = 'id, sender_id, receiver_id, content, message_type, created_at, is_read, message_uid'
+
+    def __init__(self, id: int, sender_id: str, receiver_id: str, content: str,
+                 message_type: str = 'text', created_at: int = None, is_read: bool = False,
+                 message_uid: str = None):
+        """
+        Args:
+            id: 本地消息ID，尚未写入数据库时为None
+            sender_id: 发送者ID
+            receiver_id: 接收者ID
+            content: 消息内容
+            message_type: 消息类型
+            created_at: 创建时间（毫秒时间戳），默认当前时间
+            is_read: 是否已读
+            message_uid: 全局唯一的消息UID（旧消息在回填完成前可能为None）
+        """
+        self.id = id
+        self.sender_id = sender_id
+        self.receiver_id = receiver_id
+        self.content = content
+        self.message_type = message_type
+        self.created_at = now_ms() if created_at is None else created_at
+        self.is_read = is_read
+        self.message_uid = message_uid
+        self._time_text = None
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> 'ChatMessage':
+        """从按 COLUMNS 顺序查询出的行创建记录"""
+        created_at = row[5]
+        if isinstance(created_at, str):
+            created_at = legacy_to_epoch_ms(created_at)
+        return cls(row[0], row[1], row[2], row[3], row[4], created_at, bool(row[6]), row[7])
+
+    @property
+    def created_datetime(self) -> datetime:
+        """创建时间（本地时间）"""
+        return from_epoch_ms(self.created_at)
+
+    @property
+    def time_text(self) -> str:
+        """气泡上显示的时间文本（HH:MM）"""
+        if self._time_text is None:
+            try:
+                self._time_text = format_time_text(self.created_at)
+            except (TypeError, ValueError, OverflowError, OSError):
+                self._time_text = "未知"
+        return self._time_text
+
+    def __getitem__(self, key: str) -> Any:
+        if key.startswith('_') or key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            'id': self.id,
+            'sender_id': self.sender_id,
+            'receiver_id': self.receiver_id,
+            'content': self.content,
+            'message_type': self.message_type,
+            'created_at': self.created_at,
+            'is_read': self.is_read,
+            'message_uid': self.message_uid
+        }
+
+    def __repr__(self) -> str:
+        return (f"ChatMessage(id={self.id!r}, sender_id={self.sender_id!r}, "
+                f"receiver_id={self.receiver_id!r}, created_at={self.created_at!r})")
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天数据库迁移模块
+基于 PRAGMA user_version 的版本化迁移，以及在后台分批执行的数据回填
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional
+from PyQt5.QtCore import QObject, pyqtSignal
+
+class Backfill:
+    """分批数据回填
+
+    按主键区间分批执行update_sql（参数为区间的起止ID），全部完成后执行
+    finalize_sql（通常是创建依赖回填结果的索引）。进度保存在schema_backfills表中，
+    应用重启后从中断处继续。
+    """
+
+    def __init__(self, name: str, update_sql: str, finalize_sql: List[str] = None):
+        self.name = name
+        self.update_sql = update_sql
+        self.finalize_sql = finalize_sql or []
+
+class Migration:
+    """单个版本迁移"""
+
+    def __init__(self, version: int, description: str, upgrade: Callable[[sqlite3.Cursor], None],
+                 backfills: List[Backfill] = None, transactional: bool = True):
+        """
+        Args:
+            version: 迁移完成后的 user_version
+            description: 迁移说明
+            upgrade: 执行结构变更的函数，应只包含快速操作
+            backfills: 需要在后台分批执行的数据回填
+            transactional: 是否在事务中执行（VACUUM等语句不能在事务中执行）
+        """
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+        self.backfills = backfills or []
+        self.transactional = transactional
+
+def _create_base_schema(cursor: sqlite3.Cursor):
+    """v1: 聊天消息表及基础索引"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id TEXT NOT NULL,
+            receiver_id TEXT NOT NULL,
+            content TEXT NOT NULL,
+            message_type TEXT DEFAULT 'text',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_read BOOLEAN DEFAULT 0,
+            sync_status TEXT DEFAULT 'local'
+        )
+    """)
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_conversation
+        ON chat_messages(sender_id, receiver_id, created_at)
+    """)
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_unread
+        ON chat_messages(receiver_id, is_read)
+    """)
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_sync
+        ON chat_messages(sync_status)
+    """)
+
+def _create_unread_counters(cursor: sqlite3.Cursor):
+    """v2: 未读计数表及维护它的触发器
+
+    unread_counters按(接收者, 发送者)保存未读消息数，由chat_messages上的
+    INSERT/UPDATE/DELETE触发器在同一事务内精确维护，读取未读数无需再扫描消息表。
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS unread_counters (
+            receiver_id TEXT NOT NULL,
+            sender_id TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (receiver_id, sender_id)
+        ) WITHOUT ROWID
+    """)
+
+    # 新消息为未读时计数加一
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_unread_counters_insert
+        AFTER INSERT ON chat_messages
+        WHEN NEW.is_read = 0
+        BEGIN
+            INSERT INTO unread_counters (receiver_id, sender_id, count)
+            VALUES (NEW.receiver_id, NEW.sender_id, 1)
+            ON CONFLICT(receiver_id, sender_id) DO UPDATE SET count = count + 1;
+        END
+    """)
+
+    # 删除未读消息时计数减一，减到零时删除该行
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_unread_counters_delete
+        AFTER DELETE ON chat_messages
+        WHEN OLD.is_read = 0
+        BEGIN
+            UPDATE unread_counters SET count = count - 1
+            WHERE receiver_id = OLD.receiver_id AND sender_id = OLD.sender_id;
+            DELETE FROM unread_counters
+            WHERE receiver_id = OLD.receiver_id AND sender_id = OLD.sender_id AND count <= 0;
+        END
+    """)
+
+    # 更新时先按旧值扣除，再按新值累加（覆盖标记已读以及改动收发双方的情况）
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_unread_counters_update_old
+        AFTER UPDATE OF is_read, sender_id, receiver_id ON chat_messages
+        WHEN OLD.is_read = 0
+        BEGIN
+            UPDATE unread_counters SET count = count - 1
+            WHERE receiver_id = OLD.receiver_id AND sender_id = OLD.sender_id;
+            DELETE FROM unread_counters
+            WHERE receiver_id = OLD.receiver_id AND sender_id = OLD.sender_id AND count <= 0;
+        END
+    """)
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_unread_counters_update_new
+        AFTER UPDATE OF is_read, sender_id, receiver_id ON chat_messages
+        WHEN NEW.is_read = 0
+        BEGIN
+            INSERT INTO unread_counters (receiver_id, sender_id, count)
+            VALUES (NEW.receiver_id, NEW.sender_id, 1)
+            ON CONFLICT(receiver_id, sender_id) DO UPDATE SET count = count + 1;
+        END
+    """)
+
+    # 根据现有消息重建计数（旧版本可能已创建过计数表）
+    cursor.execute("DELETE FROM unread_counters")
+    cursor.execute("""
+        INSERT INTO unread_counters (receiver_id, sender_id, count)
+        SELECT receiver_id, sender_id, COUNT(*) FROM chat_messages
+        WHERE is_read = 0
+        GROUP BY receiver_id, sender_id
+    """)
+
+def _add_conversation_key(cursor: sqlite3.Cursor):
+    """v3: 会话键列，两人之间的消息共享同一个键，会话查询只需一次索引查找"""
+    cursor.execute("ALTER TABLE chat_messages ADD COLUMN conversation_key TEXT")
+
+def _add_sync_columns(cursor: sqlite3.Cursor):
+    """v4: 云端同步所需的服务器ID列与同步状态表"""
+    cursor.execute("ALTER TABLE chat_messages ADD COLUMN server_id INTEGER")
+
+    # 新列全为NULL，部分索引建立时不会写入任何条目
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_messages_server_id
+        ON chat_messages(server_id) WHERE server_id IS NOT NULL
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        ) WITHOUT ROWID
+    """)
+
+# 旧版本保存的本地时间ISO字符串对应的毫秒时间戳（无法解析时为NULL）
+ISO_TO_EPOCH_MS_SQL = "CAST(ROUND((julianday(created_at, 'utc') - 2440587.5) * 86400000) AS INTEGER)"
+
+# 时间格式回填完成前读取用的时间表达式：新旧两种格式混存时按同一标准比较和排序
+# （SQLite中整数总是排在字符串之前，直接按列排序会错乱）
+MIXED_CREATED_AT_SQL = f"(CASE WHEN typeof(created_at) = 'text' THEN {ISO_TO_EPOCH_MS_SQL} ELSE created_at END)"
+
+def epoch_ms_update_sql(table: str, condition: str = '') -> str:
+    """把 table 中的ISO字符串时间转换为毫秒时间戳的UPDATE语句
+
+    无法解析的时间取前一条已转换消息的时间，没有时取转换时刻，
+    不会被当成1970年的消息而被归档或清理。
+
+    Args:
+        table: 表名
+        condition: 附加的WHERE条件（如按ID区间分批）
+    """
+    return f"""
+        UPDATE {table} SET created_at = COALESCE(
+            {ISO_TO_EPOCH_MS_SQL},
+            (SELECT previous.created_at FROM {table} AS previous
+             WHERE previous.id < {table}.id AND typeof(previous.created_at) = 'integer'
+             ORDER BY previous.id DESC LIMIT 1),
+            CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)
+        )
+        WHERE typeof(created_at) = 'text'{condition}
+    """
+
+def _convert_timestamps(cursor: sqlite3.Cursor):
+    """v5: created_at 由ISO字符串改为整数毫秒时间戳
+
+    整数比较和排序比字符串快，也不再需要在读取时解析。已有消息在后台分批转换，
+    转换完成前读取使用兼容两种格式的时间表达式（见 MIXED_CREATED_AT_SQL）。
+    """
+    # 按时间范围查询（跨会话）以及按时间归档
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_created_at
+        ON chat_messages(created_at)
+    """)
+
+# 由数据库生成的消息UID，格式与 uuid.uuid4().hex 相同（32位小写十六进制）
+RANDOM_UID_SQL = "lower(hex(randomblob(16)))"
+
+def _add_message_uid(cursor: sqlite3.Cursor):
+    """v6: 全局唯一的消息UID
+
+    本地自增ID只在本机有效；同一条消息经重试、同步或重复导入再次到达时，
+    按UID命中唯一索引后直接忽略。已有消息的UID在后台分批补齐。
+    """
+    cursor.execute("ALTER TABLE chat_messages ADD COLUMN message_uid TEXT")
+
+    # 部分索引：回填前全为NULL，建立时不写入任何条目
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_messages_message_uid
+        ON chat_messages(message_uid) WHERE message_uid IS NOT NULL
+    """)
+
+MIGRATIONS = [
+    Migration(1, "创建聊天消息表", _create_base_schema),
+    Migration(2, "创建未读计数表", _create_unread_counters),
+    Migration(3, "添加会话键", _add_conversation_key, backfills=[
+        Backfill(
+            'conversation_key',
+            """
+                UPDATE chat_messages SET conversation_key = CASE
+                    WHEN sender_id < receiver_id THEN sender_id || '|' || receiver_id
+                    ELSE receiver_id || '|' || sender_id
+                END
+                WHERE id > ? AND id <= ? AND conversation_key IS NULL
+            """,
+            ["""
+                CREATE INDEX IF NOT EXISTS idx_chat_messages_conversation_key
+                ON chat_messages(conversation_key, created_at)
+            """]
+        )
+    ]),
+    Migration(4, "添加同步字段", _add_sync_columns),
+    Migration(5, "转换消息时间格式", _convert_timestamps, backfills=[
+        Backfill('epoch_ms', epoch_ms_update_sql('chat_messages', " AND id > ? AND id <= ?"))
+    ]),
+    Migration(6, "添加消息UID", _add_message_uid, backfills=[
+        Backfill(
+            'message_uid',
+            f"""
+                UPDATE chat_messages SET message_uid = {RANDOM_UID_SQL}
+                WHERE id > ? AND id <= ? AND message_uid IS NULL
+            """
+        )
+    ]),
+]
+
+class ChatMigrator(QObject):
+    """聊天数据库迁移执行器
+
+    结构迁移在启动时同步执行，每个版本一个事务；耗时的数据回填在后台线程中
+    分批执行，每批一个短事务，通过progress信号报告进度。
+    """
+
+    progress = pyqtSignal(str, int, int)   # 回填进度信号(说明, 已完成, 总数)
+    backfill_completed = pyqtSignal(str)   # 回填完成信号(回填名称)
+
+    def __init__(self, db_path: str, migrations: List[Migration] = None,
+                 batch_size: int = 2000, batch_pause: float = 0.005):
+        """
+        Args:
+            db_path: 数据库文件路径
+            migrations: 迁移列表，默认使用MIGRATIONS
+            batch_size: 回填时每批处理的ID区间大小
+            batch_pause: 两批之间让出写锁的时间（秒）
+        """
+        super().__init__()
+        self.db_path = db_path
+        self.migrations = sorted(migrations or MIGRATIONS, key=lambda m: m.version)
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+
+        self._completed_backfills = set()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def latest_version(self) -> int:
+        return self.migrations[-1].version if self.migrations else 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # 手动管理事务，保证DDL与user_version在同一事务内提交
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def migrate(self) -> int:
+        """执行所有未完成的结构迁移
+
+        Returns:
+            迁移后的数据库版本
+        """
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_backfills (
+                    name TEXT PRIMARY KEY,
+                    cursor_id INTEGER NOT NULL DEFAULT 0,
+                    target_id INTEGER NOT NULL DEFAULT 0,
+                    completed INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for migration in self.migrations:
+                if migration.version <= version:
+                    continue
+                version = self._apply(conn, migration)
+
+            for (name,) in conn.execute("SELECT name FROM schema_backfills WHERE completed = 1"):
+                self._completed_backfills.add(name)
+            return version
+        finally:
+            conn.close()
+
+    def _apply(self, conn: sqlite3.Connection, migration: Migration) -> int:
+        """在独立事务中执行单个迁移"""
+        cursor = conn.cursor()
+        if not migration.transactional:
+            migration.upgrade(cursor)
+            cursor.execute(f"PRAGMA user_version = {int(migration.version)}")
+            return migration.version
+
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # 拿到写锁后再确认一次版本，避免多个进程重复执行同一迁移
+            current = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if current >= migration.version:
+                cursor.execute("ROLLBACK")
+                return current
+
+            migration.upgrade(cursor)
+
+            if migration.backfills:
+                max_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM chat_messages").fetchone()[0]
+                for backfill in migration.backfills:
+                    cursor.execute("""
+                        INSERT OR REPLACE INTO schema_backfills (name, cursor_id, target_id, completed)
+                        VALUES (?, 0, ?, 0)
+                    """, (backfill.name, max_id))
+
+            cursor.execute(f"PRAGMA user_version = {int(migration.version)}")
+            cursor.execute("COMMIT")
+            return migration.version
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def is_backfill_complete(self, name: str) -> bool:
+        """回填是否已完成"""
+        return name in self._completed_backfills
+
+    def has_pending_backfills(self) -> bool:
+        """是否还有未完成的回填"""
+        return any(
+            backfill.name not in self._completed_backfills
+            for migration in self.migrations
+            for backfill in migration.backfills
+        )
+
+    def start_backfills(self):
+        """在后台线程中执行未完成的回填"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if not self.has_pending_backfills():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run_backfills, name='ChatBackfill', daemon=True)
+        self._thread.start()
+
+    def wait_for_backfills(self, timeout: Optional[float] = None) -> bool:
+        """等待后台回填结束
+
+        Returns:
+            是否在超时前结束
+        """
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def stop(self, timeout: float = 2.0) -> bool:
+        """停止后台回填（进度已保存，下次启动继续）"""
+        self._stop_event.set()
+        return self.wait_for_backfills(timeout)
+
+    def _run_backfills(self):
+        """后台回填线程"""
+        conn = self._connect()
+        try:
+            for migration in self.migrations:
+                for backfill in migration.backfills:
+                    if backfill.name in self._completed_backfills:
+                        continue
+                    if not self._run_backfill(conn, migration, backfill):
+                        return
+        except Exception as e:
+            print(f"聊天数据库回填失败: {e}")
+        finally:
+            conn.close()
+
+    def _run_backfill(self, conn: sqlite3.Connection, migration: Migration, backfill: Backfill) -> bool:
+        """分批执行单个回填，被中止时返回False"""
+        row = conn.execute(
+            "SELECT cursor_id, target_id FROM schema_backfills WHERE name = ?",
+            (backfill.name,)
+        ).fetchone()
+        if row is None:
+            return True
+        cursor_id, target_id = row
+
+        while cursor_id < target_id:
+            if self._stop_event.is_set():
+                return False
+
+            upper = min(cursor_id + self.batch_size, target_id)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(backfill.update_sql, (cursor_id, upper))
+                conn.execute(
+                    "UPDATE schema_backfills SET cursor_id = ? WHERE name = ?",
+                    (upper, backfill.name)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            cursor_id = upper
+            self.progress.emit(migration.description, cursor_id, target_id)
+            # 让出写锁，避免阻塞界面线程和写入队列
+            time.sleep(self.batch_pause)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql in backfill.finalize_sql:
+                conn.execute(sql)
+            conn.execute("UPDATE schema_backfills SET completed = 1 WHERE name = ?", (backfill.name,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._completed_backfills.add(backfill.name)
+        self.progress.emit(migration.description, target_id, target_id)
+        self.backfill_completed.emit(backfill.name)
+        return True
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天数据变更通知模块
+本进程的写入由 ChatDatabase 逐条通知，经会话缓存更新后按会话分发给订阅者；
+其他进程的写入通过轮询 PRAGMA data_version 发现（只读取WAL索引头，不访问数据页），
+发现后丢弃缓存并通知所有订阅者。窗口不再各自定时查询数据库
+"""
+
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional
+from PyQt5.QtCore import QObject, pyqtSignal
+from chat_database import MESSAGES_RESET, chat_db
+from chat_cache import conversation_cache
+
+class ChatChangeNotifier(QObject):
+    """聊天数据变更通知中心
+
+    订阅回调总是在界面线程中调用。本进程每次写入结束时立即记下新的 data_version，
+    轮询时 data_version 仍有变化即说明其他进程写入过数据库。本进程开始写入前先检查一次，
+    上次轮询之后其他进程的写入不会因为随后的本地写入一起被记下而丢失。
+    """
+
+    external_change = pyqtSignal()  # 检测到其他进程修改了数据库信号
+
+    def __init__(self, database, cache, interval: float = 1.0):
+        """
+        Args:
+            database: ChatDatabase 实例
+            cache: ConversationCache 实例，会话变化由它在更新缓存后发出
+            interval: 检查其他进程写入的间隔（秒）
+        """
+        super().__init__()
+        self.database = database
+        self.interval = interval
+        self._subscribers: Dict[str, List[Callable[[str], None]]] = {}
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_lock = threading.Lock()
+        self._data_version = None
+        self._external_pending = False
+        self._thread = None
+        self._stop_event = threading.Event()
+
+        cache.conversation_updated.connect(self._dispatch)
+        database.add_write_start_observer(self._check_before_local_write)
+        database.add_write_observer(self._absorb_local_write)
+
+    def subscribe(self, key: str, callback: Callable[[str], None]):
+        """订阅一个会话的变化
+
+        Args:
+            key: 会话键（conversation_key）
+            callback: 会话变化时调用，参数为会话键
+        """
+        callbacks = self._subscribers.setdefault(key, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+
+    def unsubscribe(self, key: str, callback: Callable[[str], None]):
+        """取消订阅"""
+        callbacks = self._subscribers.get(key)
+        if callbacks and callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del self._subscribers[key]
+
+    def _dispatch(self, key: str):
+        """把会话变化分发给该会话的订阅者"""
+        for callback in list(self._subscribers.get(key, ())):
+            try:
+                callback(key)
+            except Exception as e:
+                print(f"处理聊天变更通知失败: {e}")
+
+    def _read_data_version(self) -> int:
+        """读取 data_version（调用方持有 _conn_lock）"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.database.db_path, timeout=1,
+                                         check_same_thread=False)
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _check_before_local_write(self):
+        """本进程即将写入：data_version 已经变化说明期间有其他进程写入，留到下一轮轮询时通知
+
+        其他本地写入正在进行时它们的提交也会改变 data_version，无法区分，此时不作判断。
+        """
+        with self._conn_lock:
+            if self._data_version is None or self.database.has_active_writes():
+                return
+            try:
+                version = self._read_data_version()
+            except Exception as e:
+                print(f"检查聊天数据库变更失败: {e}")
+                return
+            if version != self._data_version:
+                self._external_pending = True
+                self._data_version = version
+
+    def _absorb_local_write(self):
+        """本进程的一次写入结束：记下它造成的 data_version 变化，轮询时不再当作其他进程的写入"""
+        with self._conn_lock:
+            if self._data_version is None:
+                return
+            try:
+                self._data_version = self._read_data_version()
+            except Exception as e:
+                print(f"检查聊天数据库变更失败: {e}")
+
+    def check_external_changes(self) -> bool:
+        """检查一次数据库是否被其他进程修改
+
+        data_version 在其他连接提交后变化。本进程的写入在结束时（仍计为进行中）已经记下
+        新的 data_version；有写入正在进行时本轮不作判断，留到下一轮。
+
+        Returns:
+            是否检测到其他进程的写入
+        """
+        with self._conn_lock:
+            if self.database.has_active_writes():
+                return False
+            try:
+                version = self._read_data_version()
+            except Exception as e:
+                print(f"检查聊天数据库变更失败: {e}")
+                return False
+            external = self._external_pending or (
+                self._data_version is not None and version != self._data_version)
+            self._external_pending = False
+            self._data_version = version
+
+        if external:
+            # 无法知道具体改了什么：缓存整体失效，缓存再通知各会话的订阅者
+            self.database.notify_listeners(MESSAGES_RESET)
+            self.external_change.emit()
+        return external
+
+    def start(self):
+        """启动后台检查"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='ChatChangeWatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0) -> bool:
+        """停止后台检查"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._data_version = None
+            self._external_pending = False
+        return self._thread is None or not self._thread.is_alive()
+
+    def _run(self):
+        """后台检查线程（第一次检查只记下当前的 data_version）"""
+        self.check_external_changes()
+        while not self._stop_event.wait(self.interval):
+            self.check_external_changes()
+
+# 全局变更通知实例
+chat_notifier = ChatChangeNotifier(chat_db, conversation_cache)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天数据服务模块
+聊天窗口的数据库读写都提交到专用的数据库线程按顺序执行，结果通过信号回到界面线程，
+数据库较大或被其他进程锁住时界面不再卡顿
+"""
+
+import queue
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5 import sip
+from chat_database import chat_db
+from chat_cache import conversation_cache
+from chat_message import ChatMessage
+
+def is_gui_thread() -> bool:
+    """当前是否为界面线程（QApplication 在主线程中创建）"""
+    return threading.current_thread() is threading.main_thread()
+
+class _GuiThreadCheckedConnection(sqlite3.Connection):
+    """在界面线程中执行语句时抛出 AssertionError 的连接"""
+
+    def _check(self):
+        assert not is_gui_thread(), "在界面线程中访问了SQLite数据库"
+
+    def cursor(self, *args, **kwargs):
+        self._check()
+        return super().cursor(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        self._check()
+        return super().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._check()
+        return super().executemany(*args, **kwargs)
+
+    def executescript(self, *args, **kwargs):
+        self._check()
+        return super().executescript(*args, **kwargs)
+
+_unchecked_connect = None
+
+def enable_gui_thread_check():
+    """调试模式：此后在界面线程中打开SQLite连接或执行语句都会抛出 AssertionError
+
+    在启动阶段的数据库初始化完成之后调用。
+    """
+    global _unchecked_connect
+    if _unchecked_connect is not None:
+        return
+    _unchecked_connect = sqlite3.connect
+
+    def checked_connect(*args, **kwargs):
+        assert not is_gui_thread(), "在界面线程中访问了SQLite数据库"
+        kwargs.setdefault('factory', _GuiThreadCheckedConnection)
+        return _unchecked_connect(*args, **kwargs)
+
+    sqlite3.connect = checked_connect
+
+def disable_gui_thread_check():
+    """取消界面线程检查"""
+    global _unchecked_connect
+    if _unchecked_connect is not None:
+        sqlite3.connect = _unchecked_connect
+        _unchecked_connect = None
+
+class ChatDataService(QObject):
+    """聊天数据服务
+
+    所有任务在同一个数据库线程中按提交顺序执行，回调在创建服务的线程（界面线程）中调用。
+    任务失败时打印错误，回调收到任务的默认结果。
+    """
+
+    _completed = pyqtSignal(object, object)  # 任务完成信号(回调, 结果)
+
+    def __init__(self, database, cache):
+        """
+        Args:
+            database: ChatDatabase 实例
+            cache: ConversationCache 实例
+        """
+        super().__init__()
+        self.database = database
+        self.cache = cache
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._completed.connect(self._deliver)
+
+    def submit(self, func: Callable, *args, callback: Callable[[Any], None] = None,
+               default: Any = None, **kwargs):
+        """在数据库线程中执行 func(*args, **kwargs)
+
+        Args:
+            func: 要执行的函数
+            callback: 完成后在界面线程中调用，参数为结果
+            default: 执行失败时交给回调的结果
+        """
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ChatData', daemon=True)
+                self._thread.start()
+            self._queue.put((func, args, kwargs, callback, default))
+
+    def load_recent(self, user1_id: str, user2_id: str, limit: int,
+                    callback: Callable[[List[ChatMessage]], None]):
+        """读取会话最近的消息（经会话缓存）"""
+        self.submit(self.cache.get_recent, user1_id, user2_id, limit,
+                    callback=callback, default=[])
+
+    def load_page(self, user1_id: str, user2_id: str, created_at: int, message_id: int,
+                  older: bool, limit: int, callback: Callable[[List[ChatMessage]], None]):
+        """读取游标之前或之后的一页消息（参数同 ChatDatabase.get_message_page）"""
+        self.submit(self.database.get_message_page, user1_id, user2_id, created_at, message_id,
+                    older, limit, callback=callback, default=[])
+
+    def prefetch(self, user1_id: str, user2_id: str):
+        """预先把会话加载到会话缓存（已缓存时不提交任务）"""
+        if self.cache.peek_recent(user1_id, user2_id, 0) is None:
+            self.submit(self.cache.prefetch, user1_id, user2_id)
+
+    def prefetch_recent(self, user_id: str, count: int = 10):
+        """预先加载用户最近活跃的若干个会话（如登录后）"""
+        self.submit(self.cache.prefetch_recent_conversations, user_id, count)
+
+    def mark_read(self, sender_id: str, receiver_id: str,
+                  callback: Callable[[bool], None] = None):
+        """标记消息为已读"""
+        self.submit(self.database.mark_messages_as_read, sender_id, receiver_id,
+                    callback=callback, default=False)
+
+    def send_message(self, sender_id: str, receiver_id: str, content: str, created_at: int,
+                     message_uid: str, callback: Callable[[Optional[int]], None] = None):
+        """保存发送的消息（进入后台组提交队列），写入完成后回调消息ID，失败时为None"""
+        self.submit(self._enqueue_message, sender_id, receiver_id, content, created_at,
+                    message_uid, callback)
+
+    def _enqueue_message(self, sender_id, receiver_id, content, created_at, message_uid, callback):
+        """在数据库线程中把消息交给写入队列，写入结果由写线程直接回调"""
+        try:
+            future = self.database.save_message_async(
+                sender_id=sender_id, receiver_id=receiver_id, content=content,
+                created_at=created_at, message_uid=message_uid
+            )
+        except Exception as e:
+            print(f"保存聊天消息失败: {e}")
+            if callback is not None:
+                self._completed.emit(callback, None)
+            return
+        if callback is not None:
+            future.add_done_callback(
+                lambda f: self._completed.emit(callback, None if f.exception() else f.result())
+            )
+
+    def flush(self, timeout: float = 2.0) -> bool:
+        """等待已提交的任务执行完（不含写入队列中的消息）"""
+        done = threading.Event()
+        self.submit(done.set)
+        return done.wait(timeout)
+
+    def stop(self, timeout: float = 2.0) -> bool:
+        """执行完已提交的任务后停止数据库线程"""
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return True
+            self._queue.put(None)
+        thread.join(timeout)
+        return not thread.is_alive()
+
+    def _run(self):
+        """数据库线程"""
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            func, args, kwargs, callback, default = task
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                print(f"执行聊天数据任务失败: {e}")
+                result = default
+            if callback is not None:
+                self._completed.emit(callback, result)
+
+    def _deliver(self, callback: Callable[[Any], None], result: Any):
+        """在界面线程中调用回调（回调所属的窗口已销毁时跳过）"""
+        owner = getattr(getattr(callback, 'func', callback), '__self__', None)
+        if isinstance(owner, QObject) and sip.isdeleted(owner):
+            return
+        try:
+            callback(result)
+        except Exception as e:
+            print(f"处理聊天数据结果失败: {e}")
+
+class ReadReceiptBatcher(QObject):
+    """已读回执合并器
+
+    每个会话在内存中记录"已读到的消息ID"水位，短暂防抖后（或窗口隐藏时）把所有会话的水位
+    在数据库线程中一次提交，连续收到多条消息时只写一次数据库。只在界面线程中使用。
+    """
+
+    def __init__(self, service: ChatDataService, delay_ms: int = 500):
+        """
+        Args:
+            service: 执行写入的 ChatDataService
+            delay_ms: 防抖时间（毫秒）
+        """
+        super().__init__()
+        self.service = service
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(delay_ms)
+        self._timer.timeout.connect(self.flush)
+
+    def mark_read(self, sender_id: str, receiver_id: str, message_id: int):
+        """把会话的已读水位推进到 message_id（不会后退），防抖后写入"""
+        key = (sender_id, receiver_id)
+        if message_id <= self._pending.get(key, 0):
+            return
+        self._pending[key] = message_id
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        """立即写入所有待提交的水位"""
+        self._timer.stop()
+        if not self._pending:
+            return
+        watermarks, self._pending = self._pending, {}
+        self.service.submit(self.service.database.mark_messages_read_up_to, watermarks, default=0)
+
+class UnreadCountService(QObject):
+    """当前用户的未读消息总数
+
+    总数由会话缓存随消息到达和已读事件在内存中维护，这里只在收到变化通知时
+    到数据库线程读取一次（通常不访问数据库），界面不再定时查询。只在界面线程中使用。
+    """
+
+    count_changed = pyqtSignal(int)  # 未读总数变化信号(未读总数)
+
+    def __init__(self, service: ChatDataService):
+        super().__init__()
+        self.service = service
+        self.user_id = None
+        self.count = 0
+        self._loading = False
+        self._reload_pending = False
+        service.cache.unread_changed.connect(self._on_unread_changed)
+
+    def watch(self, user_id: str):
+        """开始跟踪用户的未读总数（如登录后）"""
+        self.user_id = user_id
+        self.refresh()
+
+    def clear(self):
+        """停止跟踪（如退出登录时）"""
+        self.user_id = None
+        self._set_count(None, 0)
+
+    def refresh(self):
+        """在数据库线程中重新读取未读总数；读取期间的再次请求合并为一次"""
+        if self.user_id is None:
+            return
+        if self._loading:
+            self._reload_pending = True
+            return
+        self._loading = True
+        user_id = self.user_id
+        self.service.submit(self.service.cache.get_unread_count, user_id,
+                            callback=lambda count: self._on_loaded(user_id, count), default=None)
+
+    def _on_unread_changed(self, receiver_id: str):
+        if receiver_id == self.user_id:
+            self.refresh()
+
+    def _on_loaded(self, user_id: str, count: Optional[int]):
+        self._loading = False
+        if self._reload_pending:
+            self._reload_pending = False
+            self.refresh()
+            return
+        if count is not None:
+            self._set_count(user_id, count)
+
+    def _set_count(self, user_id: Optional[str], count: int):
+        if user_id != self.user_id or count == self.count:
+            return
+        self.count = count
+        self.count_changed.emit(count)
+
+# 全局聊天数据服务实例
+chat_service = ChatDataService(chat_db, conversation_cache)
+
+# 全局已读回执合并器
+read_receipts = ReadReceiptBatcher(chat_service)
+
+# 全局未读总数
+unread_counter = UnreadCountService(chat_service)
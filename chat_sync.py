@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天消息云端同步模块
+把本地 sync_status='local' 的消息批量上传到 Supabase，并按服务器游标增量拉取收到的消息
+"""
+
+import re
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+from PyQt5.QtCore import QObject, pyqtSignal
+from chat_database import chat_db
+from chat_message import to_epoch_ms
+from user_auth import user_auth
+
+# 拉取时从水位往前重叠的时间（毫秒），覆盖写入后尚未提交的消息（与服务端迁移 007 一致）
+PULL_OVERLAP_MS = 5000
+
+def to_server_time(created_at: int) -> str:
+    """把本地的毫秒时间戳转换为带时区的ISO时间"""
+    return datetime.fromtimestamp(created_at / 1000, tz=timezone.utc).isoformat()
+
+def to_local_time(server_time: str) -> int:
+    """把服务器返回的带时区ISO时间转换为本地使用的毫秒时间戳"""
+    text = server_time.replace('Z', '+00:00').replace(' ', 'T', 1)
+    # Python 3.9 的 fromisoformat 只接受3位或6位小数秒，Postgres可能返回其他位数
+    match = re.match(r'^(.*T\d{2}:\d{2}:\d{2})\.(\d+)(.*)$', text)
+    if match:
+        text = f"{match.group(1)}.{(match.group(2) + '000000')[:6]}{match.group(3)}"
+    return to_epoch_ms(datetime.fromisoformat(text))
+
+class ChatSyncEngine(QObject):
+    """聊天消息同步引擎
+
+    每轮同步先上传本地消息（批量upsert，以幂等键去重，重试不会产生重复），
+    再按服务端写入时间水位拉取新收到的消息（带重叠窗口，重复的消息按服务器ID和消息UID跳过）。后台线程按自适应间隔运行：
+    有数据往来时保持较短间隔，空闲或出错时逐步拉长。
+    """
+
+    sync_finished = pyqtSignal(dict)     # 一轮同步完成信号(统计信息)
+    messages_received = pyqtSignal(int)  # 收到新消息信号(新消息数)
+
+    def __init__(self, database, client, user_provider: Callable[[], Optional[Dict[str, Any]]],
+                 batch_size: int = 200, min_interval: float = 5.0, max_interval: float = 120.0):
+        """
+        Args:
+            database: ChatDatabase 实例
+            client: 提供 table() 接口的 Supabase/PostgREST 客户端
+            user_provider: 返回当前登录用户信息的函数
+            batch_size: 每次上传/拉取的最大消息数
+            min_interval: 最短同步间隔（秒）
+            max_interval: 最长同步间隔（秒）
+        """
+        super().__init__()
+        self.database = database
+        self.client = client
+        self.user_provider = user_provider
+        self.batch_size = batch_size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.interval = min_interval
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._sync_lock = threading.Lock()
+
+    def _device_id(self) -> str:
+        """本机设备ID，用于为尚未补齐消息UID的旧消息生成上传幂等键"""
+        device_id = self.database.get_sync_value('device_id')
+        if not device_id:
+            device_id = uuid.uuid4().hex
+            self.database.set_sync_value('device_id', device_id)
+        return device_id
+
+    def push(self, user_id: str) -> int:
+        """上传本地消息
+
+        Returns:
+            上传的消息数
+        """
+        device_id = self._device_id()
+        pushed = 0
+        while True:
+            messages = self.database.get_unsynced_messages(user_id, self.batch_size)
+            if not messages:
+                return pushed
+
+            keys = {}
+            payload = []
+            for message in messages:
+                # 消息UID全局唯一，直接作为服务器端的幂等键
+                client_key = message.message_uid or f"{device_id}:{message.id}"
+                keys[client_key] = message.id
+                payload.append({
+                    'client_key': client_key,
+                    'sender_id': message.sender_id,
+                    'receiver_id': message.receiver_id,
+                    'content': message.content,
+                    'message_type': message.message_type or 'text',
+                    'created_at': to_server_time(message.created_at),
+                })
+
+            # 冲突时合并而不是忽略，这样重试的批次也能拿回已存在行的服务器ID
+            result = self.client.table('chat_messages').upsert(
+                payload, on_conflict='client_key'
+            ).execute()
+
+            server_ids = {keys[row['client_key']]: row['id'] for row in result.data if row.get('client_key') in keys}
+            if not self.database.mark_messages_synced(server_ids):
+                raise RuntimeError("标记消息已同步失败")
+            pushed += len(server_ids)
+
+            if len(messages) < self.batch_size or not server_ids:
+                return pushed
+
+    def _pull_watermark(self, user_id: str) -> Optional[str]:
+        """读取拉取水位（服务端写入时间）
+
+        从旧版本升级时只有按 id 的游标，改用游标所在消息的写入时间接着拉取。
+        """
+        watermark = self.database.get_sync_value(f"pull_since:{user_id}")
+        if watermark is None:
+            legacy_cursor = self.database.get_sync_value(f"pull_cursor:{user_id}")
+            if legacy_cursor:
+                result = self.client.table('chat_messages').select(
+                    'server_received_at'
+                ).eq('id', int(legacy_cursor)).execute()
+                if result.data:
+                    watermark = result.data[0]['server_received_at']
+        return watermark
+
+    def pull(self, user_id: str) -> int:
+        """拉取新收到的消息
+
+        Returns:
+            新增的消息数
+        """
+        cursor_key = f"pull_since:{user_id}"
+        watermark = self._pull_watermark(user_id)
+        last = None  # 本轮已拉取到的 (写入时间, ID)，分页时从其后继续
+        received = 0
+        while True:
+            query = self.client.table('chat_messages').select(
+                'id, client_key, sender_id, receiver_id, content, message_type, created_at, server_received_at'
+            ).eq('receiver_id', user_id)
+            if last is not None:
+                query = query.or_(f"server_received_at.gt.{last[0]},"
+                                  f"and(server_received_at.eq.{last[0]},id.gt.{last[1]})")
+            elif watermark is not None:
+                query = query.gte('server_received_at',
+                                  to_server_time(to_local_time(watermark) - PULL_OVERLAP_MS))
+            result = query.order('server_received_at').order('id').limit(self.batch_size).execute()
+
+            rows = result.data or []
+            if not rows:
+                return received
+
+            messages = [{
+                'server_id': row['id'],
+                'message_uid': row.get('client_key'),
+                'sender_id': str(row['sender_id']),
+                'receiver_id': str(row['receiver_id']),
+                'content': row['content'],
+                'message_type': row.get('message_type') or 'text',
+                'created_at': to_local_time(row['created_at']),
+            } for row in rows]
+
+            last = (rows[-1]['server_received_at'], rows[-1]['id'])
+            if watermark is None or to_local_time(last[0]) >= to_local_time(watermark):
+                watermark = last[0]
+            received += self.database.save_inbound_messages(messages, cursor_key, watermark)
+
+            if len(rows) < self.batch_size:
+                return received
+
+    def sync_once(self) -> Dict[str, int]:
+        """执行一轮同步
+
+        Returns:
+            {'pushed': 上传数, 'pulled': 新收到的消息数}
+        """
+        user = self.user_provider()
+        if not user:
+            return {'pushed': 0, 'pulled': 0}
+
+        user_id = str(user['id'])
+        with self._sync_lock:
+            pushed = self.push(user_id)
+            pulled = self.pull(user_id)
+
+        stats = {'pushed': pushed, 'pulled': pulled}
+        if pulled:
+            self.messages_received.emit(pulled)
+        self.sync_finished.emit(stats)
+        return stats
+
+    def start(self):
+        """启动后台同步"""
+        if self._thread is not None and self._thread.is_alive():
+            self.request_sync()
+            return
+        self._stop_event.clear()
+        self.interval = self.min_interval
+        self._thread = threading.Thread(target=self._run, name='ChatSync', daemon=True)
+        self._thread.start()
+        self.request_sync()
+
+    def stop(self, timeout: float = 2.0) -> bool:
+        """停止后台同步"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def request_sync(self):
+        """请求尽快同步一次（如刚发送了消息）"""
+        self.interval = self.min_interval
+        self._wake_event.set()
+
+    def _run(self):
+        """后台同步线程"""
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+            if self._stop_event.is_set():
+                break
+
+            try:
+                stats = self.sync_once()
+                if stats['pushed'] or stats['pulled']:
+                    self.interval = self.min_interval
+                else:
+                    self.interval = min(self.interval * 2, self.max_interval)
+            except Exception as e:
+                print(f"聊天消息同步失败: {e}")
+                self.interval = min(max(self.interval * 2, self.min_interval * 4), self.max_interval)
+
+# 全局聊天同步实例
+chat_sync = ChatSyncEngine(chat_db, user_auth.supabase, user_auth.get_current_user)
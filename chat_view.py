@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天消息列表视图模块
+用模型/视图代替每条消息一组控件：模型按消息身份增量更新，委托直接绘制气泡，
+文本排版结果按消息缓存，视图只绘制可见的行
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QPointF, QRectF, QSize
+from PyQt5.QtGui import (QBrush, QColor, QFont, QFontMetrics, QPainter, QPen, QStaticText, QTextLayout,
+                         QTextOption)
+from PyQt5.QtWidgets import QListView, QStyledItemDelegate, QStyleOptionViewItem
+from chat_message import ChatMessage
+
+# 取出消息记录的数据角色
+MessageRole = Qt.UserRole + 1
+
+def message_key(message: ChatMessage):
+    """消息身份：优先使用UID（旧消息回填完成前退回本地ID）"""
+    return message.message_uid or message.id
+
+def order_key(message: ChatMessage):
+    """消息在会话中的排序键（与数据库查询的 created_at, id 一致，未写入的消息排在同一时刻之后）"""
+    return (message.created_at, message.id if message.id is not None else float('inf'))
+
+class MessageListModel(QAbstractListModel):
+    """聊天消息列表模型（按时间升序）"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._messages: List[ChatMessage] = []
+        self._keys: List[Any] = []
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._messages)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._messages):
+            return None
+        message = self._messages[index.row()]
+        if role == MessageRole:
+            return message
+        if role == Qt.DisplayRole:
+            return message.content
+        return None
+
+    def message_at(self, row: int) -> Optional[ChatMessage]:
+        """获取指定行的消息"""
+        if 0 <= row < len(self._messages):
+            return self._messages[row]
+        return None
+
+    def messages(self) -> List[ChatMessage]:
+        """当前的全部消息"""
+        return list(self._messages)
+
+    def row_of(self, key) -> int:
+        """消息身份所在的行，不存在时返回-1"""
+        try:
+            return self._keys.index(key)
+        except ValueError:
+            return -1
+
+    def last_key(self):
+        """最后一条消息的身份，列表为空时返回None"""
+        return self._keys[-1] if self._keys else None
+
+    def add_message(self, message: ChatMessage):
+        """在末尾追加一条消息（如刚发送、尚未写入数据库的消息）"""
+        row = len(self._messages)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._messages.append(message)
+        self._keys.append(message_key(message))
+        self.endInsertRows()
+
+    def set_messages(self, messages: List[ChatMessage]):
+        """按消息身份增量更新为新的消息列表
+
+        已有的行原地替换为新的消息记录，新消息按连续区间插入，不再出现的行按连续区间删除，
+        视图因此只重新排版发生变化的行。
+        """
+        messages = list(messages)
+        if not self._messages:
+            self.beginResetModel()
+            self._messages = messages
+            self._keys = [message_key(m) for m in messages]
+            self.endResetModel()
+            return
+
+        keys = [message_key(m) for m in messages]
+        wanted = set(keys)
+
+        # 从后往前按连续区间删除不再显示的行
+        row = len(self._keys) - 1
+        while row >= 0:
+            if self._keys[row] in wanted:
+                row -= 1
+                continue
+            last = row
+            while row >= 0 and self._keys[row] not in wanted:
+                row -= 1
+            self.beginRemoveRows(QModelIndex(), row + 1, last)
+            del self._messages[row + 1:last + 1]
+            del self._keys[row + 1:last + 1]
+            self.endRemoveRows()
+
+        present = set(self._keys)
+        changed_first, changed_last = None, None
+        index = 0
+        while index < len(keys):
+            key = keys[index]
+            if index < len(self._keys) and self._keys[index] == key:
+                if self._messages[index] is not messages[index]:
+                    self._messages[index] = messages[index]
+                    changed_first = index if changed_first is None else changed_first
+                    changed_last = index
+                index += 1
+            elif key in present:
+                # 顺序变化（如较早的消息晚到）时移动已有的行
+                source = self._keys.index(key, index)
+                self.beginMoveRows(QModelIndex(), source, source, QModelIndex(), index)
+                self._keys.insert(index, self._keys.pop(source))
+                self._messages.pop(source)
+                self._messages.insert(index, messages[index])
+                self.endMoveRows()
+                index += 1
+            else:
+                end = index
+                while end < len(keys) and keys[end] not in present:
+                    end += 1
+                self.beginInsertRows(QModelIndex(), index, end - 1)
+                self._messages[index:index] = messages[index:end]
+                self._keys[index:index] = keys[index:end]
+                self.endInsertRows()
+                index = end
+
+        if changed_first is not None:
+            self.dataChanged.emit(self.index(changed_first), self.index(changed_last), [MessageRole])
+
+class MessageBubbleDelegate(QStyledItemDelegate):
+    """直接绘制消息气泡的委托
+
+    每条消息的文本排版（QTextLayout）按 (消息身份, 可用宽度) 缓存，滚动和重绘时不再重新断行；
+    时间和已读状态预先排成 QStaticText。排版对象只保留最近使用的一部分，行高则全部保留，
+    视图对所有行计算高度时不必重新排版。画笔、画刷和字体在创建委托时一次生成，所有气泡共用，
+    不再为每条消息解析样式表。
+    """
+
+    BUBBLE_MAX_WIDTH = 300  # 气泡最大宽度
+    PADDING_H = 12          # 气泡内水平边距
+    PADDING_V = 8           # 气泡内垂直边距
+    RADIUS = 12             # 气泡圆角
+    MARGIN = 5              # 气泡与行边缘的距离
+    LAYOUT_CACHE_SIZE = 5000
+
+    def __init__(self, current_user_id: str, view: QListView):
+        super().__init__(view)
+        self.current_user_id = current_user_id
+        self.view = view
+
+        self.text_font = QFont(view.font())
+        self.text_font.setPixelSize(12)
+        self.time_font = QFont(view.font())
+        self.time_font.setPixelSize(10)
+        self.time_height = QFontMetrics(self.time_font).height()
+
+        # 发送的消息绿色靠右，接收的消息白色靠左
+        self.sent_brush = QBrush(QColor('#4CAF50'))
+        self.received_brush = QBrush(QColor('white'))
+        self.received_border = QPen(QColor('#e9ecef'), 1)
+        self.sent_text_pen = QPen(QColor('white'))
+        self.received_text_pen = QPen(QColor('#333333'))
+        self.time_pen = QPen(QColor('#95a5a6'))
+
+        self._layouts: 'OrderedDict[Tuple[Any, int], Tuple[QTextLayout, float, float]]' = OrderedDict()
+        self._sizes: Dict[Any, Tuple[float, float]] = {}
+        self._sizes_width = None
+        self._time_texts: 'OrderedDict[Any, Tuple[str, QStaticText]]' = OrderedDict()
+
+    def _text_width(self) -> int:
+        """气泡内文本的最大宽度"""
+        available = self.view.viewport().width() - 2 * self.MARGIN
+        return max(50, min(self.BUBBLE_MAX_WIDTH, available) - 2 * self.PADDING_H)
+
+    def text_layout(self, message: ChatMessage, width: int) -> Tuple[QTextLayout, float, float]:
+        """获取消息文本的排版结果
+
+        Returns:
+            (排版, 实际文本宽度, 文本高度)
+        """
+        cache_key = (message_key(message), width)
+        cached = self._layouts.get(cache_key)
+        if cached is not None:
+            self._layouts.move_to_end(cache_key)
+            return cached
+
+        layout = QTextLayout(message.content, self.text_font)
+        option = QTextOption()
+        option.setWrapMode(QTextOption.WrapAtWordBoundaryOrAnywhere)
+        layout.setTextOption(option)
+        layout.setCacheEnabled(True)
+
+        height = 0.0
+        text_width = 0.0
+        layout.beginLayout()
+        while True:
+            line = layout.createLine()
+            if not line.isValid():
+                break
+            line.setLineWidth(width)
+            line.setPosition(QPointF(0, height))
+            height += line.height()
+            text_width = max(text_width, line.naturalTextWidth())
+        layout.endLayout()
+
+        cached = (layout, text_width, height)
+        self._layouts[cache_key] = cached
+        if len(self._layouts) > self.LAYOUT_CACHE_SIZE:
+            self._layouts.popitem(last=False)
+        return cached
+
+    def time_text(self, message: ChatMessage, is_sent: bool) -> QStaticText:
+        """获取消息的时间和已读状态（预先排版的静态文本，状态变化时重新生成）"""
+        text = message.time_text
+        if is_sent and message.is_read:
+            text += " 已读"
+        key = message_key(message)
+        cached = self._time_texts.get(key)
+        if cached is not None and cached[0] == text:
+            self._time_texts.move_to_end(key)
+            return cached[1]
+
+        static_text = QStaticText(text)
+        static_text.setTextFormat(Qt.PlainText)
+        static_text.setPerformanceHint(QStaticText.AggressiveCaching)
+        static_text.prepare(font=self.time_font)
+        self._time_texts[key] = (text, static_text)
+        self._time_texts.move_to_end(key)
+        if len(self._time_texts) > self.LAYOUT_CACHE_SIZE:
+            self._time_texts.popitem(last=False)
+        return static_text
+
+    def text_size(self, message: ChatMessage, width: int) -> Tuple[float, float]:
+        """获取消息文本排版后的 (宽度, 高度)"""
+        if width != self._sizes_width:
+            self._sizes.clear()
+            self._sizes_width = width
+        key = message_key(message)
+        size = self._sizes.get(key)
+        if size is None:
+            _, text_width, text_height = self.text_layout(message, width)
+            size = self._sizes[key] = (text_width, text_height)
+        return size
+
+    def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex) -> QSize:
+        message = index.data(MessageRole)
+        if message is None:
+            return QSize(0, 0)
+        _, text_height = self.text_size(message, self._text_width())
+        height = text_height + 2 * self.PADDING_V + self.time_height + 2 * self.MARGIN + 2
+        return QSize(self.view.viewport().width(), int(height + 0.999))
+
+    def paint(self, painter, option: QStyleOptionViewItem, index: QModelIndex):
+        message = index.data(MessageRole)
+        if message is None:
+            return
+
+        layout, text_width, text_height = self.text_layout(message, self._text_width())
+        is_sent = message.sender_id == self.current_user_id
+        rect = option.rect
+
+        bubble_width = text_width + 2 * self.PADDING_H
+        bubble_height = text_height + 2 * self.PADDING_V
+        if is_sent:
+            left = rect.right() - self.MARGIN - bubble_width
+        else:
+            left = rect.left() + self.MARGIN
+        bubble = QRectF(left, rect.top() + self.MARGIN, bubble_width, bubble_height)
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+
+        if is_sent:
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(self.sent_brush)
+        else:
+            painter.setPen(self.received_border)
+            painter.setBrush(self.received_brush)
+        painter.drawRoundedRect(bubble, self.RADIUS, self.RADIUS)
+
+        painter.setPen(self.sent_text_pen if is_sent else self.received_text_pen)
+        layout.draw(painter, QPointF(bubble.left() + self.PADDING_H, bubble.top() + self.PADDING_V))
+
+        # 时间和已读状态
+        time_text = self.time_text(message, is_sent)
+        if is_sent:
+            time_left = rect.right() - self.MARGIN - time_text.size().width()
+        else:
+            time_left = rect.left() + self.MARGIN
+        painter.setFont(self.time_font)
+        painter.setPen(self.time_pen)
+        painter.drawStaticText(QPointF(time_left, bubble.bottom() + 2), time_text)
+
+        painter.restore()
+
+def create_message_view(current_user_id: str, parent=None) -> Tuple[QListView, MessageListModel]:
+    """创建消息列表视图及其模型"""
+    view = QListView(parent)
+    model = MessageListModel(view)
+    view.setModel(model)
+    view.setItemDelegate(MessageBubbleDelegate(current_user_id, view))
+
+    view.setSelectionMode(QListView.NoSelection)
+    view.setFocusPolicy(Qt.NoFocus)
+    view.setVerticalScrollMode(QListView.ScrollPerPixel)
+    view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+    view.setResizeMode(QListView.Adjust)
+    view.setUniformItemSizes(False)
+    # 聊天窗口按页加载消息，行数有上限，一次排版完成以便翻页时保持滚动位置
+    view.setLayoutMode(QListView.SinglePass)
+    view.setContextMenuPolicy(Qt.CustomContextMenu)
+    return view, model
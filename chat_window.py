@@ -5,115 +5,66 @@
 提供好友间聊天界面和功能
 """
 
+from functools import partial
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, 
-    QPushButton, QTextEdit, QScrollArea, QWidget, QFrame,
-    QMessageBox, QSizePolicy
+    QPushButton, QTextEdit, QWidget, QMessageBox, QSizePolicy,
+    QApplication, QMenu
 )
-from PyQt5.QtCore import Qt, pyqtSignal, QTimer, QThread, pyqtSlot
+from PyQt5.QtCore import Qt, pyqtSignal, QTimer, pyqtSlot
 from PyQt5.QtGui import QFont, QTextCursor, QPalette
-from datetime import datetime
 from user_auth import user_auth
-from chat_database import chat_db
-from typing import Dict, Any, List
+from chat_database import chat_db, conversation_key
+from chat_cache import conversation_cache
+from chat_notify import chat_notifier
+from chat_service import chat_service, read_receipts
+from chat_sync import chat_sync
+from chat_message import ChatMessage, new_message_uid
+from chat_view import MessageRole, create_message_view, message_key, order_key
+from typing import List
 
-class MessageBubble(QFrame):
-    """消息气泡组件"""
+class ChatWindow(QDialog):
+    """聊天窗口类
     
-    def __init__(self, message_data: Dict[str, Any], is_sent: bool, parent=None):
-        super().__init__(parent)
-        self.message_data = message_data
-        self.is_sent = is_sent
-        self.init_ui()
+    列表中只保留视口附近的若干页消息：向上滚动接近顶部时在后台线程读取更早的一页，
+    并预取再下一页；超过页数上限时卸载离视口最远的一页，回到底部时重新接上实时消息。
+    所有数据库读写经 chat_service 在数据库线程中执行，界面线程只处理回调。
+    """
     
-    def init_ui(self):
-        """初始化界面"""
-        layout = QVBoxLayout()
-        layout.setContentsMargins(5, 5, 5, 5)
-        layout.setSpacing(2)
-        
-        # 消息内容
-        content_label = QLabel(self.message_data['content'])
-        content_label.setWordWrap(True)
-        content_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
-        content_label.setStyleSheet("""
-            QLabel {
-                padding: 8px 12px;
-                border-radius: 12px;
-                font-size: 12px;
-                line-height: 1.4;
-            }
-        """)
-        
-        # 时间标签
-        try:
-            created_time = datetime.fromisoformat(self.message_data['created_at'])
-            time_text = created_time.strftime("%H:%M")
-        except:
-            time_text = "未知"
-        
-        time_label = QLabel(time_text)
-        time_label.setStyleSheet("font-size: 10px; color: #95a5a6;")
-        
-        if self.is_sent:
-            # 发送的消息（右对齐，绿色）
-            content_label.setStyleSheet(content_label.styleSheet() + """
-                QLabel {
-                    background-color: #4CAF50;
-                    color: white;
-                }
-            """)
-            time_label.setAlignment(Qt.AlignRight)
-            layout.addWidget(content_label)
-            layout.addWidget(time_label)
-            layout.setAlignment(Qt.AlignRight)
-        else:
-            # 接收的消息（左对齐，白色）
-            content_label.setStyleSheet(content_label.styleSheet() + """
-                QLabel {
-                    background-color: white;
-                    color: #333333;
-                    border: 1px solid #e9ecef;
-                }
-            """)
-            time_label.setAlignment(Qt.AlignLeft)
-            layout.addWidget(content_label)
-            layout.addWidget(time_label)
-            layout.setAlignment(Qt.AlignLeft)
-        
-        self.setLayout(layout)
-        self.setStyleSheet("background: transparent;")
-        
-        # 设置最大宽度
-        content_label.setMaximumWidth(300)
-
-class ChatWindow(QDialog):
-    """聊天窗口类"""
+    PAGE_SIZE = 50        # 每页消息数
+    MAX_PAGES = 6         # 列表中最多保留的页数
+    LOAD_THRESHOLD = 300  # 滚动到距离顶部/底部多少像素时加载相邻的一页
     
     def __init__(self, friend_id: str, friend_username: str, parent=None):
         super().__init__(parent)
         self.friend_id = friend_id
         self.friend_username = friend_username
         self.current_user = user_auth.get_current_user()
+        self.subscribed = False          # 是否订阅了本会话的变更通知（隐藏时取消）
         
         if not self.current_user:
             QMessageBox.warning(self, "错误", "请先登录")
             self.close()
             return
         
-        self.message_widgets = []
-        self.refresh_timer = QTimer()
-        self.refresh_timer.timeout.connect(self.load_messages)
+        self.conversation_key = conversation_key(self.current_user['id'], friend_id)
+        self.at_live_end = True          # 列表是否包含最新的消息（是否跟随实时消息）
+        self.history_exhausted = False   # 是否已经加载到最早的消息
+        self.pending_pages = set()       # 正在读取的分页方向('older'/'newer')
+        self.recent_loading = False      # 是否正在读取最新的消息
+        self.reload_pending = False      # 读取期间又收到了变更通知
+        self.prefetched = {}             # 方向 -> (游标, 预取的一页消息)
+        self.page_generation = 0         # 列表重置后丢弃过期的分页结果
         
         self.init_ui()
         self.setup_connections()
-        self.load_messages()
-        
-        # 标记消息为已读
-        chat_db.mark_messages_as_read(self.friend_id, self.current_user['id'])
-        
-        # 每5秒刷新一次消息
-        self.refresh_timer.start(5000)
+        # 会话已预取到内存时立即显示，否则在数据库线程中读取；之后只在收到本会话的变更通知时刷新
+        cached = conversation_cache.peek_recent(self.current_user['id'], friend_id,
+                                                conversation_cache.capacity)
+        if cached is not None:
+            self.on_recent_loaded(cached)
+        else:
+            self.load_messages()
     
     def init_ui(self):
         """初始化界面"""
@@ -126,7 +77,7 @@ class ChatWindow(QDialog):
             QDialog {
                 background-color: #f5f5f5;
             }
-            QScrollArea {
+            QListView {
                 border: none;
                 background-color: transparent;
             }
@@ -196,19 +147,11 @@ class ChatWindow(QDialog):
         
         layout.addLayout(title_layout)
         
-        # 消息显示区域
-        self.messages_scroll = QScrollArea()
-        self.messages_scroll.setWidgetResizable(True)
-        self.messages_scroll.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
-        self.messages_scroll.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        
-        self.messages_container = QWidget()
-        self.messages_layout = QVBoxLayout(self.messages_container)
-        self.messages_layout.setSpacing(8)
-        self.messages_layout.addStretch()
-        
-        self.messages_scroll.setWidget(self.messages_container)
-        layout.addWidget(self.messages_scroll)
+        # 消息显示区域（模型/视图，只绘制可见的消息）
+        self.message_view, self.message_model = create_message_view(self.current_user['id'])
+        self.message_view.customContextMenuRequested.connect(self.show_message_menu)
+        self.message_view.verticalScrollBar().valueChanged.connect(self.on_scrolled)
+        layout.addWidget(self.message_view)
         
         # 输入区域
         input_layout = QHBoxLayout()
@@ -239,6 +182,9 @@ class ChatWindow(QDialog):
         self.send_btn.clicked.connect(self.send_message)
         self.message_input.returnPressed.connect(self.send_message)
         self.message_input.textChanged.connect(self.on_input_changed)
+        chat_db.migrator.progress.connect(self.on_migration_progress)
+        chat_notifier.subscribe(self.conversation_key, self.on_conversation_updated)
+        self.subscribed = True
     
     def on_input_changed(self, text):
         """输入框内容改变"""
@@ -250,119 +196,264 @@ class ChatWindow(QDialog):
         if not content:
             return
         
-        # 禁用发送按钮
-        self.send_btn.setEnabled(False)
-        self.send_btn.setText('发送中...')
-        
-        try:
-            # 保存到本地数据库
-            message_id = chat_db.save_message(
-                sender_id=self.current_user['id'],
-                receiver_id=self.friend_id,
-                content=content
-            )
-            
-            if message_id:
-                # 清空输入框
-                self.message_input.clear()
-                
-                # 立即显示发送的消息
-                message_data = {
-                    'id': message_id,
-                    'sender_id': self.current_user['id'],
-                    'receiver_id': self.friend_id,
-                    'content': content,
-                    'created_at': datetime.now().isoformat(),
-                    'is_read': False
-                }
-                
-                self.add_message_bubble(message_data, is_sent=True)
-                self.scroll_to_bottom()
-                
-                self.status_label.setText('消息已发送')
-                QTimer.singleShot(2000, lambda: self.status_label.setText(''))
-            else:
-                self.status_label.setText('发送失败')
-                QTimer.singleShot(2000, lambda: self.status_label.setText(''))
-        
-        except Exception as e:
-            self.status_label.setText(f'发送失败: {str(e)}')
-            QTimer.singleShot(3000, lambda: self.status_label.setText(''))
-        
-        finally:
-            # 恢复发送按钮
-            self.send_btn.setEnabled(True)
-            self.send_btn.setText('发送')
-            self.message_input.setFocus()
+        # 清空输入框并立即显示发送的消息，写库在后台组提交完成；
+        # 发送按钮只取决于输入框内容，不等待写入结果
+        self.message_input.clear()
+        
+        # 界面上的临时消息与写入数据库的记录共用同一个UID，刷新时不会重复显示
+        message_data = ChatMessage(None, self.current_user['id'], self.friend_id, content,
+                                   message_uid=new_message_uid())
+        
+        if not self.at_live_end:
+            self.reset_to_latest()
+        self.message_model.add_message(message_data)
+        self.scroll_to_bottom()
+        
+        # 保存到本地数据库（数据库线程提交给写入队列，结果回到界面线程；窗口已销毁时不回调）
+        chat_service.send_message(
+            self.current_user['id'], self.friend_id, content,
+            message_data.created_at, message_data.message_uid,
+            callback=partial(self.on_message_saved, message_data=message_data)
+        )
+        
+        self.message_input.setFocus()
     
-    def load_messages(self):
-        """加载聊天记录"""
-        try:
-            messages = chat_db.get_conversation_history(
-                self.current_user['id'], 
-                self.friend_id, 
-                limit=50
-            )
-            
-            # 检查是否有新消息
-            if len(messages) != len(self.message_widgets):
-                self.refresh_messages(messages)
-                
-                # 标记新收到的消息为已读
-                chat_db.mark_messages_as_read(self.friend_id, self.current_user['id'])
-        
-        except Exception as e:
-            print(f"加载聊天记录失败: {e}")
+    def on_migration_progress(self, description: str, done: int, total: int):
+        """聊天记录后台升级进度"""
+        if total and done < total:
+            self.status_label.setText(f'{description}: {done * 100 // total}%')
+        else:
+            self.status_label.setText('')
+    
+    def on_message_saved(self, message_id, message_data: ChatMessage):
+        """后台写入完成"""
+        if message_id:
+            message_data.id = message_id
+            # 尽快上传到云端
+            chat_sync.request_sync()
+            self.status_label.setText('消息已发送')
+            QTimer.singleShot(2000, lambda: self.status_label.setText(''))
+        else:
+            self.status_label.setText('发送失败')
+            QTimer.singleShot(2000, lambda: self.status_label.setText(''))
+    
+    def on_conversation_updated(self, key: str):
+        """本会话发生变化（变更通知中心回调）"""
+        self.load_messages()
     
-    def refresh_messages(self, messages: List[Dict[str, Any]]):
-        """刷新消息列表"""
-        # 清空现有消息
-        for widget in self.message_widgets:
-            widget.setParent(None)
-        self.message_widgets.clear()
-        
-        # 添加新消息
-        for message in messages:
-            is_sent = message['sender_id'] == self.current_user['id']
-            self.add_message_bubble(message, is_sent)
+    def load_messages(self):
+        """加载最新的聊天记录（在数据库线程中从共享的会话缓存读取）
         
-        self.scroll_to_bottom()
+        读取期间再次收到变更通知时，只在这次读取完成后再读一次。
+        """
+        if not self.at_live_end:
+            return
+        if self.recent_loading:
+            self.reload_pending = True
+            return
+        self.recent_loading = True
+        chat_service.load_recent(self.current_user['id'], self.friend_id,
+                                 conversation_cache.capacity, self.on_recent_loaded)
     
-    def add_message_bubble(self, message_data: Dict[str, Any], is_sent: bool):
-        """添加消息气泡"""
-        bubble = MessageBubble(message_data, is_sent)
-        
-        # 创建容器来控制对齐
-        container = QWidget()
-        container_layout = QHBoxLayout(container)
-        container_layout.setContentsMargins(0, 0, 0, 0)
-        
-        if is_sent:
-            container_layout.addStretch()
-            container_layout.addWidget(bubble)
+    def on_recent_loaded(self, live: List[ChatMessage]):
+        """最新的消息回到界面线程
+        
+        缓存中的消息与列表中已加载的更早的页合并；列表停留在较早的历史位置时不跟随实时消息。
+        """
+        self.recent_loading = False
+        if self.reload_pending:
+            self.reload_pending = False
+            self.load_messages()
+            return
+        if not self.at_live_end:
+            return
+        
+        rows = self.message_model.messages()
+        first_load = not rows
+        if first_load:
+            messages = live[-self.PAGE_SIZE:]
+        elif not live:
+            messages = []
         else:
-            container_layout.addWidget(bubble)
-            container_layout.addStretch()
+            # 早于缓存范围的行保留，缓存范围内以缓存为准；尚未写入的消息保留在末尾
+            live_start, rows_start = order_key(live[0]), order_key(rows[0])
+            live_keys = {message_key(m) for m in live}
+            messages = [m for m in rows if order_key(m) < live_start]
+            messages += [m for m in live if order_key(m) >= rows_start]
+            messages += [m for m in rows if m.id is None and message_key(m) not in live_keys]
+        
+        self.render_messages(messages)
+        
+        # 第一次打开时预取更早的一页
+        if first_load and len(live) >= self.PAGE_SIZE:
+            self.start_page_load('older', self._page_cursor(messages, 'older'), prefetch=True)
+        
+        # 推进已读水位（防抖后与其他会话一起写入）
+        unread_ids = [m.id for m in live if m.sender_id == self.friend_id and not m.is_read and m.id]
+        if unread_ids:
+            read_receipts.mark_read(self.friend_id, self.current_user['id'], max(unread_ids))
+    
+    def render_messages(self, messages: List[ChatMessage]):
+        """按消息身份增量更新消息列表（已显示的消息原地更新，只插入新消息）"""
+        scrollbar = self.message_view.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum() - 10
+        last_key = self.message_model.last_key()
+        
+        self.message_model.set_messages(messages)
+        
+        if at_bottom and self.message_model.last_key() != last_key:
+            # 停在底部时新消息不断累积，超出上限后卸载最早的消息
+            overflow = self.message_model.rowCount() - self.MAX_PAGES * self.PAGE_SIZE
+            if overflow > 0:
+                self.message_model.set_messages(self.message_model.messages()[overflow:])
+                self.history_exhausted = False
+            self.scroll_to_bottom()
+    
+    def on_scrolled(self, value: int):
+        """滚动时按需加载相邻的一页"""
+        if value <= self.LOAD_THRESHOLD:
+            self.request_page('older')
+        elif not self.at_live_end and value >= self.message_view.verticalScrollBar().maximum() - self.LOAD_THRESHOLD:
+            self.request_page('newer')
+    
+    def request_page(self, direction: str):
+        """请求列表顶部之前（older）或底部之后（newer）的一页消息"""
+        if direction in self.pending_pages or (direction == 'older' and self.history_exhausted):
+            return
+        rows = self.message_model.messages()
+        if not rows:
+            return
         
-        # 插入到消息列表中（在stretch之前）
-        self.messages_layout.insertWidget(self.messages_layout.count() - 1, container)
-        self.message_widgets.append(container)
+        cursor = self._page_cursor(rows, direction)
+        prefetched = self.prefetched.pop(direction, None)
+        if prefetched is not None and prefetched[0] == cursor:
+            self.apply_page(direction, prefetched[1])
+        else:
+            self.start_page_load(direction, cursor, prefetch=False)
+    
+    def _page_cursor(self, rows: List[ChatMessage], direction: str):
+        """分页游标：列表首条或末条已写入数据库的消息的 (created_at, id)"""
+        saved = [m for m in rows if m.id is not None] or rows
+        message = saved[0] if direction == 'older' else saved[-1]
+        return (message.created_at, message.id or 0)
+    
+    def start_page_load(self, direction: str, cursor, prefetch: bool):
+        """在数据库线程中读取一页消息"""
+        generation = self.page_generation
+        self.pending_pages.add(direction)
+        chat_service.load_page(
+            self.current_user['id'], self.friend_id, cursor[0], cursor[1],
+            direction == 'older', self.PAGE_SIZE,
+            lambda messages: self.on_page_loaded(direction, cursor, prefetch, generation, messages)
+        )
+    
+    def on_page_loaded(self, direction: str, cursor, prefetch: bool, generation: int,
+                       messages: List[ChatMessage]):
+        """读取的一页消息回到界面线程"""
+        self.pending_pages.discard(direction)
+        if generation != self.page_generation:
+            return
+        if prefetch:
+            self.prefetched[direction] = (cursor, messages)
+            # 预取期间已经滚动到需要这一页的位置
+            self.on_scrolled(self.message_view.verticalScrollBar().value())
+        elif self.message_model.rowCount() and self._page_cursor(self.message_model.messages(), direction) == cursor:
+            self.apply_page(direction, messages)
+    
+    def apply_page(self, direction: str, page: List[ChatMessage]):
+        """把一页消息接到列表的一端，并在另一端卸载超出上限的消息"""
+        rows = self.message_model.messages()
+        limit = self.MAX_PAGES * self.PAGE_SIZE
+        
+        if direction == 'older':
+            if len(page) < self.PAGE_SIZE:
+                self.history_exhausted = True
+            messages = page + rows
+            if len(messages) > limit:
+                messages = messages[:limit]
+                self.at_live_end = False
+        else:
+            messages = rows + page
+            if len(messages) > limit:
+                messages = messages[len(messages) - limit:]
+                self.history_exhausted = False
+            if len(page) < self.PAGE_SIZE:
+                self.at_live_end = True
+        
+        self.set_messages_anchored(messages)
+        
+        if direction == 'newer' and self.at_live_end:
+            self.load_messages()
+        
+        # 预取同一方向的下一页，继续滚动时不必等待
+        if page and not (direction == 'older' and self.history_exhausted) and \
+                not (direction == 'newer' and self.at_live_end):
+            self.start_page_load(direction, self._page_cursor(messages, direction), prefetch=True)
+    
+    def set_messages_anchored(self, messages: List[ChatMessage]):
+        """更新列表并保持视口顶部的消息位置不变"""
+        view = self.message_view
+        anchor = view.indexAt(view.viewport().rect().topLeft())
+        anchor_key, anchor_top = None, 0
+        if anchor.isValid():
+            anchor_key = message_key(anchor.data(MessageRole))
+            anchor_top = view.visualRect(anchor).top()
+        
+        self.message_model.set_messages(messages)
+        
+        row = self.message_model.row_of(anchor_key) if anchor_key is not None else -1
+        if row >= 0:
+            view.doItemsLayout()
+            scrollbar = view.verticalScrollBar()
+            index = self.message_model.index(row)
+            scrollbar.setValue(scrollbar.value() + view.visualRect(index).top() - anchor_top)
+    
+    def reset_to_latest(self):
+        """丢弃已加载的历史页，回到最新的消息"""
+        self.page_generation += 1
+        self.prefetched.clear()
+        self.history_exhausted = False
+        self.at_live_end = True
+        self.message_model.set_messages([])
+        self.load_messages()
+    
+    def show_message_menu(self, pos):
+        """消息右键菜单"""
+        message = self.message_view.indexAt(pos).data(MessageRole)
+        if message is None:
+            return
+        menu = QMenu(self)
+        copy_action = menu.addAction('复制')
+        if menu.exec_(self.message_view.viewport().mapToGlobal(pos)) == copy_action:
+            QApplication.clipboard().setText(message.content)
     
     def scroll_to_bottom(self):
         """滚动到底部"""
-        QTimer.singleShot(100, lambda: (
-            self.messages_scroll.verticalScrollBar().setValue(
-                self.messages_scroll.verticalScrollBar().maximum()
-            )
-        ))
+        QTimer.singleShot(0, self.message_view.scrollToBottom)
     
     def closeEvent(self, event):
         """关闭事件"""
-        self.refresh_timer.stop()
+        # 关闭后回到界面线程的分页结果直接丢弃
+        self.page_generation += 1
         super().closeEvent(event)
     
+    def hideEvent(self, event):
+        """隐藏事件：立即写入已读回执，并停止接收变更通知
+        
+        按Esc关闭（reject）只隐藏窗口而没有关闭事件，因此在这里取消订阅。
+        """
+        read_receipts.flush()
+        if self.subscribed:
+            chat_notifier.unsubscribe(self.conversation_key, self.on_conversation_updated)
+            self.subscribed = False
+        super().hideEvent(event)
+    
     def showEvent(self, event):
-        """显示事件"""
+        """显示事件：重新显示时恢复订阅，并补上隐藏期间的变化"""
+        if not self.subscribed:
+            chat_notifier.subscribe(self.conversation_key, self.on_conversation_updated)
+            self.subscribed = True
+            self.load_messages()
         super().showEvent(event)
         self.message_input.setFocus()
         self.scroll_to_bottom()
\ No newline at end of file
@@ -12,7 +12,7 @@ from PyQt5.QtWidgets import (
     QVBoxLayout, QHBoxLayout, QPushButton, QSizePolicy, QDesktopWidget
 )
 from PyQt5.QtCore import Qt, QPoint, QPropertyAnimation, QEasingCurve, pyqtSignal, QTimer, QTime, QStandardPaths, QRectF, QPointF
-from PyQt5.QtGui import QPixmap, QPainter, QColor, QPainterPath, QFont, QCursor, QPen
+from PyQt5.QtGui import QPixmap, QPainter, QColor, QPainterPath, QFont, QFontMetrics, QCursor, QPen
 from PyQt5.QtWidgets import QDesktopWidget
 
 from pet_state import PetState
@@ -26,6 +26,11 @@ from register_dialog import RegisterDialog
 from user_auth import user_auth
 from friends_dialog import FriendsDialog
 from chat_window import ChatWindow
+from chat_sync import chat_sync
+from chat_cache import conversation_cache
+from chat_service import chat_service, unread_counter
+from presence import presence_service
+from friends_sync import friends_sync
 
 # PyInstaller资源路径辅助函数
 def resource_path(relative_path: str) -> str:
@@ -187,6 +192,8 @@ class DesktopPet(QWidget):
         self.drag_start_position = QPoint()
         self.images = {}
         self.original_images = {}  # 新增：保留原始图像，便于缩放
+        self.unread_count = 0      # 未读消息总数（由 unread_counter 推送）
+        self.badge_images = {}     # 状态 -> 叠加了未读角标的图像（未读数或尺寸变化时重建）
         self.pet_label = None
         self.fall_animation = None
         # 叶子下落动画相关
@@ -276,6 +283,9 @@ class DesktopPet(QWidget):
         self.login_dialog = None
         self.register_dialog = None
         
+        # 未读消息总数变化时更新角标
+        unread_counter.count_changed.connect(self.on_unread_count_changed)
+        
         # 应用启动时尝试自动登录（记住我）
         try:
             self.try_auto_login()
@@ -350,6 +360,45 @@ class DesktopPet(QWidget):
         
         return pixmap
     
+    def display_pixmap(self, state_key):
+        """获取状态对应的显示图像：有未读消息时为预先合成了角标的图像"""
+        pixmap = self.images[state_key]
+        if not self.unread_count:
+            return pixmap
+        badged = self.badge_images.get(state_key)
+        if badged is None:
+            badged = self.create_badge_image(pixmap, self.unread_count)
+            self.badge_images[state_key] = badged
+        return badged
+    
+    def create_badge_image(self, pixmap, count):
+        """在图像右上角合成未读角标"""
+        badged = QPixmap(pixmap)
+        text = str(count) if count < 100 else '99+'
+        diameter = max(16, int(min(pixmap.width(), pixmap.height()) * 0.3))
+        font = QFont()
+        font.setBold(True)
+        font.setPixelSize(max(9, int(diameter * (0.6 if len(text) == 1 else 0.48))))
+        width = max(diameter, QFontMetrics(font).horizontalAdvance(text) + diameter // 2)
+        rect = QRectF(badged.width() - width - 1, 1, width, diameter)
+        
+        painter = QPainter(badged)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(QPen(QColor('white'), 1.5))
+        painter.setBrush(QColor('#e74c3c'))
+        painter.drawRoundedRect(rect, diameter / 2, diameter / 2)
+        painter.setFont(font)
+        painter.drawText(rect, Qt.AlignCenter, text)
+        painter.end()
+        return badged
+    
+    def on_unread_count_changed(self, count):
+        """未读消息总数变化：只重建一次角标图像"""
+        self.unread_count = count
+        self.badge_images.clear()
+        if self.pet_label is not None and self.current_state.value in self.images:
+            self.pet_label.setPixmap(self.display_pixmap(self.current_state.value))
+    
     def set_initial_position(self):
         """设置初始位置在屏幕右下角（使用可用工作区）"""
         rect = self._available_rect()
@@ -381,7 +430,7 @@ class DesktopPet(QWidget):
             QApplication.processEvents()
             
             # 设置新的图像
-            self.pet_label.setPixmap(self.images[state_key])
+            self.pet_label.setPixmap(self.display_pixmap(state_key))
             
             if is_macos:
                 # Mac特定：重新显示窗口
@@ -593,6 +642,13 @@ class DesktopPet(QWidget):
         # 更新菜单状态
         self.update_menu()
         
+        # 开始后台同步聊天消息和好友数据，显示未读角标，预取最近的会话，发送在线心跳
+        chat_sync.start()
+        unread_counter.watch(user_auth.get_current_user()['id'])
+        chat_service.prefetch_recent(user_auth.get_current_user()['id'])
+        presence_service.start()
+        friends_sync.start()
+        
         # 可以在这里添加登录成功后的处理逻辑
         # 比如显示欢迎消息等
     
@@ -606,6 +662,9 @@ class DesktopPet(QWidget):
         # 立即更新UI状态，给用户即时反馈
         print("正在登出...")
         
+        # 先停止心跳，避免登出后又被心跳标记为在线
+        presence_service.stop()
+        
         # 异步执行登出操作
         from async_worker import LogoutWorker, task_manager
         
@@ -617,6 +676,13 @@ class DesktopPet(QWidget):
     def on_logout_finished(self, result: dict):
         """登出完成"""
         if result.get('success'):
+            # 停止聊天消息和好友数据同步（本地副本按用户保存，下次登录直接显示）
+            chat_sync.stop()
+            friends_sync.stop()
+            unread_counter.clear()
+            presence_service.reset()
+            conversation_cache.clear()
+            
             # 清除所有缓存数据
             from cache_manager import user_cache
             user_cache.clear_all()
@@ -1386,7 +1452,7 @@ class DesktopPet(QWidget):
         
         # 更新当前显示
         if self.current_state and self.current_state.value in self.images:
-            self.pet_label.setPixmap(self.images[self.current_state.value])
+            self.pet_label.setPixmap(self.display_pixmap(self.current_state.value))
         
         # 确保窗口在屏幕内
         rect = self._available_rect()
@@ -1409,6 +1475,7 @@ class DesktopPet(QWidget):
                     Qt.KeepAspectRatio,
                     Qt.SmoothTransformation
                 )
+            self.badge_images.clear()
         except Exception as e:
             print(f"重建缩放图像失败: {e}")
 
@@ -1467,6 +1534,12 @@ class DesktopPet(QWidget):
                     self.login_dialog.close()
                 # 刷新菜单以反映登录状态
                 self.update_menu()
+                # 开始后台同步聊天消息和好友数据，显示未读角标，预取最近的会话，发送在线心跳
+                chat_sync.start()
+                unread_counter.watch(user_auth.get_current_user()['id'])
+                chat_service.prefetch_recent(user_auth.get_current_user()['id'])
+                presence_service.start()
+                friends_sync.start()
             else:
                 # 恢复失败则清理会话文件，避免下次反复失败
                 self.clear_remember_session()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+好友接口性能基准
+在本地 PostgREST 替身服务上生成好友关系，对比旧实现与当前一次 RPC 请求的延迟：
+- 好友列表：旧实现两次请求（先查 friendships 再按 id 查 users）
+- 发送好友请求：旧实现四次请求（查目标用户、查好友关系、查待处理请求、插入）
+替身服务为每个请求附加固定的模拟网络延迟，服务端函数以 Python 实现。
+
+用法：
+    python friends_benchmark.py [--users 1000] [--friends 200] [--latency 0.03] [--repeat 20]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from postgrest import SyncPostgrestClient
+from local_postgrest import LocalPostgrest
+from friends_manager import FriendsManager
+from user_auth import user_auth
+
+# 与 005_create_presence.sql 中的常量一致
+PRESENCE_TIMEOUT = timedelta(seconds=90)
+HEARTBEAT_MIN_GAP = timedelta(seconds=20)
+PRESENCE_OVERLAP = timedelta(seconds=5)
+
+# 与 006_create_friends_delta_sync.sql 中的常量一致
+TOMBSTONE_RETENTION = timedelta(days=30)
+SYNC_OVERLAP = timedelta(seconds=5)
+
+def changed_at(row: Dict[str, Any], column: str) -> datetime:
+    """行的变化时间；迁移前已存在的行没有该列，视为很早以前"""
+    value = row.get(column)
+    return datetime.fromisoformat(value) if value else datetime.min.replace(tzinfo=timezone.utc)
+
+def presence_of(user: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    """按 user_presence 视图推导用户的在线状态和状态变化时间"""
+    last_active = datetime.fromisoformat(user['last_active'])
+    online = bool(user['is_online']) and last_active > now - PRESENCE_TIMEOUT
+    if user['is_online'] and not online:
+        changed_at = last_active + PRESENCE_TIMEOUT
+    else:
+        changed_at = datetime.fromisoformat(user.get('presence_changed_at') or user['last_active'])
+    return {'is_online': online, 'last_active': user['last_active'], 'changed_at': changed_at}
+
+def install_friend_functions(server: LocalPostgrest):
+    """在替身服务上注册好友相关的服务端函数（与 supabase/migrations 中的定义一致）"""
+
+    def friend_ids(user_id: str) -> List[str]:
+        ids = []
+        for friendship in server.tables.get('friendships', []):
+            if friendship['user1_id'] == user_id:
+                ids.append(friendship['user2_id'])
+            elif friendship['user2_id'] == user_id:
+                ids.append(friendship['user1_id'])
+        return ids
+
+    def get_friends_list(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        user_id = params['p_user_id']
+        users = {u['id']: u for u in server.tables.get('users', [])}
+        now = datetime.now(timezone.utc)
+        friends = []
+        for friendship in server.tables.get('friendships', []):
+            if friendship['user1_id'] == user_id:
+                friend = users.get(friendship['user2_id'])
+            elif friendship['user2_id'] == user_id:
+                friend = users.get(friendship['user1_id'])
+            else:
+                continue
+            if friend is not None:
+                friends.append({
+                    'id': friend['id'],
+                    'username': friend['username'],
+                    'is_online': presence_of(friend, now)['is_online'],
+                    'last_active': friend['last_active'],
+                    'friends_since': friendship['created_at'],
+                })
+        return friends
+
+    def presence_sync(params: Dict[str, Any]) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        users = {u['id']: u for u in server.tables.get('users', [])}
+        me = users.get(params['p_user_id'])
+        if me is not None and not (me['is_online'] and
+                                   datetime.fromisoformat(me['last_active']) > now - HEARTBEAT_MIN_GAP):
+            if not presence_of(me, now)['is_online']:
+                me['presence_changed_at'] = now.isoformat()
+            me['is_online'] = True
+            me['last_active'] = now.isoformat()
+
+        since = datetime.fromisoformat(params['p_since']) if params.get('p_since') else None
+        changes = []
+        for friend_id in friend_ids(params['p_user_id']):
+            if friend_id not in users:
+                continue
+            presence = presence_of(users[friend_id], now)
+            if since is None or presence['changed_at'] > since - PRESENCE_OVERLAP:
+                changes.append({'user_id': friend_id, 'is_online': presence['is_online'],
+                                'last_active': presence['last_active']})
+        return {'as_of': now.isoformat(), 'changes': changes}
+
+    def send_friend_request(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # 替身服务持锁执行函数，检查和插入之间不会有其他请求
+        sender_id = params['p_sender_id']
+        target = next((u for u in server.tables.get('users', [])
+                       if u['username'] == params['p_target_username']), None)
+        if target is None:
+            return [{'code': 'user_not_found', 'request_id': None}]
+        if target['id'] == sender_id:
+            return [{'code': 'self', 'request_id': None}]
+        pair = {sender_id, target['id']}
+        if any({f['user1_id'], f['user2_id']} == pair for f in server.tables.get('friendships', [])):
+            return [{'code': 'already_friends', 'request_id': None}]
+        if any(r['sender_id'] == sender_id and r['receiver_id'] == target['id'] and r['status'] == 'pending'
+               for r in server.tables.get('friend_requests', [])):
+            return [{'code': 'already_requested', 'request_id': None}]
+        request = server.insert_rows('friend_requests', [{
+            'id': str(uuid.uuid4()),
+            'sender_id': sender_id,
+            'receiver_id': target['id'],
+            'message': params.get('p_message'),
+            'status': 'pending',
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'updated_at': datetime.now(timezone.utc).isoformat(),
+        }])[0]
+        return [{'code': 'sent', 'request_id': request['id']}]
+
+    def sync_friends(params: Dict[str, Any]) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        user_id = params['p_user_id']
+        since = datetime.fromisoformat(params['p_since']) if params.get('p_since') else None
+        full = since is None or since < now - TOMBSTONE_RETENTION
+        if not full:
+            since -= SYNC_OVERLAP
+        users = {u['id']: u for u in server.tables.get('users', [])}
+
+        friends, current = [], set()
+        for friendship in server.tables.get('friendships', []):
+            if user_id not in (friendship['user1_id'], friendship['user2_id']):
+                continue
+            friend_id = friendship['user2_id'] if friendship['user1_id'] == user_id else friendship['user1_id']
+            current.add(friend_id)
+            friend = users.get(friend_id)
+            if friend is None:
+                continue
+            if full or changed_at(friendship, 'updated_at') > since or changed_at(friend, 'profile_updated_at') > since:
+                friends.append({
+                    'id': friend['id'],
+                    'username': friend['username'],
+                    'is_online': presence_of(friend, now)['is_online'],
+                    'last_active': friend['last_active'],
+                    'friends_since': friendship['created_at'],
+                })
+
+        removed = set()
+        if not full:
+            for tombstone in server.tables.get('friendship_tombstones', []):
+                if changed_at(tombstone, 'deleted_at') <= since:
+                    continue
+                if tombstone['user1_id'] == user_id:
+                    removed.add(tombstone['user2_id'])
+                elif tombstone['user2_id'] == user_id:
+                    removed.add(tombstone['user1_id'])
+
+        requests = []
+        for request in server.tables.get('friend_requests', []):
+            if user_id not in (request['sender_id'], request['receiver_id']):
+                continue
+            if request['status'] == 'pending' if full else changed_at(request, 'updated_at') > since:
+                requests.append({
+                    'id': request['id'],
+                    'sender_id': request['sender_id'],
+                    'receiver_id': request['receiver_id'],
+                    'sender_username': users.get(request['sender_id'], {}).get('username'),
+                    'receiver_username': users.get(request['receiver_id'], {}).get('username'),
+                    'message': request.get('message'),
+                    'status': request['status'],
+                    'created_at': request['created_at'],
+                })
+
+        return {'as_of': now.isoformat(), 'full': full, 'friends': friends,
+                'removed': sorted(removed - current), 'requests': requests}
+
+    def touch_updated_at(method: str, rows: List[Dict[str, Any]]):
+        if method != 'DELETE':
+            for row in rows:
+                row['updated_at'] = datetime.now(timezone.utc).isoformat()
+
+    def friendships_changed(method: str, rows: List[Dict[str, Any]]):
+        if method == 'DELETE':
+            server.insert_rows('friendship_tombstones', [{
+                'user1_id': row['user1_id'],
+                'user2_id': row['user2_id'],
+                'deleted_at': datetime.now(timezone.utc).isoformat(),
+            } for row in rows])
+        else:
+            touch_updated_at(method, rows)
+
+    server.rpc['get_friends_list'] = get_friends_list
+    server.rpc['send_friend_request'] = send_friend_request
+    server.rpc['presence_sync'] = presence_sync
+    server.rpc['sync_friends'] = sync_friends
+    server.triggers['friendships'] = friendships_changed
+    server.triggers['friend_requests'] = touch_updated_at
+
+def seed_friendships(server: LocalPostgrest, users: int, friends: int) -> str:
+    """生成用户和好友关系，返回拥有 friends 个好友的用户ID
+
+    一半好友关系中该用户在 user1_id，另一半在 user2_id。
+    """
+    now = datetime.now(timezone.utc)
+    rows = [{
+        'id': str(uuid.uuid4()),
+        'username': f'user{i:05d}',
+        'is_online': i % 3 == 0,
+        'last_active': (now - timedelta(minutes=i)).isoformat(),
+    } for i in range(max(users, friends + 1))]
+    server.insert_rows('users', rows)
+
+    me = rows[0]['id']
+    server.insert_rows('friendships', [{
+        'user1_id': me if i % 2 else friend['id'],
+        'user2_id': friend['id'] if i % 2 else me,
+        'created_at': now.isoformat(),
+    } for i, friend in enumerate(rows[1:friends + 1])])
+    return me
+
+def legacy_get_friends_list(client, user_id: str) -> List[Dict[str, Any]]:
+    """旧的实现：先查好友关系，再按ID查询好友资料（两次往返）"""
+    result = client.table('friendships').select(
+        'id, user1_id, user2_id, created_at'
+    ).or_(f'user1_id.eq.{user_id},user2_id.eq.{user_id}').execute()
+    friend_ids = [f['user2_id'] if f['user1_id'] == user_id else f['user1_id'] for f in result.data]
+    if not friend_ids:
+        return []
+    return client.table('users').select(
+        'id, username, is_online, last_active'
+    ).in_('id', friend_ids).execute().data
+
+def legacy_send_friend_request(client, sender_id: str, target_username: str) -> bool:
+    """旧的实现：查目标用户、查好友关系、查待处理请求后插入（四次往返）"""
+    target = client.table('users').select('id, username').eq('username', target_username).execute().data
+    if not target or target[0]['id'] == sender_id:
+        return False
+    target_id = target[0]['id']
+    friendship = client.table('friendships').select('id').or_(
+        f'and(user1_id.eq.{sender_id},user2_id.eq.{target_id}),'
+        f'and(user1_id.eq.{target_id},user2_id.eq.{sender_id})'
+    ).execute().data
+    if friendship:
+        return False
+    pending = client.table('friend_requests').select('id').eq('sender_id', sender_id).eq(
+        'receiver_id', target_id).eq('status', 'pending').execute().data
+    if pending:
+        return False
+    client.table('friend_requests').insert({
+        'sender_id': sender_id,
+        'receiver_id': target_id,
+        'message': '想要添加你为好友',
+        'status': 'pending',
+    }).execute()
+    return True
+
+def measure(server: LocalPostgrest, func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """测量耗时（中位数/最小值）和每次调用的请求数"""
+    timings = []
+    requests = server.request_count
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': statistics.median(timings),
+        'min_ms': min(timings),
+        'requests': (server.request_count - requests) / repeat,
+    }
+
+def run(users: int, friends: int, latency: float, repeat: int) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """对比好友列表和发送好友请求的旧实现与当前实现
+
+    Returns:
+        {'friends_list': {...}, 'send_request': {...}}，每项包含 legacy 和 current 的测量结果
+    """
+    # 每次发送好友请求需要一个新的非好友用户
+    users = max(users, friends + 1 + 2 * (repeat + 1))
+    server = LocalPostgrest(latency=latency).start()
+    previous_user = user_auth.current_user
+    try:
+        install_friend_functions(server)
+        me = seed_friendships(server, users, friends)
+        client = SyncPostgrestClient(server.url)
+        manager = FriendsManager(client)
+        user_auth.current_user = {'id': me, 'username': 'user00000'}
+
+        legacy = legacy_get_friends_list(client, me)
+        current = manager.get_friends_list()
+        assert current['success'], current.get('message')
+        assert sorted(f['id'] for f in legacy) == sorted(f['id'] for f in current['friends'])
+
+        strangers = iter(f'user{i:05d}' for i in range(friends + 1, users))
+        sent = manager.send_friend_request(next(strangers))
+        assert sent['success'], sent['message']
+        assert not manager.send_friend_request('user00001')['success']
+
+        return {
+            'friends_list': {
+                'legacy': measure(server, lambda: legacy_get_friends_list(client, me), repeat),
+                'current': measure(server, manager.get_friends_list, repeat),
+            },
+            'send_request': {
+                'legacy': measure(server, lambda: legacy_send_friend_request(client, me, next(strangers)), repeat),
+                'current': measure(server, lambda: manager.send_friend_request(next(strangers)), repeat),
+            },
+        }
+    finally:
+        user_auth.current_user = previous_user
+        server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='好友接口性能基准')
+    parser.add_argument('--users', type=int, default=1000, help='用户总数')
+    parser.add_argument('--friends', type=int, default=200, help='好友数')
+    parser.add_argument('--latency', type=float, default=0.03, help='每个请求的模拟网络延迟（秒）')
+    parser.add_argument('--repeat', type=int, default=20, help='重复次数')
+    args = parser.parse_args()
+
+    results = run(args.users, args.friends, args.latency, args.repeat)
+    print(f"{args.friends} 个好友，模拟延迟 {args.latency * 1000:.0f}ms/请求（重复 {args.repeat} 次）")
+    titles = {'friends_list': '好友列表', 'send_request': '发送好友请求'}
+    for key, group in results.items():
+        print(f"\n{titles[key]}")
+        print(f"{'方式':<10}{'请求数':>8}{'中位数(ms)':>14}{'最小值(ms)':>14}")
+        for name, result in group.items():
+            print(f"{name:<10}{result['requests']:>8.0f}{result['median_ms']:>14.1f}{result['min_ms']:>14.1f}")
+        print(f"耗时比: {group['current']['median_ms'] / group['legacy']['median_ms']:.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -10,12 +10,15 @@ from PyQt5.QtWidgets import (
     QPushButton, QListWidget, QListWidgetItem, QTabWidget,
     QWidget, QMessageBox, QFrame, QScrollArea, QTextEdit, QProgressBar, QSizePolicy
 )
-from PyQt5.QtCore import Qt, pyqtSignal, QTimer
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QFont, QPixmap, QPainter, QColor
 from friends_manager import friends_manager
 from user_auth import user_auth
 from datetime import datetime
-from async_worker import FriendsListWorker, FriendRequestsWorker, SearchUsersWorker, task_manager
+from async_worker import AsyncWorker, SearchUsersWorker, task_manager
+from chat_service import chat_service
+from presence import presence_service
+from friends_sync import friends_sync
 
 class FriendItemWidget(QWidget):
     """好友列表项组件"""
@@ -38,36 +41,14 @@ class FriendItemWidget(QWidget):
         info_layout.setSpacing(2)
         
         # 用户名
-        username_label = QLabel(self.friend_data['username'])
-        username_label.setStyleSheet("font-weight: bold; font-size: 13px; color: #2c3e50;")
-        info_layout.addWidget(username_label)
+        self.username_label = QLabel(self.friend_data['username'])
+        self.username_label.setStyleSheet("font-weight: bold; font-size: 13px; color: #2c3e50;")
+        info_layout.addWidget(self.username_label)
         
         # 在线状态
-        status_text = "在线" if self.friend_data['is_online'] else "离线"
-        status_color = "#27ae60" if self.friend_data['is_online'] else "#95a5a6"
-        
-        if not self.friend_data['is_online'] and self.friend_data['last_active']:
-            try:
-                last_active = datetime.fromisoformat(self.friend_data['last_active'].replace('Z', '+00:00'))
-                now = datetime.now(last_active.tzinfo)
-                diff = now - last_active
-                
-                if diff.days > 0:
-                    status_text = f"离线 {diff.days}天前"
-                elif diff.seconds > 3600:
-                    hours = diff.seconds // 3600
-                    status_text = f"离线 {hours}小时前"
-                elif diff.seconds > 60:
-                    minutes = diff.seconds // 60
-                    status_text = f"离线 {minutes}分钟前"
-                else:
-                    status_text = "刚刚离线"
-            except:
-                status_text = "离线"
-        
-        status_label = QLabel(status_text)
-        status_label.setStyleSheet(f"font-size: 11px; color: {status_color};")
-        info_layout.addWidget(status_label)
+        self.status_label = QLabel()
+        self.update_status_label()
+        info_layout.addWidget(self.status_label)
         
         layout.addLayout(info_layout)
         layout.addStretch()
@@ -131,6 +112,55 @@ class FriendItemWidget(QWidget):
         """)
         self.setFixedHeight(60)
     
+    def update_status_label(self):
+        """根据 friend_data 中的在线状态更新状态标签"""
+        status_text = "在线" if self.friend_data['is_online'] else "离线"
+        status_color = "#27ae60" if self.friend_data['is_online'] else "#95a5a6"
+        
+        if not self.friend_data['is_online'] and self.friend_data['last_active']:
+            try:
+                last_active = datetime.fromisoformat(self.friend_data['last_active'].replace('Z', '+00:00'))
+                now = datetime.now(last_active.tzinfo)
+                diff = now - last_active
+                
+                if diff.days > 0:
+                    status_text = f"离线 {diff.days}天前"
+                elif diff.seconds > 3600:
+                    hours = diff.seconds // 3600
+                    status_text = f"离线 {hours}小时前"
+                elif diff.seconds > 60:
+                    minutes = diff.seconds // 60
+                    status_text = f"离线 {minutes}分钟前"
+                else:
+                    status_text = "刚刚离线"
+            except:
+                status_text = "离线"
+        
+        self.status_label.setText(status_text)
+        self.status_label.setStyleSheet(f"font-size: 11px; color: {status_color};")
+    
+    def set_friend_data(self, friend_data: dict):
+        """用新的好友数据更新组件（列表刷新时复用组件）"""
+        self.friend_data = friend_data
+        self.username_label.setText(friend_data['username'])
+        self.update_status_label()
+    
+    def update_presence(self, presence: dict):
+        """更新在线状态
+        
+        Args:
+            presence: {'is_online', 'last_active'}
+        """
+        self.friend_data.update(presence)
+        self.update_status_label()
+    
+    def enterEvent(self, event):
+        """鼠标悬停：预取与该好友的聊天记录，点击聊天时可以立即显示"""
+        super().enterEvent(event)
+        current_user = user_auth.get_current_user()
+        if current_user:
+            chat_service.prefetch(current_user['id'], self.friend_data['id'])
+    
     def on_chat_clicked(self):
         """聊天按钮点击"""
         self.chat_requested.emit(self.friend_data['id'], self.friend_data['username'])
@@ -365,13 +395,24 @@ class AddFriendDialog(QDialog):
         )
         
         if reply == QMessageBox.Yes:
-            result = friends_manager.send_friend_request(user_data['username'])
-            
-            if result['success']:
-                QMessageBox.information(self, '成功', result['message'])
-                self.close()
-            else:
-                QMessageBox.warning(self, '失败', result['message'])
+            self.result_list.setEnabled(False)
+            self.status_label.setText('正在发送好友请求...')
+            self.send_worker = task_manager.run_task(
+                AsyncWorker, friends_manager.send_friend_request, user_data['username']
+            )
+            self.send_worker.finished.connect(self.on_request_sent)
+            self.send_worker.error.connect(lambda message: self.on_request_sent(
+                {"success": False, "message": message}))
+    
+    def on_request_sent(self, result: dict):
+        """好友请求发送完成"""
+        self.result_list.setEnabled(True)
+        self.status_label.setText('')
+        if result['success']:
+            QMessageBox.information(self, '成功', result['message'])
+            self.close()
+        else:
+            QMessageBox.warning(self, '失败', result['message'])
 
 class FriendsDialog(QDialog):
     """好友管理对话框"""
@@ -391,18 +432,27 @@ class FriendsDialog(QDialog):
         self.friends_loading = False
         self.requests_loading = False
         self.search_loading = False
+        # 读取期间收到的刷新请求，读取完成后重新读取一次
+        self.friends_reload_pending = False
+        self.requests_reload_pending = False
+        
+        # 当前显示的列表项 {ID: (数据, 组件)}，刷新时按ID增量更新
+        self.friend_items = {}
+        self.request_items = {}
+        
+        # 本地副本是否同步过（从未同步且同步失败时才显示加载失败）
+        self.friends_synced = True
+        self.requests_synced = True
         
-        self.refresh_timer = QTimer()
-        self.refresh_timer.timeout.connect(self.refresh_data)
         self.init_ui()
         self.setup_connections()
         
-        # 异步加载数据
+        # 先显示本地副本，好友和请求的变化由 friends_sync 后台同步后通知，
+        # 在线状态由 presence_service 推送，不再定时刷新
         self.load_friends_list_async()
         self.load_friend_requests_async()
-        
-        # 每30秒刷新一次数据
-        self.refresh_timer.start(30000)
+        friends_sync.request_sync()
+        presence_service.request_sync()
     
     def init_ui(self):
         """初始化界面"""
@@ -545,35 +595,33 @@ class FriendsDialog(QDialog):
         self.add_friend_btn.clicked.connect(self.show_add_friend_dialog)
         self.refresh_btn.clicked.connect(self.refresh_data)
         self.close_btn.clicked.connect(self.close)
+        presence_service.presence_changed.connect(self.on_presence_changed)
+        friends_sync.friends_changed.connect(self.load_friends_list)
+        friends_sync.requests_changed.connect(self.load_friend_requests)
+        friends_sync.sync_failed.connect(self.on_sync_failed)
     
     def refresh_data(self):
-        """刷新数据"""
+        """刷新数据：重新读取本地副本并立即与服务器同步"""
         self.load_friends_list()
         self.load_friend_requests()
+        friends_sync.request_sync()
     
     def load_friends_list_async(self):
-        """异步加载好友列表"""
+        """在数据库线程中读取本地好友列表"""
         if self.friends_loading:
+            self.friends_reload_pending = True
             return
         
         self.friends_loading = True
         self.set_friends_loading_state(True)
-        
-        # 创建好友列表工作线程
-        self.friends_worker = task_manager.run_task(FriendsListWorker)
-        
-        # 连接信号
-        self.friends_worker.progress.connect(self.on_friends_progress)
-        self.friends_worker.finished.connect(self.on_friends_loaded)
-        self.friends_worker.error.connect(self.on_friends_error)
+        chat_service.submit(friends_manager.get_local_friends_list, callback=self.on_friends_loaded,
+                            default={"success": False, "message": "读取本地好友列表失败"})
     
     def set_friends_loading_state(self, loading: bool):
-        """设置好友列表加载状态"""
-        # 清空现有列表
-        for i in reversed(range(self.friends_layout.count() - 1)):
-            child = self.friends_layout.itemAt(i).widget()
-            if child:
-                child.setParent(None)
+        """设置好友列表加载状态（已有列表项时保留列表，不显示加载提示）"""
+        if self.friend_items:
+            return
+        self.clear_placeholders(self.friends_layout)
         
         if loading:
             # 显示加载提示
@@ -584,84 +632,185 @@ class FriendsDialog(QDialog):
             
             self.friends_layout.insertWidget(self.friends_layout.count() - 1, self.friends_loading_label)
     
-    def on_friends_progress(self, message: str):
-        """好友列表加载进度"""
-        if hasattr(self, 'friends_loading_label'):
-            self.friends_loading_label.setText(message)
-    
     def on_friends_loaded(self, result: dict):
         """好友列表加载完成"""
         self.friends_loading = False
-        
-        # 清空现有列表
-        for i in reversed(range(self.friends_layout.count() - 1)):
-            child = self.friends_layout.itemAt(i).widget()
-            if child:
-                child.setParent(None)
+        if self.friends_reload_pending:
+            # 读取期间本地副本又变化了，这次的结果已经过时
+            self.friends_reload_pending = False
+            self.load_friends_list_async()
+            return
         
         if result.get('success'):
             friends = result.get('friends', [])
+            self.friends_synced = result.get('synced', True)
+            if not friends and not self.friends_synced:
+                # 首次使用：等待第一次同步完成
+                return
             
-            if friends:
-                for friend in friends:
-                    friend_widget = FriendItemWidget(friend)
-                    friend_widget.chat_requested.connect(self.on_chat_requested)
-                    friend_widget.remove_requested.connect(self.on_remove_friend)
-                    self.friends_layout.insertWidget(self.friends_layout.count() - 1, friend_widget)
-            else:
+            for friend in friends:
+                # 列表可能比最近一次心跳取回的在线状态旧
+                presence = presence_service.get(friend['id'])
+                if presence:
+                    friend.update(presence)
+            
+            self.sync_items(self.friends_layout, self.friend_items, friends,
+                            self.create_friend_widget, FriendItemWidget.set_friend_data)
+            
+            if not friends:
                 # 显示空状态
-                empty_label = QLabel('暂无好友\n点击"添加好友"开始添加吧！')
-                empty_label.setAlignment(Qt.AlignCenter)
-                empty_label.setStyleSheet("color: #95a5a6; font-size: 12px; padding: 40px;")
-                self.friends_layout.insertWidget(self.friends_layout.count() - 1, empty_label)
+                self.show_empty_label(self.friends_layout, '暂无好友\n点击"添加好友"开始添加吧！')
         else:
+            self.clear_placeholders(self.friends_layout)
             QMessageBox.warning(self, "错误", f"加载好友列表失败: {result.get('message', '未知错误')}")
     
+    def create_friend_widget(self, friend: dict) -> FriendItemWidget:
+        """创建好友列表项"""
+        friend_widget = FriendItemWidget(friend)
+        friend_widget.chat_requested.connect(self.on_chat_requested)
+        friend_widget.remove_requested.connect(self.on_remove_friend)
+        return friend_widget
+    
+    def create_request_widget(self, request: dict) -> FriendRequestWidget:
+        """创建好友请求列表项"""
+        request_widget = FriendRequestWidget(request)
+        request_widget.request_responded.connect(self.on_request_responded)
+        return request_widget
+    
+    def sync_items(self, layout, items: dict, rows: list, create_widget, update_widget=None) -> bool:
+        """按ID增量更新列表项：只创建新增的、更新变化的、删除消失的组件
+        
+        Args:
+            layout: 列表布局（最后一项为伸缩项）
+            items: {ID: (数据, 组件)}，原地更新
+            rows: 新的数据列表（按显示顺序）
+            create_widget: 根据数据创建组件的函数
+            update_widget: 用新数据更新组件的函数(组件, 数据)；为None时数据变化则重新创建组件
+            
+        Returns:
+            是否有列表项变化（没有变化时不触碰布局）
+        """
+        ids = [row['id'] for row in rows]
+        if ids == list(items) and all(items[row['id']][0] == row for row in rows):
+            return False
+        
+        container = layout.parentWidget()
+        container.setUpdatesEnabled(False)
+        try:
+            self.clear_placeholders(layout)
+            
+            for item_id in set(items) - set(ids):
+                _, widget = items.pop(item_id)
+                layout.removeWidget(widget)
+                widget.deleteLater()
+            
+            ordered = {}
+            for index, row in enumerate(rows):
+                data, widget = items.get(row['id'], (None, None))
+                if widget is not None and data != row:
+                    if update_widget is not None:
+                        update_widget(widget, row)
+                    else:
+                        layout.removeWidget(widget)
+                        widget.deleteLater()
+                        widget = None
+                if widget is None:
+                    widget = create_widget(row)
+                if layout.indexOf(widget) != index:
+                    layout.removeWidget(widget)
+                    layout.insertWidget(index, widget)
+                # 保存副本：组件可能原地修改自己的数据（如在线状态）
+                ordered[row['id']] = (dict(row), widget)
+            
+            items.clear()
+            items.update(ordered)
+        finally:
+            container.setUpdatesEnabled(True)
+        return True
+    
+    def clear_items(self, layout, items: dict):
+        """删除全部列表项"""
+        for _, widget in items.values():
+            layout.removeWidget(widget)
+            widget.deleteLater()
+        items.clear()
+    
+    def show_empty_label(self, layout, text: str):
+        """显示空列表提示（已显示时不再改动布局）"""
+        for i in range(layout.count() - 1):
+            child = layout.itemAt(i).widget()
+            if isinstance(child, QLabel) and child.objectName() == 'empty_label':
+                return
+        
+        self.clear_placeholders(layout)
+        empty_label = QLabel(text)
+        empty_label.setObjectName('empty_label')
+        empty_label.setAlignment(Qt.AlignCenter)
+        empty_label.setStyleSheet("color: #95a5a6; font-size: 12px; padding: 40px;")
+        layout.insertWidget(layout.count() - 1, empty_label)
+    
+    def clear_placeholders(self, layout):
+        """移除列表中的提示标签（加载中、空列表、加载失败），保留列表项"""
+        for i in reversed(range(layout.count() - 1)):
+            child = layout.itemAt(i).widget()
+            if isinstance(child, QLabel):
+                child.setParent(None)
+    
+    def on_presence_changed(self, changes: dict):
+        """好友在线状态变化
+        
+        Args:
+            changes: {好友ID: {'is_online', 'last_active'}}
+        """
+        for friend_id, presence in changes.items():
+            if friend_id in self.friend_items:
+                self.friend_items[friend_id][1].update_presence(presence)
+        
+        # 出现不在列表中的好友（如对方接受了好友请求），同步好友数据
+        if not self.friends_loading and set(changes) - set(self.friend_items):
+            friends_sync.request_sync()
+    
+    def on_sync_failed(self, error_message: str):
+        """同步失败：本地副本从未同步过时显示加载失败，否则继续显示本地数据"""
+        if not self.friends_synced and not self.friend_items:
+            self.on_friends_error(error_message)
+        if not self.requests_synced and not self.request_items:
+            self.on_requests_error(error_message)
+    
     def on_friends_error(self, error_message: str):
         """好友列表加载错误"""
         self.friends_loading = False
         
         # 清空现有列表
-        for i in reversed(range(self.friends_layout.count() - 1)):
-            child = self.friends_layout.itemAt(i).widget()
-            if child:
-                child.setParent(None)
+        self.clear_items(self.friends_layout, self.friend_items)
+        self.clear_placeholders(self.friends_layout)
         
         # 显示错误状态
         error_label = QLabel('加载失败\n请检查网络连接后重试')
         error_label.setAlignment(Qt.AlignCenter)
         error_label.setStyleSheet("color: #e74c3c; font-size: 12px; padding: 40px;")
         self.friends_layout.insertWidget(self.friends_layout.count() - 1, error_label)
-        
-        QMessageBox.critical(self, "错误", f"加载好友列表时出错: {error_message}")
     
     def load_friends_list(self):
         """同步加载好友列表（保持兼容性）"""
         self.load_friends_list_async()
     
     def load_friend_requests_async(self):
-        """异步加载好友请求"""
+        """在数据库线程中读取本地好友请求"""
         if self.requests_loading:
+            self.requests_reload_pending = True
             return
         
         self.requests_loading = True
         self.set_requests_loading_state(True)
-        
-        # 创建好友请求工作线程
-        self.requests_worker = task_manager.run_task(FriendRequestsWorker)
-        
-        # 连接信号
-        self.requests_worker.progress.connect(self.on_requests_progress)
-        self.requests_worker.finished.connect(self.on_requests_loaded)
-        self.requests_worker.error.connect(self.on_requests_error)
+        chat_service.submit(friends_manager.get_local_friend_requests, callback=self.on_requests_loaded,
+                            default={"success": False, "message": "读取本地好友请求失败"})
     
     def set_requests_loading_state(self, loading: bool):
-        """设置好友请求加载状态"""
-        # 清空现有列表
-        for i in reversed(range(self.requests_layout.count() - 1)):
-            child = self.requests_layout.itemAt(i).widget()
-            if child:
-                child.setParent(None)
+        """设置好友请求加载状态（已有列表项时保留列表，不显示加载提示）"""
+        if self.request_items:
+            return
+        self.clear_placeholders(self.requests_layout)
         
         if loading:
             # 显示加载提示
@@ -672,43 +821,39 @@ class FriendsDialog(QDialog):
             
             self.requests_layout.insertWidget(self.requests_layout.count() - 1, self.requests_loading_label)
     
-    def on_requests_progress(self, message: str):
-        """好友请求加载进度"""
-        if hasattr(self, 'requests_loading_label'):
-            self.requests_loading_label.setText(message)
-    
     def on_requests_loaded(self, result: dict):
         """好友请求加载完成"""
         self.requests_loading = False
-        
-        # 清空现有列表
-        for i in reversed(range(self.requests_layout.count() - 1)):
-            child = self.requests_layout.itemAt(i).widget()
-            if child:
-                child.setParent(None)
+        if self.requests_reload_pending:
+            # 读取期间本地副本又变化了，这次的结果已经过时
+            self.requests_reload_pending = False
+            self.load_friend_requests_async()
+            return
         
         if result.get('success'):
             requests = result.get('requests', [])
+            self.requests_synced = result.get('synced', True)
+            if not requests and not self.requests_synced:
+                # 首次使用：等待第一次同步完成
+                return
+            
+            self.sync_items(self.requests_layout, self.request_items, requests,
+                            self.create_request_widget)
             
             if requests:
-                for request in requests:
-                    request_widget = FriendRequestWidget(request)
-                    request_widget.request_responded.connect(self.on_request_responded)
-                    self.requests_layout.insertWidget(self.requests_layout.count() - 1, request_widget)
-                
                 # 更新选项卡标题显示未读数量
                 count = len(requests)
-                self.tab_widget.setTabText(1, f"好友请求 ({count})")
+                tab_text = f"好友请求 ({count})"
             else:
                 # 显示空状态
-                empty_label = QLabel('暂无好友请求')
-                empty_label.setAlignment(Qt.AlignCenter)
-                empty_label.setStyleSheet("color: #95a5a6; font-size: 12px; padding: 40px;")
-                self.requests_layout.insertWidget(self.requests_layout.count() - 1, empty_label)
+                self.show_empty_label(self.requests_layout, '暂无好友请求')
                 
                 # 重置选项卡标题
-                self.tab_widget.setTabText(1, "好友请求")
+                tab_text = "好友请求"
+            if self.tab_widget.tabText(1) != tab_text:
+                self.tab_widget.setTabText(1, tab_text)
         else:
+            self.clear_placeholders(self.requests_layout)
             QMessageBox.warning(self, "错误", f"加载好友请求失败: {result.get('message', '未知错误')}")
     
     def on_requests_error(self, error_message: str):
@@ -716,18 +861,14 @@ class FriendsDialog(QDialog):
         self.requests_loading = False
         
         # 清空现有列表
-        for i in reversed(range(self.requests_layout.count() - 1)):
-            child = self.requests_layout.itemAt(i).widget()
-            if child:
-                child.setParent(None)
+        self.clear_items(self.requests_layout, self.request_items)
+        self.clear_placeholders(self.requests_layout)
         
         # 显示错误状态
         error_label = QLabel('加载失败\n请检查网络连接后重试')
         error_label.setAlignment(Qt.AlignCenter)
         error_label.setStyleSheet("color: #e74c3c; font-size: 12px; padding: 40px;")
         self.requests_layout.insertWidget(self.requests_layout.count() - 1, error_label)
-        
-        QMessageBox.critical(self, "错误", f"加载好友请求时出错: {error_message}")
     
     def load_friend_requests(self):
         """同步加载好友请求（保持兼容性）"""
@@ -754,18 +895,20 @@ class FriendsDialog(QDialog):
         )
         
         if reply == QMessageBox.Yes:
-            result = friends_manager.remove_friend(friend_id)
-            
-            if result['success']:
-                QMessageBox.information(self, '成功', result['message'])
-                self.refresh_data()
-            else:
-                QMessageBox.warning(self, '失败', result['message'])
+            self.run_mutation(friends_manager.remove_friend, friend_id)
     
     def on_request_responded(self, request_id, action):
         """处理好友请求回应"""
-        result = friends_manager.respond_to_friend_request(request_id, action)
-        
+        self.run_mutation(friends_manager.respond_to_friend_request, request_id, action)
+    
+    def run_mutation(self, func, *args):
+        """在工作线程中执行修改操作（网络不可用时由 FriendsManager 保存到待同步队列）"""
+        worker = task_manager.run_task(AsyncWorker, func, *args)
+        worker.finished.connect(self.on_mutation_finished)
+        worker.error.connect(lambda message: self.on_mutation_finished({"success": False, "message": message}))
+    
+    def on_mutation_finished(self, result: dict):
+        """修改操作完成"""
         if result['success']:
             QMessageBox.information(self, '成功', result['message'])
             self.refresh_data()
@@ -774,5 +917,12 @@ class FriendsDialog(QDialog):
     
     def closeEvent(self, event):
         """关闭事件"""
-        self.refresh_timer.stop()
+        for signal, slot in ((presence_service.presence_changed, self.on_presence_changed),
+                             (friends_sync.friends_changed, self.load_friends_list),
+                             (friends_sync.requests_changed, self.load_friend_requests),
+                             (friends_sync.sync_failed, self.on_sync_failed)):
+            try:
+                signal.disconnect(slot)
+            except TypeError:
+                pass
         super().closeEvent(event)
\ No newline at end of file
@@ -5,23 +5,92 @@
 提供好友添加、删除、搜索等功能
 """
 
+import httpx
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 from user_auth import user_auth
+from friends_store import (friends_store, REMOVE_FRIEND, RESPOND_TO_FRIEND_REQUEST,
+                           SEND_FRIEND_REQUEST)
+
+def is_network_error(error: Exception) -> bool:
+    """是否为网络不可用（连接失败、超时等），而不是服务器拒绝了请求"""
+    return isinstance(error, (httpx.TransportError, ConnectionError))
 
 class FriendsManager:
     """好友管理类"""
     
-    def __init__(self):
-        """初始化好友管理器"""
-        self.supabase = user_auth.supabase
+    # send_friend_request 服务端函数返回的状态码 -> 提示信息
+    SEND_REQUEST_ERRORS = {
+        'user_not_found': "用户不存在",
+        'self': "不能添加自己为好友",
+        'already_friends': "你们已经是好友了",
+        'already_requested': "已经发送过好友请求，请等待对方回应",
+    }
+    
+    # 离线时操作进入待同步队列后的提示信息
+    QUEUED_MESSAGES = {
+        REMOVE_FRIEND: "网络不可用，已在本地删除好友，联网后自动同步",
+        RESPOND_TO_FRIEND_REQUEST: "网络不可用，已在本地处理好友请求，联网后自动同步",
+        SEND_FRIEND_REQUEST: "网络不可用，好友请求将在联网后发送",
+    }
+    
+    def __init__(self, client=None, store=None):
+        """初始化好友管理器
+        
+        Args:
+            client: Supabase/PostgREST 客户端，默认使用 user_auth 的客户端
+            store: 好友数据本地副本（FriendsStore），为None时不保存离线操作
+        """
+        self.supabase = client or user_auth.supabase
+        self.store = store
+    
+    def _handle_error(self, error: Exception, kind: str, payload: Dict[str, Any],
+                      queue_offline: bool, error_message: str) -> Dict[str, Any]:
+        """修改操作出错：网络不可用时保存到待同步队列，否则返回失败结果
+        
+        Returns:
+            结果字典；offline 表示是否因网络不可用而失败
+        """
+        offline = is_network_error(error)
+        current_user = user_auth.get_current_user()
+        if offline and queue_offline and self.store is not None and current_user:
+            if self.store.queue_mutation(str(current_user['id']), kind, payload):
+                return {"success": True, "message": self.QUEUED_MESSAGES[kind], "queued": True}
+        return {"success": False, "message": f"{error_message}: {str(error)}", "offline": offline}
+    
+    def _apply_local(self, kind: str, payload: Dict[str, Any]):
+        """服务器确认后立即更新本地副本，不必等下一次同步"""
+        current_user = user_auth.get_current_user()
+        if self.store is not None and current_user:
+            self.store.apply_local(str(current_user['id']), kind, payload)
     
-    def send_friend_request(self, target_username: str, message: str = None) -> Dict[str, Any]:
+    def apply_mutation(self, kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """重放离线时保存的修改操作（失败时不再进入队列）
+        
+        Args:
+            kind: 操作类型
+            payload: 操作参数
+            
+        Returns:
+            结果字典
+        """
+        if kind == REMOVE_FRIEND:
+            return self.remove_friend(payload['friend_id'], queue_offline=False)
+        if kind == RESPOND_TO_FRIEND_REQUEST:
+            return self.respond_to_friend_request(payload['request_id'], payload['action'], queue_offline=False)
+        if kind == SEND_FRIEND_REQUEST:
+            return self.send_friend_request(payload['target_username'], payload.get('message'),
+                                            queue_offline=False)
+        return {"success": False, "message": f"未知的操作类型: {kind}"}
+    
+    def send_friend_request(self, target_username: str, message: str = None,
+                            queue_offline: bool = True) -> Dict[str, Any]:
         """发送好友请求
         
         Args:
             target_username: 目标用户名
             message: 请求消息
+            queue_offline: 网络不可用时是否保存到待同步队列，联网后再发送
             
         Returns:
             请求结果字典
@@ -31,57 +100,27 @@ class FriendsManager:
             if not current_user:
                 return {"success": False, "message": "请先登录"}
             
-            # 查找目标用户
-            target_result = self.supabase.table('users').select('id, username').eq('username', target_username).execute()
-            if not target_result.data:
-                return {"success": False, "message": "用户不存在"}
-            
-            target_user = target_result.data[0]
-            
-            # 检查是否是自己
-            if target_user['id'] == current_user['id']:
-                return {"success": False, "message": "不能添加自己为好友"}
-            
-            # 检查是否已经是好友
-            friendship_check = self.supabase.table('friendships').select('id').or_(
-                f'and(user1_id.eq.{current_user["id"]},user2_id.eq.{target_user["id"]}),'
-                f'and(user1_id.eq.{target_user["id"]},user2_id.eq.{current_user["id"]})'
-            ).execute()
-            
-            if friendship_check.data:
-                return {"success": False, "message": "你们已经是好友了"}
-            
-            # 检查是否已经发送过请求
-            existing_request = self.supabase.table('friend_requests').select('id, status').eq(
-                'sender_id', current_user['id']
-            ).eq('receiver_id', target_user['id']).eq('status', 'pending').execute()
-            
-            if existing_request.data:
-                return {"success": False, "message": "已经发送过好友请求，请等待对方回应"}
+            # 查找目标用户、检查好友关系和待处理请求、插入请求在服务端一次完成
+            result = self.supabase.rpc('send_friend_request', {
+                'p_sender_id': current_user['id'],
+                'p_target_username': target_username,
+                'p_message': message or f"{current_user['username']} 想要添加你为好友"
+            }).execute()
             
-            # 发送好友请求
-            request_data = {
-                "sender_id": current_user['id'],
-                "receiver_id": target_user['id'],
-                "message": message or f"{current_user['username']} 想要添加你为好友",
-                "status": "pending",
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
-            }
-            
-            result = self.supabase.table('friend_requests').insert(request_data).execute()
-            
-            if result.data:
+            row = result.data[0] if result.data else {}
+            code = row.get('code')
+            if code == 'sent':
                 return {
                     "success": True,
                     "message": f"已向 {target_username} 发送好友请求",
-                    "request_id": result.data[0]['id']
+                    "request_id": row['request_id']
                 }
-            else:
-                return {"success": False, "message": "发送好友请求失败"}
+            return {"success": False, "message": self.SEND_REQUEST_ERRORS.get(code, "发送好友请求失败")}
                 
         except Exception as e:
-            return {"success": False, "message": f"发送好友请求时出错: {str(e)}"}
+            return self._handle_error(e, SEND_FRIEND_REQUEST,
+                                      {'target_username': target_username, 'message': message},
+                                      queue_offline, "发送好友请求时出错")
     
     def get_friend_requests(self, request_type: str = "received") -> Dict[str, Any]:
         """获取好友请求列表
@@ -138,12 +177,14 @@ class FriendsManager:
         except Exception as e:
             return {"success": False, "message": f"获取好友请求时出错: {str(e)}", "requests": []}
     
-    def respond_to_friend_request(self, request_id: str, action: str) -> Dict[str, Any]:
+    def respond_to_friend_request(self, request_id: str, action: str,
+                                  queue_offline: bool = True) -> Dict[str, Any]:
         """回应好友请求
         
         Args:
             request_id: 请求ID
             action: 操作类型，"accept"(接受) 或 "reject"(拒绝)
+            queue_offline: 网络不可用时是否在本地处理并保存到待同步队列
             
         Returns:
             操作结果字典
@@ -182,13 +223,17 @@ class FriendsManager:
                 }
                 
                 self.supabase.table('friendships').insert(friendship_data).execute()
-                
+            
+            self._apply_local(RESPOND_TO_FRIEND_REQUEST, {'request_id': request_id, 'action': action})
+            if action == "accept":
                 return {"success": True, "message": "已接受好友请求"}
             else:
                 return {"success": True, "message": "已拒绝好友请求"}
                 
         except Exception as e:
-            return {"success": False, "message": f"处理好友请求时出错: {str(e)}"}
+            return self._handle_error(e, RESPOND_TO_FRIEND_REQUEST,
+                                      {'request_id': request_id, 'action': action},
+                                      queue_offline, "处理好友请求时出错")
     
     def get_friends_list(self) -> Dict[str, Any]:
         """获取好友列表
@@ -201,34 +246,17 @@ class FriendsManager:
             if not current_user:
                 return {"success": False, "message": "请先登录", "friends": []}
             
-            # 获取好友关系
-            result = self.supabase.table('friendships').select(
-                'id, user1_id, user2_id, created_at'
-            ).or_(
-                f'user1_id.eq.{current_user["id"]},user2_id.eq.{current_user["id"]}'
-            ).execute()
+            # 一次请求取回好友及其资料（服务端函数 get_friends_list 合并了对称的两侧关系）
+            result = self.supabase.rpc('get_friends_list', {'p_user_id': current_user['id']}).execute()
             
             friends = []
-            friend_ids = []
-            
-            for friendship in result.data:
-                # 确定好友ID
-                friend_id = friendship['user2_id'] if friendship['user1_id'] == current_user['id'] else friendship['user1_id']
-                friend_ids.append(friend_id)
-            
-            if friend_ids:
-                # 获取好友详细信息
-                friends_result = self.supabase.table('users').select(
-                    'id, username, is_online, last_active'
-                ).in_('id', friend_ids).execute()
-                
-                for friend in friends_result.data:
-                    friends.append({
-                        "id": friend['id'],
-                        "username": friend['username'],
-                        "is_online": friend['is_online'],
-                        "last_active": friend['last_active']
-                    })
+            for friend in result.data or []:
+                friends.append({
+                    "id": friend['id'],
+                    "username": friend['username'],
+                    "is_online": friend['is_online'],
+                    "last_active": friend['last_active']
+                })
             
             return {
                 "success": True,
@@ -239,11 +267,73 @@ class FriendsManager:
         except Exception as e:
             return {"success": False, "message": f"获取好友列表时出错: {str(e)}", "friends": []}
     
-    def remove_friend(self, friend_id: str) -> Dict[str, Any]:
+    def get_friends_delta(self, since: Optional[str]) -> Dict[str, Any]:
+        """取回上次同步以来变化的好友数据（服务端函数 sync_friends）
+        
+        Args:
+            since: 上次同步返回的服务器时间，为None时取回全量
+            
+        Returns:
+            结果字典，成功时 delta 为 {'as_of', 'full', 'friends', 'removed', 'requests'}
+        """
+        try:
+            current_user = user_auth.get_current_user()
+            if not current_user:
+                return {"success": False, "message": "请先登录"}
+            
+            result = self.supabase.rpc('sync_friends', {
+                'p_user_id': current_user['id'],
+                'p_since': since
+            }).execute()
+            return {"success": True, "delta": result.data}
+            
+        except Exception as e:
+            return {"success": False, "message": f"同步好友数据时出错: {str(e)}", "offline": is_network_error(e)}
+    
+    def get_local_friends_list(self) -> Dict[str, Any]:
+        """从本地副本读取好友列表（不访问网络）
+        
+        Returns:
+            好友列表字典，格式同 get_friends_list；synced 表示本地副本是否同步过
+        """
+        current_user = user_auth.get_current_user()
+        if not current_user or self.store is None:
+            return {"success": False, "message": "请先登录", "friends": []}
+        
+        owner_id = str(current_user['id'])
+        friends = self.store.get_friends(owner_id)
+        return {
+            "success": True,
+            "friends": friends,
+            "total": len(friends),
+            "synced": self.store.get_watermark(owner_id) is not None
+        }
+    
+    def get_local_friend_requests(self, request_type: str = "received") -> Dict[str, Any]:
+        """从本地副本读取待处理的好友请求（不访问网络）
+        
+        Returns:
+            请求列表字典，格式同 get_friend_requests；synced 表示本地副本是否同步过
+        """
+        current_user = user_auth.get_current_user()
+        if not current_user or self.store is None:
+            return {"success": False, "message": "请先登录", "requests": []}
+        
+        owner_id = str(current_user['id'])
+        requests = self.store.get_friend_requests(owner_id, request_type)
+        return {
+            "success": True,
+            "requests": requests,
+            "total": len(requests),
+            "synced": self.store.get_watermark(owner_id) is not None
+        }
+    
+    def remove_friend(self, friend_id: str, queue_offline: bool = True) -> Dict[str, Any]:
         """删除好友
         
         Args:
             friend_id: 好友用户ID
+            queue_offline: 网络不可用时是否在本地删除并保存到待同步队列
             
         Returns:
             删除结果字典
@@ -260,12 +350,15 @@ class FriendsManager:
             ).execute()
             
             if result.data:
+                self._apply_local(REMOVE_FRIEND, {'friend_id': friend_id})
                 return {"success": True, "message": "已删除好友"}
             else:
+                # 服务器上没有删除任何记录：本地副本不动，由下一次同步纠正
                 return {"success": False, "message": "好友关系不存在"}
                 
         except Exception as e:
-            return {"success": False, "message": f"删除好友时出错: {str(e)}"}
+            return self._handle_error(e, REMOVE_FRIEND, {'friend_id': friend_id},
+                                      queue_offline, "删除好友时出错")
     
     def search_users(self, query: str) -> Dict[str, Any]:
         """搜索用户（用于添加好友）
@@ -279,4 +372,4 @@ class FriendsManager:
         return user_auth.search_users(query)
 
 # 全局好友管理实例
-friends_manager = FriendsManager()
\ No newline at end of file
+friends_manager = FriendsManager(store=friends_store)
\ No newline at end of file
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+好友数据本地副本模块
+在本地SQLite中保存好友、好友资料和好友请求的副本，好友列表打开时直接读取，
+由 friends_sync 按服务器时间水位增量同步；离线时的修改操作进入待同步队列，联网后重放
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from PyQt5.QtCore import QStandardPaths
+from chat_message import now_ms
+
+# 待同步的修改操作（与 FriendsManager 的同名方法对应）
+REMOVE_FRIEND = 'remove_friend'                          # 载荷：{'friend_id'}
+RESPOND_TO_FRIEND_REQUEST = 'respond_to_friend_request'  # 载荷：{'request_id', 'action'}
+SEND_FRIEND_REQUEST = 'send_friend_request'              # 载荷：{'target_username', 'message'}
+
+class FriendsStore:
+    """好友数据本地副本
+
+    所有数据按当前登录用户（owner_id）分开保存，切换账号互不影响。
+    """
+
+    def __init__(self, db_path: str = None):
+        """初始化数据库
+
+        指定路径时立即初始化；使用默认路径时（导入模块时创建的全局实例）在第一次访问
+        db_path 时才创建数据库，只导入模块不会触碰用户数据目录。
+
+        Args:
+            db_path: 数据库文件路径，默认使用用户数据目录下的friends.db
+        """
+        lazy = db_path is None
+        if db_path is None:
+            # 使用用户数据目录存储数据库
+            base_dir = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
+            if not base_dir:
+                base_dir = os.path.expanduser('~/.desktop_pet')
+            db_path = os.path.join(base_dir, 'friends.db')
+
+        self._db_path = db_path
+        self._opened = False
+        self._open_lock = threading.Lock()
+        if not lazy:
+            self._open()
+
+    @property
+    def db_path(self) -> str:
+        """数据库文件路径（第一次访问时初始化数据库）"""
+        if not self._opened:
+            self._open()
+        return self._db_path
+
+    def _open(self):
+        """初始化数据库（只执行一次）"""
+        with self._open_lock:
+            if not self._opened:
+                self.init_database()
+                self._opened = True
+
+    def init_database(self):
+        """初始化数据库表结构"""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self._db_path)), exist_ok=True)
+            with sqlite3.connect(self._db_path) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS friends (
+                        owner_id TEXT NOT NULL,
+                        friend_id TEXT NOT NULL,
+                        username TEXT NOT NULL,
+                        is_online INTEGER NOT NULL DEFAULT 0,
+                        last_active TEXT,
+                        friends_since TEXT,
+                        PRIMARY KEY (owner_id, friend_id)
+                    );
+
+                    CREATE TABLE IF NOT EXISTS friend_requests (
+                        owner_id TEXT NOT NULL,
+                        id TEXT NOT NULL,
+                        sender_id TEXT NOT NULL,
+                        receiver_id TEXT NOT NULL,
+                        sender_username TEXT,
+                        receiver_username TEXT,
+                        message TEXT,
+                        status TEXT NOT NULL,
+                        created_at TEXT,
+                        PRIMARY KEY (owner_id, id)
+                    );
+
+                    CREATE TABLE IF NOT EXISTS sync_state (
+                        owner_id TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        value TEXT,
+                        PRIMARY KEY (owner_id, key)
+                    );
+
+                    CREATE TABLE IF NOT EXISTS pending_mutations (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        owner_id TEXT NOT NULL,
+                        kind TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        created_at INTEGER NOT NULL
+                    );
+
+                    CREATE INDEX IF NOT EXISTS idx_pending_mutations_owner ON pending_mutations(owner_id, id);
+                """)
+        except Exception as e:
+            print(f"初始化好友数据库失败: {e}")
+
+    def get_friends(self, owner_id: str) -> List[Dict[str, Any]]:
+        """读取好友列表（按用户名排序）
+
+        Returns:
+            [{'id', 'username', 'is_online', 'last_active'}]，格式与 FriendsManager.get_friends_list 相同
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                rows = conn.execute("""
+                    SELECT friend_id, username, is_online, last_active FROM friends
+                    WHERE owner_id = ? ORDER BY username COLLATE NOCASE
+                """, (owner_id,)).fetchall()
+            return [{'id': r[0], 'username': r[1], 'is_online': bool(r[2]), 'last_active': r[3]} for r in rows]
+        except Exception as e:
+            print(f"读取本地好友列表失败: {e}")
+            return []
+
+    def get_friend_requests(self, owner_id: str, request_type: str = "received") -> List[Dict[str, Any]]:
+        """读取待处理的好友请求（最新的在前）
+
+        Args:
+            owner_id: 当前用户ID
+            request_type: "received"(收到的) 或 "sent"(发送的)
+
+        Returns:
+            请求列表，格式与 FriendsManager.get_friend_requests 相同
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                if request_type == "received":
+                    rows = conn.execute("""
+                        SELECT id, sender_id, sender_username, message, status, created_at FROM friend_requests
+                        WHERE owner_id = ? AND receiver_id = ? AND status = 'pending'
+                        ORDER BY created_at DESC
+                    """, (owner_id, owner_id)).fetchall()
+                    keys = ('id', 'sender_id', 'sender_username', 'message', 'status', 'created_at')
+                else:
+                    rows = conn.execute("""
+                        SELECT id, receiver_id, receiver_username, message, status, created_at FROM friend_requests
+                        WHERE owner_id = ? AND sender_id = ? AND status = 'pending'
+                        ORDER BY created_at DESC
+                    """, (owner_id, owner_id)).fetchall()
+                    keys = ('id', 'receiver_id', 'receiver_username', 'message', 'status', 'created_at')
+            return [dict(zip(keys, row)) for row in rows]
+        except Exception as e:
+            print(f"读取本地好友请求失败: {e}")
+            return []
+
+    def get_watermark(self, owner_id: str) -> Optional[str]:
+        """上次同步返回的服务器时间，从未同步过时为None"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                row = conn.execute(
+                    "SELECT value FROM sync_state WHERE owner_id = ? AND key = 'watermark'", (owner_id,)
+                ).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            print(f"读取好友同步水位失败: {e}")
+            return None
+
+    def reset_watermark(self, owner_id: str) -> bool:
+        """清除同步水位，下次同步改为全量（如重放的修改被服务器拒绝，本地副本需要纠正时）"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("DELETE FROM sync_state WHERE owner_id = ? AND key = 'watermark'", (owner_id,))
+            return True
+        except Exception as e:
+            print(f"清除好友同步水位失败: {e}")
+            return False
+
+    def apply_delta(self, owner_id: str, delta: Dict[str, Any]) -> Tuple[bool, bool]:
+        """在一个事务中合并服务端 sync_friends 返回的变化并推进水位
+
+        Args:
+            owner_id: 当前用户ID
+            delta: {'as_of', 'full', 'friends', 'removed', 'requests'}
+
+        Returns:
+            (好友列表是否变化, 好友请求是否变化)；内容与本地相同的行不算变化
+        """
+        friends = delta.get('friends') or []
+        requests = delta.get('requests') or []
+        friends_changed = requests_changed = False
+
+        with sqlite3.connect(self.db_path) as conn:
+            if delta.get('full'):
+                # 全量：删除服务器上已不存在的好友和请求
+                keep_friends = [str(f['id']) for f in friends]
+                cursor = conn.execute(
+                    f"DELETE FROM friends WHERE owner_id = ? AND friend_id NOT IN ({','.join('?' * len(keep_friends))})",
+                    [owner_id] + keep_friends
+                )
+                friends_changed |= cursor.rowcount > 0
+                keep_requests = [str(r['id']) for r in requests]
+                cursor = conn.execute(
+                    f"DELETE FROM friend_requests WHERE owner_id = ? AND id NOT IN ({','.join('?' * len(keep_requests))})",
+                    [owner_id] + keep_requests
+                )
+                requests_changed |= cursor.rowcount > 0
+
+            for friend_id in delta.get('removed') or []:
+                cursor = conn.execute(
+                    "DELETE FROM friends WHERE owner_id = ? AND friend_id = ?", (owner_id, str(friend_id))
+                )
+                friends_changed |= cursor.rowcount > 0
+
+            for friend in friends:
+                friends_changed |= self._upsert_friend(conn, owner_id, str(friend['id']), friend['username'],
+                                                       bool(friend.get('is_online')), friend.get('last_active'),
+                                                       friend.get('friends_since'))
+
+            for request in requests:
+                if request['status'] != 'pending':
+                    # 已处理的请求不再显示
+                    cursor = conn.execute(
+                        "DELETE FROM friend_requests WHERE owner_id = ? AND id = ?", (owner_id, str(request['id']))
+                    )
+                else:
+                    cursor = conn.execute("""
+                        INSERT INTO friend_requests (owner_id, id, sender_id, receiver_id, sender_username,
+                                                     receiver_username, message, status, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (owner_id, id) DO UPDATE SET
+                            sender_username = excluded.sender_username,
+                            receiver_username = excluded.receiver_username,
+                            message = excluded.message,
+                            status = excluded.status
+                        WHERE sender_username IS NOT excluded.sender_username
+                           OR receiver_username IS NOT excluded.receiver_username
+                           OR message IS NOT excluded.message
+                           OR status IS NOT excluded.status
+                    """, (owner_id, str(request['id']), str(request['sender_id']), str(request['receiver_id']),
+                          request.get('sender_username'), request.get('receiver_username'),
+                          request.get('message'), request['status'], request.get('created_at')))
+                requests_changed |= cursor.rowcount > 0
+
+            conn.execute("""
+                INSERT INTO sync_state (owner_id, key, value) VALUES (?, 'watermark', ?)
+                ON CONFLICT (owner_id, key) DO UPDATE SET value = excluded.value
+            """, (owner_id, delta['as_of']))
+
+        return friends_changed, requests_changed
+
+    def _upsert_friend(self, conn: sqlite3.Connection, owner_id: str, friend_id: str, username: str,
+                       is_online: bool, last_active: Optional[str], friends_since: Optional[str]) -> bool:
+        """写入一个好友，返回是否有变化"""
+        cursor = conn.execute("""
+            INSERT INTO friends (owner_id, friend_id, username, is_online, last_active, friends_since)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (owner_id, friend_id) DO UPDATE SET
+                username = excluded.username,
+                is_online = excluded.is_online,
+                last_active = excluded.last_active,
+                friends_since = excluded.friends_since
+            WHERE username IS NOT excluded.username
+               OR is_online IS NOT excluded.is_online
+               OR last_active IS NOT excluded.last_active
+               OR friends_since IS NOT excluded.friends_since
+        """, (owner_id, friend_id, username, int(is_online), last_active, friends_since))
+        return cursor.rowcount > 0
+
+    def apply_local(self, owner_id: str, kind: str, payload: Dict[str, Any],
+                    conn: sqlite3.Connection = None) -> bool:
+        """把修改操作的结果先反映到本地副本（服务器确认前界面即可看到）
+
+        Args:
+            owner_id: 当前用户ID
+            kind: 操作类型（REMOVE_FRIEND 等）
+            payload: 操作参数
+            conn: 已打开的连接（在调用方的事务中执行），为None时自行打开
+
+        Returns:
+            是否执行成功
+        """
+        if conn is None:
+            try:
+                with sqlite3.connect(self.db_path) as conn:
+                    return self.apply_local(owner_id, kind, payload, conn)
+            except Exception as e:
+                print(f"更新本地好友数据失败: {e}")
+                return False
+
+        if kind == REMOVE_FRIEND:
+            conn.execute("DELETE FROM friends WHERE owner_id = ? AND friend_id = ?",
+                         (owner_id, payload['friend_id']))
+        elif kind == RESPOND_TO_FRIEND_REQUEST:
+            request = conn.execute("""
+                SELECT sender_id, sender_username FROM friend_requests
+                WHERE owner_id = ? AND id = ? AND receiver_id = ?
+            """, (owner_id, payload['request_id'], owner_id)).fetchone()
+            conn.execute("DELETE FROM friend_requests WHERE owner_id = ? AND id = ?",
+                         (owner_id, payload['request_id']))
+            if request and payload['action'] == 'accept':
+                self._upsert_friend(conn, owner_id, request[0], request[1] or '', False, None,
+                                    datetime.now(timezone.utc).isoformat())
+        return True
+
+    def queue_mutation(self, owner_id: str, kind: str, payload: Dict[str, Any]) -> bool:
+        """离线时保存修改操作，并在同一事务中更新本地副本
+
+        Returns:
+            是否保存成功
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute(
+                    "INSERT INTO pending_mutations (owner_id, kind, payload, created_at) VALUES (?, ?, ?, ?)",
+                    (owner_id, kind, json.dumps(payload, ensure_ascii=False), now_ms())
+                )
+                self.apply_local(owner_id, kind, payload, conn)
+            return True
+        except Exception as e:
+            print(f"保存离线操作失败: {e}")
+            return False
+
+    def get_pending_mutations(self, owner_id: str) -> List[Dict[str, Any]]:
+        """按提交顺序读取待同步的修改操作
+
+        Returns:
+            [{'id', 'kind', 'payload'}]
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                rows = conn.execute(
+                    "SELECT id, kind, payload FROM pending_mutations WHERE owner_id = ? ORDER BY id",
+                    (owner_id,)
+                ).fetchall()
+            return [{'id': r[0], 'kind': r[1], 'payload': json.loads(r[2])} for r in rows]
+        except Exception as e:
+            print(f"读取离线操作失败: {e}")
+            return []
+
+    def remove_mutation(self, mutation_id: int) -> bool:
+        """删除已重放的修改操作"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("DELETE FROM pending_mutations WHERE id = ?", (mutation_id,))
+            return True
+        except Exception as e:
+            print(f"删除离线操作失败: {e}")
+            return False
+
+# 全局好友数据本地副本实例
+friends_store = FriendsStore()
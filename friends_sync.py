@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+好友数据同步模块
+先重放离线时保存的修改操作，再按服务器时间水位增量拉取好友和好友请求的变化，写入本地副本
+"""
+
+import threading
+from typing import Any, Callable, Dict, Optional
+from PyQt5.QtCore import QObject, pyqtSignal
+from friends_store import friends_store
+from friends_manager import friends_manager
+from user_auth import user_auth
+
+class FriendsSyncEngine(QObject):
+    """好友数据同步引擎
+
+    每轮同步按提交顺序重放待同步队列中的修改操作（网络不可用时停止，下一轮继续），
+    再调用服务端函数 sync_friends 取回水位之后的变化，在一个事务中写入本地副本并推进水位。
+    后台线程按固定间隔运行，出错时逐步拉长间隔。
+    """
+
+    friends_changed = pyqtSignal()   # 本地好友列表变化信号
+    requests_changed = pyqtSignal()  # 本地好友请求变化信号
+    sync_failed = pyqtSignal(str)    # 同步失败信号(错误信息)
+
+    def __init__(self, store, manager, user_provider: Callable[[], Optional[Dict[str, Any]]],
+                 min_interval: float = 30.0, max_interval: float = 300.0):
+        """
+        Args:
+            store: FriendsStore 实例
+            manager: FriendsManager 实例（访问服务器）
+            user_provider: 返回当前登录用户信息的函数
+            min_interval: 同步间隔（秒）
+            max_interval: 出错时的最长同步间隔（秒）
+        """
+        super().__init__()
+        self.store = store
+        self.manager = manager
+        self.user_provider = user_provider
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.interval = min_interval
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._sync_lock = threading.Lock()
+
+    def replay(self, owner_id: str) -> int:
+        """重放离线时保存的修改操作
+
+        Returns:
+            重放的操作数
+        """
+        replayed = 0
+        for mutation in self.store.get_pending_mutations(owner_id):
+            result = self.manager.apply_mutation(mutation['kind'], mutation['payload'])
+            if result.get('offline'):
+                raise ConnectionError(result.get('message'))
+            if not result.get('success'):
+                # 服务器拒绝（如请求已被处理）：丢弃该操作，本地副本改为全量同步以纠正
+                print(f"离线操作 {mutation['kind']} 同步失败: {result.get('message')}")
+                self.store.reset_watermark(owner_id)
+            self.store.remove_mutation(mutation['id'])
+            replayed += 1
+        return replayed
+
+    def pull(self, owner_id: str) -> Dict[str, bool]:
+        """拉取水位之后的变化
+
+        Returns:
+            {'friends': 好友列表是否变化, 'requests': 好友请求是否变化}
+        """
+        watermark = self.store.get_watermark(owner_id)
+        result = self.manager.get_friends_delta(watermark)
+        if not result.get('success'):
+            raise RuntimeError(result.get('message'))
+        friends, requests = self.store.apply_delta(owner_id, result['delta'])
+        # 首次同步即使没有数据也通知界面，结束“从未同步”的加载状态
+        first = watermark is None
+        return {'friends': friends or first, 'requests': requests or first}
+
+    def sync_once(self) -> Dict[str, int]:
+        """执行一轮同步
+
+        Returns:
+            {'replayed': 重放的操作数, 'friends': 好友列表是否变化, 'requests': 好友请求是否变化}
+        """
+        user = self.user_provider()
+        if not user:
+            return {'replayed': 0, 'friends': False, 'requests': False}
+
+        owner_id = str(user['id'])
+        with self._sync_lock:
+            replayed = self.replay(owner_id)
+            changed = self.pull(owner_id)
+
+        if changed['friends']:
+            self.friends_changed.emit()
+        if changed['requests']:
+            self.requests_changed.emit()
+        return {'replayed': replayed, **changed}
+
+    def start(self):
+        """启动后台同步"""
+        if self._thread is not None and self._thread.is_alive():
+            self.request_sync()
+            return
+        self._stop_event.clear()
+        self.interval = self.min_interval
+        self._thread = threading.Thread(target=self._run, name='FriendsSync', daemon=True)
+        self._thread.start()
+        self.request_sync()
+
+    def stop(self, timeout: float = 2.0) -> bool:
+        """停止后台同步"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def request_sync(self):
+        """请求尽快同步一次（如打开好友列表、完成修改操作后）"""
+        self.interval = self.min_interval
+        self._wake_event.set()
+
+    def _run(self):
+        """后台同步线程"""
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+            if self._stop_event.is_set():
+                break
+
+            try:
+                self.sync_once()
+                self.interval = self.min_interval
+            except Exception as e:
+                print(f"好友数据同步失败: {e}")
+                self.sync_failed.emit(str(e))
+                self.interval = min(self.interval * 2, self.max_interval)
+
+# 全局好友同步实例
+friends_sync = FriendsSyncEngine(friends_store, friends_manager, user_auth.get_current_user)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地 PostgREST 替身服务
+在内存中模拟 Supabase 的 REST 接口子集，用于离线测试同步逻辑和测量请求往返次数
+"""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+def _split_top_level(text: str) -> List[str]:
+    """按顶层逗号切分（忽略括号内的逗号）"""
+    parts, depth, current = [], 0, ''
+    for ch in text:
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        if ch == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += ch
+    if current:
+        parts.append(current)
+    return [p.strip() for p in parts if p.strip()]
+
+def _coerce(value: str, sample: Any) -> Any:
+    """把查询字符串中的值转换为与行数据相同的类型"""
+    if isinstance(sample, bool):
+        return value.lower() == 'true'
+    if isinstance(sample, int):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    if isinstance(sample, float):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+def _like(pattern: str, value: Any, case_insensitive: bool) -> bool:
+    if value is None:
+        return False
+    regex = '^' + re.escape(pattern).replace(r'\*', '.*').replace('%', '.*') + '$'
+    return re.match(regex, str(value), re.IGNORECASE if case_insensitive else 0) is not None
+
+def _match_condition(row: Dict[str, Any], column: str, expression: str) -> bool:
+    """判断单个 column=op.value 条件"""
+    negate = False
+    if expression.startswith('not.'):
+        negate = True
+        expression = expression[4:]
+    op, _, raw = expression.partition('.')
+    value = row.get(column)
+
+    if op == 'is':
+        result = value is None if raw == 'null' else value == (raw == 'true')
+    elif op == 'in':
+        options = [v.strip().strip('"') for v in raw.strip('()').split(',') if v.strip()]
+        result = value is not None and any(_coerce(o, value) == value for o in options)
+    elif op in ('like', 'ilike'):
+        result = _like(raw, value, op == 'ilike')
+    else:
+        if value is None:
+            result = False
+        else:
+            target = _coerce(raw, value)
+            try:
+                result = {
+                    'eq': value == target,
+                    'neq': value != target,
+                    'gt': value > target,
+                    'gte': value >= target,
+                    'lt': value < target,
+                    'lte': value <= target,
+                }[op]
+            except (KeyError, TypeError):
+                result = False
+    return not result if negate else result
+
+def _match_logic(row: Dict[str, Any], op: str, body: str) -> bool:
+    """判断 or=(...) / and=(...) 条件"""
+    results = []
+    for part in _split_top_level(body.strip()[1:-1]):
+        if part.startswith('or(') or part.startswith('and('):
+            name, _, rest = part.partition('(')
+            results.append(_match_logic(row, name, '(' + rest))
+        else:
+            column, _, expression = part.partition('.')
+            results.append(_match_condition(row, column, expression))
+    return any(results) if op == 'or' else all(results)
+
+class LocalPostgrest:
+    """内存中的 PostgREST 替身
+
+    用法：
+        server = LocalPostgrest(unique={'chat_messages': ['client_key']})
+        server.start()
+        client = SyncPostgrestClient(server.url)
+    """
+
+    RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+    def __init__(self, unique: Dict[str, List[str]] = None, latency: float = 0.0):
+        """
+        Args:
+            unique: 每个表用于 upsert 冲突判断的唯一列
+            latency: 每个请求附加的模拟网络延迟（秒）
+        """
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.unique = unique or {}
+        self.latency = latency
+        self.rpc: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self.embeds: Dict[str, Callable[[Dict[str, Any], str], Any]] = {}
+        # 表触发器：写入后以(方法, 受影响的行)调用，用于模拟服务端触发器
+        self.triggers: Dict[str, Callable[[str, List[Dict[str, Any]]], None]] = {}
+        self.request_count = 0
+        self._next_id: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/rest/v1"
+
+    def start(self) -> 'LocalPostgrest':
+        handler = self._make_handler()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def insert_rows(self, table: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """直接写入数据（不经过HTTP），自动分配自增id"""
+        with self._lock:
+            stored = []
+            for row in rows:
+                row = dict(row)
+                if 'id' not in row:
+                    self._next_id[table] = self._next_id.get(table, 0) + 1
+                    row['id'] = self._next_id[table]
+                self.tables.setdefault(table, []).append(row)
+                stored.append(row)
+            return stored
+
+    # ---- 查询处理 ----
+
+    def _filter(self, table: str, params: List[tuple]) -> List[Dict[str, Any]]:
+        rows = self.tables.get(table, [])
+        for key, value in params:
+            if key in self.RESERVED_PARAMS:
+                continue
+            if key in ('or', 'and'):
+                rows = [r for r in rows if _match_logic(r, key, value)]
+            else:
+                rows = [r for r in rows if _match_condition(r, key, value)]
+        return rows
+
+    def _order_and_page(self, rows: List[Dict[str, Any]], params: Dict[str, str]) -> List[Dict[str, Any]]:
+        if 'order' in params:
+            for clause in reversed(params['order'].split(',')):
+                parts = clause.split('.')
+                column = parts[0]
+                desc = 'desc' in parts[1:]
+                rows = sorted(rows, key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        offset = int(params.get('offset', 0))
+        rows = rows[offset:]
+        if 'limit' in params:
+            rows = rows[:int(params['limit'])]
+        return rows
+
+    def _project(self, table: str, rows: List[Dict[str, Any]], select: str) -> List[Dict[str, Any]]:
+        if not select or select == '*':
+            return [dict(r) for r in rows]
+        result = []
+        for row in rows:
+            item = {}
+            for field in _split_top_level(select):
+                if '(' in field:
+                    # 嵌入资源，如 users!friend_requests_sender_id_fkey(username)
+                    head = field.partition('(')[0]
+                    alias, sep, target = head.partition(':')
+                    if not sep:
+                        alias, target = '', alias
+                    name = target.split('!')[0]
+                    embed = self.embeds.get(f"{table}.{target}") or self.embeds.get(f"{table}.{name}")
+                    item[alias or name] = embed(row, field) if embed else None
+                else:
+                    item[field] = row.get(field)
+            result.append(item)
+        return result
+
+    def _fire(self, table: str, method: str, rows: List[Dict[str, Any]]):
+        trigger = self.triggers.get(table)
+        if trigger is not None and rows:
+            trigger(method, rows)
+
+    def handle(self, method: str, path: str, query: str, body: Any, prefer: str):
+        """处理一个请求，返回(状态码, 响应体)"""
+        self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        table = path.rstrip('/').split('/')[-1]
+        params_list = parse_qsl(query, keep_blank_values=True)
+        params = dict(params_list)
+
+        with self._lock:
+            if '/rpc/' in path:
+                function = self.rpc.get(table)
+                if function is None:
+                    return 404, {'message': f'function {table} not found'}
+                return 200, function(body or dict(params_list))
+
+            if method in ('GET', 'HEAD'):
+                rows = self._order_and_page(self._filter(table, params_list), params)
+                return 200, self._project(table, rows, params.get('select', '*'))
+
+            if method == 'POST':
+                rows = body if isinstance(body, list) else [body]
+                conflict = [c for c in params.get('on_conflict', '').split(',') if c] or self.unique.get(table, [])
+                merge = 'resolution=merge-duplicates' in prefer
+                ignore = 'resolution=ignore-duplicates' in prefer
+                stored = []
+                for row in rows:
+                    existing = None
+                    if conflict and (merge or ignore):
+                        existing = next((r for r in self.tables.get(table, [])
+                                         if all(r.get(c) == row.get(c) for c in conflict)), None)
+                    if existing is not None:
+                        if merge:
+                            existing.update(row)
+                            stored.append(existing)
+                        continue
+                    stored.extend(self.insert_rows(table, [row]))
+                self._fire(table, method, stored)
+                if 'return=minimal' in prefer:
+                    return 201, None
+                return 201, self._project(table, stored, params.get('select', '*'))
+
+            if method == 'PATCH':
+                rows = self._filter(table, params_list)
+                for row in rows:
+                    row.update(body or {})
+                self._fire(table, method, rows)
+                return 200, self._project(table, rows, params.get('select', '*'))
+
+            if method == 'DELETE':
+                rows = self._filter(table, params_list)
+                remaining = [r for r in self.tables.get(table, []) if r not in rows]
+                self.tables[table] = remaining
+                self._fire(table, method, rows)
+                return 200, self._project(table, rows, params.get('select', '*'))
+
+        return 405, {'message': 'method not allowed'}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _dispatch(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                body = json.loads(raw) if raw else None
+                status, payload = server.handle(
+                    self.command, parts.path, parts.query, body, self.headers.get('Prefer', '')
+                )
+                data = b'' if payload is None else json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = do_HEAD = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
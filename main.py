@@ -102,6 +102,31 @@ def main():
         # 防止应用在最后一个窗口关闭时退出（适用于托盘应用）
         app.setQuitOnLastWindowClosed(False)
         
+        # 退出前把聊天消息写入队列中的消息写完（有超时上限）
+        from chat_database import chat_db
+        from chat_sync import chat_sync
+        from chat_notify import chat_notifier
+        from chat_service import chat_service, enable_gui_thread_check, read_receipts
+        from presence import presence_service
+        from friends_sync import friends_sync
+        app.aboutToQuit.connect(chat_sync.stop)
+        app.aboutToQuit.connect(presence_service.stop)
+        app.aboutToQuit.connect(friends_sync.stop)
+        app.aboutToQuit.connect(chat_notifier.stop)
+        app.aboutToQuit.connect(read_receipts.flush)
+        app.aboutToQuit.connect(chat_service.stop)
+        app.aboutToQuit.connect(chat_db.close)
+        
+        # 空闲时归档旧聊天记录、回收数据库空间
+        chat_db.start_maintenance()
+        
+        # 监视其他进程对聊天数据库的修改
+        chat_notifier.start()
+        
+        # 调试模式：启动完成后界面线程中不允许再访问SQLite
+        if os.environ.get('DESKTOP_PET_DEBUG'):
+            enable_gui_thread_check()
+        
         # Windows特定：隐藏任务栏图标
         if os.name == 'nt':  # Windows系统
             try:
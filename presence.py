@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+在线状态模块
+登录后定期向服务器发送心跳，并在同一次请求中取回好友在线状态的变化（增量），
+好友列表据此更新在线标记，不再需要定时拉取整个好友列表
+"""
+
+import threading
+from typing import Any, Callable, Dict, Optional
+from PyQt5.QtCore import QObject, pyqtSignal
+from user_auth import user_auth
+
+class PresenceService(QObject):
+    """在线状态服务
+
+    后台线程每隔 interval 秒调用一次服务端函数 presence_sync：更新自己的 last_active
+    （服务端会合并过于频繁的心跳写入），并返回自上次调用以来在线状态有变化的好友。
+    内存中保存每个好友最近的在线状态，只有真正变化的条目才通过信号通知界面。
+    """
+
+    presence_changed = pyqtSignal(dict)  # 在线状态变化信号({好友ID: {'is_online', 'last_active'}})
+
+    def __init__(self, client, user_provider: Callable[[], Optional[Dict[str, Any]]],
+                 interval: float = 30.0):
+        """
+        Args:
+            client: 提供 rpc() 接口的 Supabase/PostgREST 客户端
+            user_provider: 返回当前登录用户信息的函数
+            interval: 心跳间隔（秒），需小于服务端的心跳超时
+        """
+        super().__init__()
+        self.client = client
+        self.user_provider = user_provider
+        self.interval = interval
+
+        self._presence: Dict[str, Dict[str, Any]] = {}
+        self._since: Optional[str] = None
+        self._user_id: Optional[str] = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """好友最近的在线状态 {'is_online', 'last_active'}，未知时返回None"""
+        with self._lock:
+            presence = self._presence.get(user_id)
+            return dict(presence) if presence else None
+
+    def sync_once(self) -> Dict[str, Dict[str, Any]]:
+        """发送一次心跳并合并好友在线状态的变化
+
+        Returns:
+            有变化的好友 {好友ID: {'is_online', 'last_active'}}
+        """
+        user = self.user_provider()
+        if not user:
+            return {}
+
+        user_id = str(user['id'])
+        with self._lock:
+            if user_id != self._user_id:
+                # 换了账号：重新取全部好友的状态
+                self._presence = {}
+                self._since = None
+                self._user_id = user_id
+            since = self._since
+
+        result = self.client.rpc('presence_sync', {
+            'p_user_id': user_id,
+            'p_since': since
+        }).execute()
+        data = result.data or {}
+
+        changed = {}
+        with self._lock:
+            if user_id != self._user_id:
+                return {}
+            for row in data.get('changes') or []:
+                friend_id = str(row['user_id'])
+                presence = {'is_online': bool(row['is_online']), 'last_active': row.get('last_active')}
+                previous = self._presence.get(friend_id)
+                if previous is None or previous['is_online'] != presence['is_online']:
+                    changed[friend_id] = presence
+                self._presence[friend_id] = presence
+            self._since = data.get('as_of') or since
+
+        if changed:
+            self.presence_changed.emit(changed)
+        return changed
+
+    def start(self):
+        """启动心跳"""
+        if self._thread is not None and self._thread.is_alive():
+            self.request_sync()
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='Presence', daemon=True)
+        self._thread.start()
+        self.request_sync()
+
+    def stop(self, timeout: float = 2.0) -> bool:
+        """停止心跳"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def reset(self):
+        """清空已知的在线状态（如退出登录时）"""
+        with self._lock:
+            self._presence = {}
+            self._since = None
+            self._user_id = None
+
+    def request_sync(self):
+        """请求尽快心跳一次（如打开好友列表时）"""
+        self._wake_event.set()
+
+    def _run(self):
+        """后台心跳线程"""
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+            if self._stop_event.is_set():
+                break
+
+            try:
+                self.sync_once()
+            except Exception as e:
+                print(f"同步在线状态失败: {e}")
+
+# 全局在线状态服务实例
+presence_service = PresenceService(user_auth.supabase, user_auth.get_current_user)
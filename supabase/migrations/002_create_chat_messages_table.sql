@@ -0,0 +1,28 @@
+-- 创建聊天消息同步表
+-- 客户端按 client_key 幂等上传本地消息，按 server_received_at 水位（重叠 5 秒）增量拉取收到的消息
+-- （最初按自增 id 游标拉取，并发提交时会漏消息，007 改为写入时间水位）
+
+CREATE TABLE chat_messages (
+    id BIGSERIAL PRIMARY KEY,
+    client_key VARCHAR(100) NOT NULL,
+    sender_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    receiver_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    content TEXT NOT NULL,
+    message_type VARCHAR(20) DEFAULT 'text',
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    inserted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 上传幂等键：同一条本地消息重试上传时命中冲突并合并
+CREATE UNIQUE INDEX idx_chat_messages_client_key ON chat_messages(client_key);
+
+-- 原拉取游标：receiver_id = ? AND id > ? ORDER BY id（007 中替换为 receiver_id, server_received_at, id）
+CREATE INDEX idx_chat_messages_receiver_cursor ON chat_messages(receiver_id, id);
+
+CREATE INDEX idx_chat_messages_sender ON chat_messages(sender_id);
+
+-- 设置权限
+GRANT SELECT, INSERT, UPDATE ON chat_messages TO anon;
+GRANT USAGE, SELECT ON SEQUENCE chat_messages_id_seq TO anon;
+GRANT ALL PRIVILEGES ON chat_messages TO authenticated;
+GRANT USAGE, SELECT ON SEQUENCE chat_messages_id_seq TO authenticated;
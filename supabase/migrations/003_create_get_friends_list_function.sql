@@ -0,0 +1,38 @@
+-- 好友列表一次请求返回好友资料
+-- 客户端原先先查 friendships 再按 id 查 users，两次往返；改为调用 get_friends_list 函数
+
+-- 好友关系是对称的：当前用户可能在 user1_id 也可能在 user2_id。
+-- 两侧各一个 (本方, 对方) 复合索引，函数的两个分支都只需一次索引扫描即可拿到对方ID，不回表
+CREATE INDEX IF NOT EXISTS idx_friendships_user1_user2 ON friendships(user1_id, user2_id) INCLUDE (created_at);
+CREATE INDEX IF NOT EXISTS idx_friendships_user2_user1 ON friendships(user2_id, user1_id) INCLUDE (created_at);
+
+-- 单列索引已被上面的复合索引覆盖
+DROP INDEX IF EXISTS idx_friendships_user1;
+DROP INDEX IF EXISTS idx_friendships_user2;
+
+-- 返回用户的全部好友及其资料
+CREATE OR REPLACE FUNCTION get_friends_list(p_user_id UUID)
+RETURNS TABLE (
+    id UUID,
+    username VARCHAR(50),
+    is_online BOOLEAN,
+    last_active TIMESTAMP WITH TIME ZONE,
+    friends_since TIMESTAMP WITH TIME ZONE
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT u.id, u.username, u.is_online, u.last_active, f.created_at
+    FROM friendships f
+    JOIN users u ON u.id = f.user2_id
+    WHERE f.user1_id = p_user_id
+    UNION ALL
+    SELECT u.id, u.username, u.is_online, u.last_active, f.created_at
+    FROM friendships f
+    JOIN users u ON u.id = f.user1_id
+    WHERE f.user2_id = p_user_id
+$$;
+
+-- 设置权限
+GRANT EXECUTE ON FUNCTION get_friends_list(UUID) TO anon;
+GRANT EXECUTE ON FUNCTION get_friends_list(UUID) TO authenticated;
@@ -0,0 +1,75 @@
+-- 发送好友请求改为一次服务端调用
+-- 客户端原先依次查询目标用户、检查好友关系、检查待处理请求后再插入，四次往返且并发时可能重复；
+-- 改为调用 send_friend_request 函数，在同一事务中完成检查和插入并返回状态码：
+--   sent              已发送（request_id 为新请求ID）
+--   user_not_found    目标用户不存在
+--   self              不能添加自己
+--   already_friends   已经是好友
+--   already_requested 已有待处理的请求
+
+CREATE OR REPLACE FUNCTION send_friend_request(
+    p_sender_id UUID,
+    p_target_username VARCHAR(50),
+    p_message TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    code TEXT,
+    request_id UUID
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_target_id UUID;
+    v_sender_name VARCHAR(50);
+    v_request_id UUID;
+BEGIN
+    SELECT u.id INTO v_target_id FROM users u WHERE u.username = p_target_username;
+    IF v_target_id IS NULL THEN
+        RETURN QUERY SELECT 'user_not_found'::TEXT, NULL::UUID;
+        RETURN;
+    END IF;
+
+    IF v_target_id = p_sender_id THEN
+        RETURN QUERY SELECT 'self'::TEXT, NULL::UUID;
+        RETURN;
+    END IF;
+
+    -- 同一对用户（任一方向）的请求串行执行，检查和插入之间不会插入其他请求
+    PERFORM pg_advisory_xact_lock(hashtextextended(
+        LEAST(p_sender_id, v_target_id)::TEXT || GREATEST(p_sender_id, v_target_id)::TEXT, 0
+    ));
+
+    IF EXISTS (
+        SELECT 1 FROM friendships f
+        WHERE (f.user1_id = p_sender_id AND f.user2_id = v_target_id)
+           OR (f.user1_id = v_target_id AND f.user2_id = p_sender_id)
+    ) THEN
+        RETURN QUERY SELECT 'already_friends'::TEXT, NULL::UUID;
+        RETURN;
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM friend_requests r
+        WHERE r.sender_id = p_sender_id AND r.receiver_id = v_target_id AND r.status = 'pending'
+    ) THEN
+        RETURN QUERY SELECT 'already_requested'::TEXT, NULL::UUID;
+        RETURN;
+    END IF;
+
+    SELECT u.username INTO v_sender_name FROM users u WHERE u.id = p_sender_id;
+
+    INSERT INTO friend_requests (sender_id, receiver_id, message, status)
+    VALUES (p_sender_id, v_target_id, COALESCE(p_message, v_sender_name || ' 想要添加你为好友'), 'pending')
+    RETURNING id INTO v_request_id;
+
+    RETURN QUERY SELECT 'sent'::TEXT, v_request_id;
+EXCEPTION
+    -- 兜底：idx_friend_requests_unique 拦截到并发插入的重复请求
+    WHEN unique_violation THEN
+        RETURN QUERY SELECT 'already_requested'::TEXT, NULL::UUID;
+END;
+$$;
+
+-- 设置权限
+GRANT EXECUTE ON FUNCTION send_friend_request(UUID, VARCHAR, TEXT) TO anon;
+GRANT EXECUTE ON FUNCTION send_friend_request(UUID, VARCHAR, TEXT) TO authenticated;
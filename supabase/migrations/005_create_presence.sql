@@ -0,0 +1,113 @@
+-- 在线状态（presence）
+-- 原先 users.is_online 只在登录、登出、恢复会话时修改，程序崩溃或断网后会一直显示在线。
+-- 改为客户端定期心跳更新 last_active，服务端按"最近 presence_timeout() 内有心跳"推导在线状态；
+-- 客户端每次心跳同时取回自上次以来在线状态发生变化的好友（增量），不再定时拉取整个好友列表。
+
+-- 心跳超时：超过该时间没有心跳视为离线（客户端心跳间隔为 30 秒）
+CREATE OR REPLACE FUNCTION presence_timeout()
+RETURNS INTERVAL
+LANGUAGE sql
+IMMUTABLE
+AS $$ SELECT INTERVAL '90 seconds' $$;
+
+-- 最近一次在线状态切换（上线/登出）的时间；超时离线的时间由 last_active 推算
+ALTER TABLE users ADD COLUMN IF NOT EXISTS presence_changed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION touch_presence_changed_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- 由离线（含心跳超时）变为在线，或登出
+    IF (NEW.is_online AND NOT (OLD.is_online AND OLD.last_active > NOW() - presence_timeout()))
+       OR (OLD.is_online AND NOT NEW.is_online) THEN
+        NEW.presence_changed_at := NOW();
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_users_presence_changed_at ON users;
+CREATE TRIGGER trg_users_presence_changed_at
+    BEFORE UPDATE OF is_online, last_active ON users
+    FOR EACH ROW EXECUTE FUNCTION touch_presence_changed_at();
+
+-- 推导出的在线状态；changed_at 为在线状态最近一次变化的时间（用于增量查询）
+CREATE OR REPLACE VIEW user_presence AS
+SELECT
+    u.id AS user_id,
+    (u.is_online AND u.last_active > NOW() - presence_timeout()) AS is_online,
+    u.last_active,
+    CASE
+        WHEN u.is_online AND u.last_active <= NOW() - presence_timeout()
+            THEN u.last_active + presence_timeout()
+        ELSE COALESCE(u.presence_changed_at, u.last_active)
+    END AS changed_at
+FROM users u;
+
+-- 好友列表返回推导出的在线状态
+CREATE OR REPLACE FUNCTION get_friends_list(p_user_id UUID)
+RETURNS TABLE (
+    id UUID,
+    username VARCHAR(50),
+    is_online BOOLEAN,
+    last_active TIMESTAMP WITH TIME ZONE,
+    friends_since TIMESTAMP WITH TIME ZONE
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT u.id, u.username, p.is_online, u.last_active, f.created_at
+    FROM friendships f
+    JOIN users u ON u.id = f.user2_id
+    JOIN user_presence p ON p.user_id = u.id
+    WHERE f.user1_id = p_user_id
+    UNION ALL
+    SELECT u.id, u.username, p.is_online, u.last_active, f.created_at
+    FROM friendships f
+    JOIN users u ON u.id = f.user1_id
+    JOIN user_presence p ON p.user_id = u.id
+    WHERE f.user2_id = p_user_id
+$$;
+
+-- 心跳并取回好友在线状态的变化（一次往返）
+--   p_since 为上次返回的 as_of，为 NULL 时返回全部好友
+-- 返回 {"as_of": 服务器时间, "changes": [{"user_id", "is_online", "last_active"}, ...]}
+CREATE OR REPLACE FUNCTION presence_sync(p_user_id UUID, p_since TIMESTAMP WITH TIME ZONE DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_now TIMESTAMP WITH TIME ZONE := NOW();
+    v_changes JSONB;
+BEGIN
+    -- 距上次写入不足 20 秒的心跳不再写表（多个客户端/重试的心跳合并为一次写入）
+    UPDATE users
+    SET last_active = v_now, is_online = TRUE
+    WHERE id = p_user_id
+      AND NOT (is_online AND last_active > v_now - INTERVAL '20 seconds');
+
+    SELECT COALESCE(jsonb_agg(jsonb_build_object(
+        'user_id', p.user_id,
+        'is_online', p.is_online,
+        'last_active', p.last_active
+    )), '[]'::JSONB)
+    INTO v_changes
+    FROM user_presence p
+    JOIN (
+        SELECT f.user2_id AS friend_id FROM friendships f WHERE f.user1_id = p_user_id
+        UNION ALL
+        SELECT f.user1_id FROM friendships f WHERE f.user2_id = p_user_id
+    ) friends ON friends.friend_id = p.user_id
+    -- 留 5 秒重叠，避免漏掉上次查询时尚未提交的变化（客户端会忽略未变化的条目）
+    WHERE p_since IS NULL OR p.changed_at > p_since - INTERVAL '5 seconds';
+
+    RETURN jsonb_build_object('as_of', v_now, 'changes', v_changes);
+END;
+$$;
+
+-- 设置权限
+GRANT SELECT ON user_presence TO anon;
+GRANT SELECT ON user_presence TO authenticated;
+GRANT EXECUTE ON FUNCTION presence_sync(UUID, TIMESTAMP WITH TIME ZONE) TO anon;
+GRANT EXECUTE ON FUNCTION presence_sync(UUID, TIMESTAMP WITH TIME ZONE) TO authenticated;
@@ -0,0 +1,170 @@
+-- 好友数据增量同步
+-- 客户端在本地 SQLite 中保存好友、好友资料和好友请求的副本，打开好友列表时直接读取本地数据；
+-- 后台调用 sync_friends 按服务器时间水位只取回上次同步以来变化的行。
+-- 变化时间一律由服务端触发器写入，不依赖客户端时钟。
+
+-- 好友关系：创建时间水位
+ALTER TABLE friendships ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
+-- 好友资料：只在用户名变化时更新（last_active 随心跳频繁变化，不计入资料变化）
+ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
+-- 删除的好友关系（增量同步据此通知客户端删除本地副本）
+CREATE TABLE IF NOT EXISTS friendship_tombstones (
+    id BIGSERIAL PRIMARY KEY,
+    user1_id UUID NOT NULL,
+    user2_id UUID NOT NULL,
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 墓碑保留时间：水位早于该时间的客户端改为全量同步
+CREATE OR REPLACE FUNCTION friends_tombstone_retention()
+RETURNS INTERVAL
+LANGUAGE sql
+IMMUTABLE
+AS $$ SELECT INTERVAL '30 days' $$;
+
+CREATE OR REPLACE FUNCTION touch_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION touch_profile_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.username IS DISTINCT FROM OLD.username THEN
+        NEW.profile_updated_at := NOW();
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION record_friendship_tombstone()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO friendship_tombstones (user1_id, user2_id) VALUES (OLD.user1_id, OLD.user2_id);
+    DELETE FROM friendship_tombstones WHERE deleted_at < NOW() - friends_tombstone_retention();
+    RETURN OLD;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_friendships_updated_at ON friendships;
+CREATE TRIGGER trg_friendships_updated_at
+    BEFORE INSERT OR UPDATE ON friendships
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+DROP TRIGGER IF EXISTS trg_friendships_tombstone ON friendships;
+CREATE TRIGGER trg_friendships_tombstone
+    AFTER DELETE ON friendships
+    FOR EACH ROW EXECUTE FUNCTION record_friendship_tombstone();
+
+-- friend_requests.updated_at 原先由客户端写入本地时间
+DROP TRIGGER IF EXISTS trg_friend_requests_updated_at ON friend_requests;
+CREATE TRIGGER trg_friend_requests_updated_at
+    BEFORE INSERT OR UPDATE ON friend_requests
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+DROP TRIGGER IF EXISTS trg_users_profile_updated_at ON users;
+CREATE TRIGGER trg_users_profile_updated_at
+    BEFORE UPDATE OF username ON users
+    FOR EACH ROW EXECUTE FUNCTION touch_profile_updated_at();
+
+-- 增量查询使用的索引
+CREATE INDEX IF NOT EXISTS idx_friend_requests_sender_updated ON friend_requests(sender_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_friend_requests_receiver_updated ON friend_requests(receiver_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_friendship_tombstones_user1 ON friendship_tombstones(user1_id, deleted_at);
+CREATE INDEX IF NOT EXISTS idx_friendship_tombstones_user2 ON friendship_tombstones(user2_id, deleted_at);
+CREATE INDEX IF NOT EXISTS idx_friendship_tombstones_deleted ON friendship_tombstones(deleted_at);
+
+-- 取回上次同步以来变化的好友数据（一次往返）
+--   p_since 为上次返回的 as_of；为 NULL 或早于墓碑保留时间时返回全量（full = true）
+-- 返回 {
+--   "as_of": 服务器时间, "full": 是否全量,
+--   "friends": 新增或资料变化的好友 [{"id", "username", "is_online", "last_active", "friends_since"}],
+--   "removed": 已不再是好友的用户ID,
+--   "requests": 状态变化的好友请求（全量时只含待处理的）
+-- }
+CREATE OR REPLACE FUNCTION sync_friends(p_user_id UUID, p_since TIMESTAMP WITH TIME ZONE DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+    v_now TIMESTAMP WITH TIME ZONE := NOW();
+    v_full BOOLEAN := p_since IS NULL OR p_since < NOW() - friends_tombstone_retention();
+    -- 留 5 秒重叠，避免漏掉上次查询时尚未提交的变化（客户端按主键覆盖写入）
+    v_since TIMESTAMP WITH TIME ZONE := p_since - INTERVAL '5 seconds';
+    v_friends JSONB;
+    v_removed JSONB;
+    v_requests JSONB;
+BEGIN
+    SELECT COALESCE(jsonb_agg(jsonb_build_object(
+        'id', u.id,
+        'username', u.username,
+        'is_online', p.is_online,
+        'last_active', u.last_active,
+        'friends_since', f.created_at
+    )), '[]'::JSONB)
+    INTO v_friends
+    FROM (
+        SELECT user2_id AS friend_id, created_at, updated_at FROM friendships WHERE user1_id = p_user_id
+        UNION ALL
+        SELECT user1_id, created_at, updated_at FROM friendships WHERE user2_id = p_user_id
+    ) f
+    JOIN users u ON u.id = f.friend_id
+    JOIN user_presence p ON p.user_id = u.id
+    WHERE v_full OR f.updated_at > v_since OR u.profile_updated_at > v_since;
+
+    SELECT COALESCE(jsonb_agg(DISTINCT t.friend_id), '[]'::JSONB)
+    INTO v_removed
+    FROM (
+        SELECT user2_id AS friend_id FROM friendship_tombstones WHERE user1_id = p_user_id AND deleted_at > v_since
+        UNION ALL
+        SELECT user1_id FROM friendship_tombstones WHERE user2_id = p_user_id AND deleted_at > v_since
+    ) t
+    WHERE NOT v_full
+      AND NOT EXISTS (
+          SELECT 1 FROM friendships f
+          WHERE (f.user1_id = p_user_id AND f.user2_id = t.friend_id)
+             OR (f.user1_id = t.friend_id AND f.user2_id = p_user_id)
+      );
+
+    SELECT COALESCE(jsonb_agg(jsonb_build_object(
+        'id', r.id,
+        'sender_id', r.sender_id,
+        'receiver_id', r.receiver_id,
+        'sender_username', s.username,
+        'receiver_username', v.username,
+        'message', r.message,
+        'status', r.status,
+        'created_at', r.created_at
+    )), '[]'::JSONB)
+    INTO v_requests
+    FROM friend_requests r
+    JOIN users s ON s.id = r.sender_id
+    JOIN users v ON v.id = r.receiver_id
+    WHERE (r.sender_id = p_user_id OR r.receiver_id = p_user_id)
+      AND (CASE WHEN v_full THEN r.status = 'pending' ELSE r.updated_at > v_since END);
+
+    RETURN jsonb_build_object(
+        'as_of', v_now,
+        'full', v_full,
+        'friends', v_friends,
+        'removed', v_removed,
+        'requests', v_requests
+    );
+END;
+$$;
+
+-- 设置权限
+GRANT EXECUTE ON FUNCTION sync_friends(UUID, TIMESTAMP WITH TIME ZONE) TO anon;
+GRANT EXECUTE ON FUNCTION sync_friends(UUID, TIMESTAMP WITH TIME ZONE) TO authenticated;
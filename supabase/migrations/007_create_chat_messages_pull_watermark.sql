@@ -0,0 +1,40 @@
+-- 聊天消息拉取水位
+-- 自增 id 在 INSERT 时分配而不是在提交时，并发写入时较大的 id 可能先提交，
+-- 客户端按 id 游标前进会永久漏掉较小 id 的消息。
+-- 改为按服务端写入时间拉取：每次从水位往前重叠 5 秒（与 presence_sync、sync_friends 一致），
+-- 重叠部分由客户端按服务器ID和消息UID去重。
+
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS server_received_at TIMESTAMP WITH TIME ZONE;
+
+-- 已有消息沿用创建时间，升级后客户端可以从原来的 id 游标所在消息接着拉取
+UPDATE chat_messages SET server_received_at = COALESCE(created_at, inserted_at, NOW())
+WHERE server_received_at IS NULL;
+
+ALTER TABLE chat_messages ALTER COLUMN server_received_at SET DEFAULT clock_timestamp();
+ALTER TABLE chat_messages ALTER COLUMN server_received_at SET NOT NULL;
+
+-- 写入时间由服务端设置（clock_timestamp 取语句执行时刻，而不是事务开始时刻），
+-- 重试上传合并到已有行时保持原值
+CREATE OR REPLACE FUNCTION set_chat_message_received_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        NEW.server_received_at := clock_timestamp();
+    ELSE
+        NEW.server_received_at := OLD.server_received_at;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_chat_messages_received_at ON chat_messages;
+CREATE TRIGGER trg_chat_messages_received_at
+    BEFORE INSERT OR UPDATE ON chat_messages
+    FOR EACH ROW EXECUTE FUNCTION set_chat_message_received_at();
+
+-- 拉取游标：receiver_id = ? AND server_received_at >= ? ORDER BY server_received_at, id
+CREATE INDEX IF NOT EXISTS idx_chat_messages_receiver_received
+    ON chat_messages(receiver_id, server_received_at, id);
+DROP INDEX IF EXISTS idx_chat_messages_receiver_cursor;
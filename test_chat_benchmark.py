@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试聊天数据库性能基准（小规模运行）
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chat_benchmark import benchmark, percentile, run_render
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([5.0], 90) == 5.0
+
+def test_benchmark_small_dataset(tmp_path):
+    report = benchmark(users=5, conversations=4, messages=2000, iterations=3,
+                       keep_dir=str(tmp_path / 'bench'))
+
+    assert report['config']['conversations'] == 4
+    assert os.path.exists(report['dataset']['path'])
+    assert report['dataset']['busiest_conversation_messages'] > 500
+    for name in ('get_conversation_history@0', 'get_recent_conversations', 'get_unread_count',
+                 'mark_messages_as_read', 'search_messages', 'save_message_burst_100'):
+        result = report['results'][name]
+        assert result['count'] >= 3
+        assert 0 <= result['p50_ms'] <= result['p99_ms'] <= result['max_ms']
+
+def test_render_benchmark_small_conversation():
+    results = run_render(count=20, repeat=1)
+    for name in ('legacy', 'current'):
+        assert 0 < results[name]['min_ms'] <= results[name]['median_ms']
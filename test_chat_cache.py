@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试聊天会话内存缓存
+"""
+
+import sys
+import os
+import sqlite3
+from PyQt5.QtCore import Qt
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chat_database import MESSAGES_ADDED, ChatDatabase
+from chat_cache import ConversationCache
+
+def test_ring_buffer_updates_in_place(tmp_path):
+    """测试会话只从数据库加载一次，之后随写入通知更新"""
+    db = ChatDatabase(db_path=str(tmp_path / 'chat.db'))
+    cache = ConversationCache(db, capacity=5)
+    updated = []
+    cache.conversation_updated.connect(updated.append, Qt.DirectConnection)
+
+    for i in range(3):
+        db.save_message('alice', 'me', f'm{i}')
+    assert [m.content for m in cache.get_recent('me', 'alice', limit=5)] == ['m0', 'm1', 'm2']
+
+    # 之后的读取不再访问数据库
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("DELETE FROM chat_messages")
+    assert len(cache.get_recent('me', 'alice', limit=5)) == 3
+
+    # 同步写入、后台写入和云端拉取都会更新缓存，超出容量时淘汰最早的消息
+    db.save_message('me', 'alice', 'm3')
+    db.save_message_async('alice', 'me', 'm4', message_uid='uid-4')
+    assert db.flush_writes(timeout=5)
+    db.save_inbound_messages([{
+        'server_id': 1, 'sender_id': 'alice', 'receiver_id': 'me', 'content': 'm5',
+        'created_at': 10 ** 13, 'message_uid': 'uid-5'
+    }], 'pull_cursor:me', '1')
+    assert [m.content for m in cache.get_recent('alice', 'me', limit=5)] == ['m1', 'm2', 'm3', 'm4', 'm5']
+    assert [m.content for m in cache.get_recent('alice', 'me', limit=2)] == ['m4', 'm5']
+    assert set(updated) == {'alice|me'}
+
+    # 重复到达的消息不会重复出现
+    count = len(updated)
+    db.save_message('alice', 'me', 'm4', message_uid='uid-4')
+    assert len(updated) == count
+    assert len(cache.get_recent('alice', 'me', limit=5)) == 5
+
+    db.delete_conversation('me', 'alice')
+    assert cache.get_recent('alice', 'me', limit=5) == []
+    assert db.close(timeout=2)
+
+def test_unread_counts_and_recent_conversations(tmp_path):
+    """测试未读数和最近会话在内存中维护"""
+    db = ChatDatabase(db_path=str(tmp_path / 'chat.db'))
+    cache = ConversationCache(db)
+    changed = []
+    cache.unread_changed.connect(changed.append, Qt.DirectConnection)
+
+    db.save_message('alice', 'me', 'hi')
+    assert cache.get_unread_counts('me') == {'alice': 1}
+    assert cache.get_recent_conversations('me')[0]['unread_count'] == 1
+
+    db.save_message('bob', 'me', 'yo')
+    db.save_message('bob', 'me', 'yo2')
+    assert cache.get_unread_counts('me') == {'alice': 1, 'bob': 2}
+    assert cache.get_unread_count('me') == 3
+    assert changed == ['me', 'me']
+
+    recent = cache.get_recent_conversations('me')
+    assert [c['other_user_id'] for c in recent] == ['bob', 'alice']
+    assert recent[0]['last_message'] == 'yo2'
+
+    cache.get_recent('me', 'bob')
+    db.mark_messages_as_read('bob', 'me')
+    assert cache.get_unread_counts('me') == {'alice': 1}
+    assert all(m.is_read for m in cache.get_recent('me', 'bob'))
+    assert cache.get_unread_counts('me') == db.get_unread_counts('me')
+
+    db.save_message('me', 'alice', 'reply')
+    recent = cache.get_recent_conversations('me')
+    assert [c['other_user_id'] for c in recent] == ['alice', 'bob']
+    assert recent[0]['is_last_sent']
+    assert db.close(timeout=2)
+
+def test_unread_snapshot_ignores_late_notifications(tmp_path):
+    """测试加载未读数之后才投递的、已计入快照的写入通知不会重复累加"""
+    db = ChatDatabase(db_path=str(tmp_path / 'chat.db'))
+    cache = ConversationCache(db)
+    db.remove_listener(cache._on_database_event)
+
+    # 写入已提交，但通知还没送到缓存时加载未读数
+    db.save_message('alice', 'me', 'hi')
+    assert cache.get_unread_counts('me') == {'alice': 1}
+    late = db.get_conversation_history('alice', 'me')
+    cache._on_database_event(MESSAGES_ADDED, late)
+    assert cache.get_unread_counts('me') == {'alice': 1}
+
+    db.add_listener(cache._on_database_event)
+    db.save_message('alice', 'me', 'again')
+    assert cache.get_unread_counts('me') == {'alice': 2} == db.get_unread_counts('me')
+    assert db.close(timeout=2)
+
+def test_prefetch_and_memory_budget(tmp_path):
+    """测试预取最近的会话，超出内存预算时淘汰最久未访问的会话"""
+    db = ChatDatabase(db_path=str(tmp_path / 'chat.db'))
+    for friend in ('alice', 'bob', 'carol'):
+        for i in range(10):
+            db.save_message(friend, 'me', f'{friend} {i}')
+
+    cache = ConversationCache(db)
+    assert cache.peek_recent('me', 'alice') is None
+    assert cache.prefetch_recent_conversations('me', count=2) == 2
+    assert [m.content for m in cache.peek_recent('me', 'carol', limit=2)] == ['carol 8', 'carol 9']
+    assert cache.peek_recent('me', 'bob') is not None
+    assert cache.peek_recent('me', 'alice') is None
+    assert not cache.prefetch('me', 'bob')
+
+    # 预算只够两个会话：加载第三个时淘汰最久未访问的 carol
+    cache.memory_budget = cache.memory_usage()
+    cache.get_recent('me', 'bob')
+    assert cache.prefetch('me', 'alice')
+    assert cache.peek_recent('me', 'carol') is None
+    assert cache.peek_recent('me', 'bob') is not None
+    assert cache.memory_usage() <= cache.memory_budget
+
+    # 被淘汰的会话收到新消息时仍然通知，打开的窗口据此重新加载
+    updated = []
+    cache.conversation_updated.connect(updated.append, Qt.DirectConnection)
+    db.save_message('carol', 'me', 'again')
+    assert updated == ['carol|me']
+    assert db.close(timeout=2)
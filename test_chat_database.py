@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试聊天数据库模块
+"""
+
+import sys
+import os
+import sqlite3
+from PyQt5.QtCore import Qt
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chat_database import ChatDatabase
+
+def make_db(tmp_path) -> ChatDatabase:
+    """在临时目录中创建数据库"""
+    return ChatDatabase(db_path=str(tmp_path / 'chat.db'))
+
+def count_rows(db: ChatDatabase) -> int:
+    with sqlite3.connect(db.db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM chat_messages").fetchone()[0]
+
+def test_default_database_opens_on_first_use(tmp_path, monkeypatch):
+    """测试使用默认路径时创建实例不触碰用户数据目录，第一次访问时才建库"""
+    import chat_database
+    data_dir = tmp_path / 'data'
+    monkeypatch.setattr(chat_database.QStandardPaths, 'writableLocation', lambda location: str(data_dir))
+    db = ChatDatabase()
+    assert not data_dir.exists()
+
+    assert db.get_unread_counts('me') == {}
+    assert os.path.exists(data_dir / 'chat.db')
+
+def test_save_message_async_group_commit(tmp_path):
+    """测试组提交写入队列"""
+    db = make_db(tmp_path)
+
+    futures = [db.save_message_async('alice', 'bob', f'消息{i}') for i in range(100)]
+    assert db.flush_writes(timeout=5)
+
+    ids = [f.result(timeout=1) for f in futures]
+    assert len(set(ids)) == 100
+    assert ids == sorted(ids)
+    assert count_rows(db) == 100
+
+    history = db.get_conversation_history('alice', 'bob', limit=100)
+    assert [m['content'] for m in history][-1] == '消息99'
+    assert db.close(timeout=2)
+
+def test_close_drains_pending_writes(tmp_path):
+    """测试关闭时写完剩余消息"""
+    db = make_db(tmp_path)
+
+    futures = [db.save_message_async('alice', 'bob', 'hi') for _ in range(20)]
+    assert db.close(timeout=5)
+    assert all(f.done() and f.result() for f in futures)
+    assert count_rows(db) == 20
+
+    # 关闭后仍可同步写入
+    assert db.save_message('bob', 'alice', 'hello')
+
+def test_submit_racing_close_never_hangs(tmp_path):
+    """测试与关闭并发提交的消息要么写入，要么立即失败，Future不会悬空"""
+    import threading
+    from chat_database import MessageWriteQueue
+    db = make_db(tmp_path)
+    writer = MessageWriteQueue(db.db_path)
+
+    futures = []
+    def submit_many():
+        for i in range(200):
+            futures.append(writer.submit('alice', 'bob', f'消息{i}'))
+    threads = [threading.Thread(target=submit_many) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    assert writer.close(timeout=5)
+    for thread in threads:
+        thread.join()
+
+    assert all(f.done() for f in futures)
+    written = [f for f in futures if f.exception() is None]
+    assert count_rows(db) == len(written)
+
+def test_unread_counters_follow_messages(tmp_path):
+    """测试触发器维护的未读计数"""
+    db = make_db(tmp_path)
+
+    for i in range(3):
+        db.save_message('alice', 'me', f'a{i}')
+    for i in range(2):
+        db.save_message('bob', 'me', f'b{i}')
+    db.save_message('me', 'alice', 'reply')
+
+    assert db.get_unread_count('me') == 5
+    assert db.get_unread_counts('me') == {'alice': 3, 'bob': 2}
+    assert db.get_unread_count_by_sender('alice', 'me') == 1
+
+    db.mark_messages_as_read('alice', 'me')
+    assert db.get_unread_counts('me') == {'bob': 2}
+    assert db.get_unread_count_by_sender('me', 'alice') == 0
+
+    db.delete_conversation('me', 'bob')
+    assert db.get_unread_count('me') == 0
+    assert db.get_unread_counts('alice') == {'me': 1}
+
+def make_legacy_db(tmp_path, rows):
+    """按迁移机制引入之前的表结构创建数据库"""
+    path = str(tmp_path / 'chat.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute("""
+            CREATE TABLE chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender_id TEXT NOT NULL,
+                receiver_id TEXT NOT NULL,
+                content TEXT NOT NULL,
+                message_type TEXT DEFAULT 'text',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_read BOOLEAN DEFAULT 0,
+                sync_status TEXT DEFAULT 'local'
+            )
+        """)
+        conn.executemany("""
+            INSERT INTO chat_messages (sender_id, receiver_id, content, created_at)
+            VALUES (?, ?, ?, ?)
+        """, rows)
+    return path
+
+def test_migrate_legacy_db(tmp_path):
+    """测试旧数据库升级：未读计数初始化与会话键后台回填"""
+    rows = [('alice', 'me', f'a{i}', f'2024-01-01T00:00:{i:02d}') for i in range(30)]
+    rows += [('me', 'alice', 'reply', '2024-01-01T00:01:00'), ('bob', 'me', 'hi', '2024-01-01T00:02:00')]
+    path = make_legacy_db(tmp_path, rows)
+
+    db = ChatDatabase(db_path=path)
+    assert db.get_unread_counts('me') == {'alice': 30, 'bob': 1}
+
+    assert db.migrator.wait_for_backfills(timeout=10)
+    assert db.migrator.is_backfill_complete('conversation_key')
+
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == db.migrator.latest_version
+        assert conn.execute(
+            "SELECT COUNT(*) FROM chat_messages WHERE conversation_key IS NULL"
+        ).fetchone()[0] == 0
+        assert conn.execute(
+            "SELECT COUNT(DISTINCT message_uid) FROM chat_messages"
+        ).fetchone()[0] == len(rows)
+
+    history = db.get_conversation_history('me', 'alice', limit=5)
+    assert [m['content'] for m in history][-1] == 'reply'
+
+    # 再次打开不会重复迁移
+    reopened = ChatDatabase(db_path=path)
+    assert reopened.migrator.is_backfill_complete('conversation_key')
+    assert reopened.get_unread_count('me') == 31
+
+def test_backfill_resumes_in_batches(tmp_path):
+    """测试回填分批执行并报告进度"""
+    from chat_migrations import ChatMigrator
+
+    rows = [('alice', 'bob', f'm{i}', f'2024-01-01T00:00:{i % 60:02d}') for i in range(50)]
+    path = make_legacy_db(tmp_path, rows)
+
+    migrator = ChatMigrator(path, batch_size=10, batch_pause=0)
+    migrator.migrate()
+    progress = []
+    # 回填线程没有事件循环可投递，测试中直接连接
+    migrator.progress.connect(lambda desc, done, total: progress.append((done, total)),
+                              Qt.DirectConnection)
+    migrator.start_backfills()
+    assert migrator.wait_for_backfills(timeout=10)
+
+    assert [done for done, _ in progress][:5] == [10, 20, 30, 40, 50]
+    assert progress[-1] == (50, 50)
+
+def test_archive_and_history_fallthrough(tmp_path):
+    """测试归档旧消息后分页读取自动落到冷库"""
+    from chat_archive import ArchivePolicy
+
+    db = make_db(tmp_path)
+    assert db.migrator.wait_for_backfills(timeout=10)
+    for i in range(30):
+        db.save_message('alice', 'me', f'm{i:02d}')
+    db.mark_messages_as_read('alice', 'me')
+    db.save_message('alice', 'me', 'unread')
+    # 尚未上传的消息不会被归档
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("UPDATE chat_messages SET sync_status = 'synced'")
+
+    db.archive_policy = ArchivePolicy(max_age_days=None, keep_per_conversation=10, batch_size=8)
+    moved = 0
+    while True:
+        step = db.run_maintenance_step()
+        if not step['archived']:
+            break
+        moved += step['archived']
+    assert moved == 21
+    assert count_rows(db) == 10
+    assert db.get_unread_counts('me') == {'alice': 1}
+
+    # 跨越热库/冷库边界的分页
+    newest = db.get_conversation_history('me', 'alice', limit=5)
+    assert [m['content'] for m in newest] == ['m26', 'm27', 'm28', 'm29', 'unread']
+    page = db.get_conversation_history('me', 'alice', limit=10, offset=5)
+    assert [m['content'] for m in page] == [f'm{i:02d}' for i in range(16, 26)]
+    oldest = db.get_conversation_history('me', 'alice', limit=10, offset=25)
+    assert [m['content'] for m in oldest] == [f'm{i:02d}' for i in range(0, 6)]
+
+    # 以消息为游标向前/向后翻页，同样跨越热库/冷库边界
+    cursor = newest[0]
+    older = db.get_message_page('me', 'alice', cursor.created_at, cursor.id, older=True, limit=10)
+    assert [m.content for m in older] == [f'm{i:02d}' for i in range(16, 26)]
+    cursor = oldest[0]
+    newer = db.get_message_page('me', 'alice', cursor.created_at, cursor.id, older=False, limit=25)
+    assert [m.content for m in newer] == [f'm{i:02d}' for i in range(1, 26)]
+
+    assert db.delete_conversation('me', 'alice')
+    assert db.get_conversation_history('me', 'alice', limit=50) == []
+
+def test_history_offsets_merge_old_hot_rows(tmp_path):
+    """测试留在热库的旧消息（未读、未同步）与冷库按时间合并分页，不乱序也不重复"""
+    from chat_archive import ArchivePolicy
+    from chat_message import now_ms
+
+    db = make_db(tmp_path)
+    assert db.migrator.wait_for_backfills(timeout=10)
+    for i in range(20):
+        db.save_message('alice', 'me', f'm{i:02d}')
+    db.mark_messages_as_read('alice', 'me')
+    base = now_ms() - 30 * 86400 * 1000
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("UPDATE chat_messages SET sync_status = 'synced', created_at = ? + id * 1000", (base,))
+        conn.execute("UPDATE chat_messages SET is_read = 0 WHERE content = 'm05'")
+        conn.execute("UPDATE chat_messages SET sync_status = 'local' WHERE content = 'm07'")
+
+    db.archive_policy = ArchivePolicy(max_age_days=1, keep_per_conversation=None)
+    assert db.run_maintenance_step()['archived'] == 18
+    assert count_rows(db) == 2
+
+    pages = [db.get_conversation_history('me', 'alice', limit=3, offset=offset)
+             for offset in range(0, 21, 3)]
+    contents = [m.content for page in reversed(pages) for m in page]
+    assert contents == [f'm{i:02d}' for i in range(20)]
+
+    # 不使用云同步时，未同步的消息超过期限后也可以归档
+    db.archive_policy = ArchivePolicy(max_age_days=1, keep_per_conversation=None, archive_unsynced=True)
+    assert db.run_maintenance_step()['archived'] == 1
+    assert [m.content for m in db.get_conversation_history('me', 'alice', limit=2, offset=12)] == ['m06', 'm07']
+
+def test_incremental_vacuum_reclaims_pages(tmp_path):
+    """测试增量回收空闲页"""
+    db = make_db(tmp_path)
+    for i in range(500):
+        db.save_message('alice', 'me', 'x' * 200)
+    db.delete_conversation('alice', 'me')
+
+    with sqlite3.connect(db.db_path) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    assert free_before > 0
+
+    db.vacuum_pages_per_step = 10
+    assert db.run_maintenance_step()['vacuumed_pages'] == 10
+
+def test_incremental_vacuum_leaves_legacy_db_alone(tmp_path):
+    """测试未启用增量回收的旧数据库不会在维护时被整体重写"""
+    from chat_archive import incremental_vacuum
+    path = str(tmp_path / 'legacy.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE t (x TEXT)")
+        conn.executemany("INSERT INTO t VALUES (?)", [('x' * 200,)] * 500)
+        conn.execute("DELETE FROM t")
+    size = os.path.getsize(path)
+
+    assert incremental_vacuum(path, 10) == 0
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+        assert conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+    assert os.path.getsize(path) == size
+
+def test_timestamps_migrated_to_epoch_ms(tmp_path, monkeypatch):
+    """测试旧的ISO时间在后台转换为毫秒时间戳，转换完成前读取也按时间排序"""
+    from datetime import datetime
+    from chat_message import ChatMessage, to_epoch_ms
+    from chat_migrations import ChatMigrator
+
+    rows = [('alice', 'me', f'm{i}', f'2024-01-01T10:00:{i:02d}.250000') for i in range(10)]
+    rows.insert(5, ('alice', 'me', 'broken', 'not a time'))
+    path = make_legacy_db(tmp_path, rows)
+    start_backfills = ChatMigrator.start_backfills
+    monkeypatch.setattr(ChatMigrator, 'start_backfills', lambda self: None)
+    db = ChatDatabase(db_path=path)
+    base = to_epoch_ms(datetime(2024, 1, 1, 10, 0, 0, 250000))
+
+    # 转换前新写入的消息已是整数时间，与旧格式混存时仍排在最后
+    db.save_message('me', 'alice', 'new')
+    history = db.get_conversation_history('me', 'alice', limit=3)
+    assert [m.content for m in history] == ['m8', 'm9', 'new']
+    assert [m.created_at for m in history[:2]] == [base + 8000, base + 9000]
+    window = db.get_messages_in_range('me', 'alice', base + 2000, base + 5000)
+    assert [m.content for m in window] == ['m2', 'm3', 'm4']
+    # 混存时不按时间清理（旧格式会被当成最新的消息保留，反而删掉新消息）
+    from chat_database import RetentionPolicy
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE chat_messages SET is_read = 1, sync_status = 'synced'")
+    assert db.prune_step(RetentionPolicy(max_per_conversation=3)) == 0
+
+    start_backfills(db.migrator)
+    assert db.migrator.wait_for_backfills(timeout=10)
+    assert db.migrator.is_backfill_complete('epoch_ms')
+    with sqlite3.connect(path) as conn:
+        assert conn.execute(
+            "SELECT COUNT(*) FROM chat_messages WHERE typeof(created_at) != 'integer'"
+        ).fetchone()[0] == 0
+        # 无法解析的时间取前一条消息的时间，不会变成1970年
+        assert conn.execute(
+            "SELECT created_at FROM chat_messages WHERE content = 'broken'"
+        ).fetchone()[0] == base + 4000
+
+    history = db.get_conversation_history('me', 'alice', limit=12)
+    assert isinstance(history[0], ChatMessage)
+    assert [m.content for m in history if m.content.startswith('m')] == [f'm{i}' for i in range(10)]
+    assert history[-1].content == 'new'
+    assert history[3].time_text == '10:00'
+
+    window = db.get_messages_in_range('me', 'alice', base + 2000, base + 5000)
+    assert [m.content for m in window] == ['m2', 'm3', 'm4', 'broken']
+    assert [m.content for m in db.get_messages_in_range('alice', 'me', base + 8000)] == ['m8', 'm9', 'new']
+
+def test_message_uid_deduplicates_inserts(tmp_path):
+    """测试同一消息UID重复写入不产生新记录"""
+    db = make_db(tmp_path)
+
+    first = db.save_message('alice', 'me', 'hi', message_uid='uid-1')
+    assert db.save_message('alice', 'me', 'hi', message_uid='uid-1') == first
+
+    futures = [db.save_message_async('me', 'alice', 'reply', message_uid='uid-2') for _ in range(3)]
+    futures.append(db.save_message_async('alice', 'me', 'hi', message_uid='uid-1'))
+    assert db.flush_writes(timeout=5)
+    ids = [f.result(timeout=1) for f in futures]
+    assert len(set(ids[:3])) == 1 and ids[3] == first
+
+    inbound = [{'server_id': 7, 'message_uid': 'uid-1', 'sender_id': 'alice', 'receiver_id': 'me',
+                'content': 'hi', 'message_type': 'text', 'created_at': 1}]
+    assert db.save_inbound_messages(inbound, 'pull_cursor:me', '7') == 0
+
+    assert count_rows(db) == 2
+    assert db.get_unread_counts('me') == {'alice': 1}
+    assert [m.message_uid for m in db.get_conversation_history('me', 'alice')] == ['uid-1', 'uid-2']
+
+def test_retention_policy_prunes_in_batches(tmp_path):
+    """测试保留策略：按会话条数和时间分批删除，跨越热库/冷库，保留未读与未同步消息"""
+    from chat_archive import ArchivePolicy
+    from chat_database import RetentionPolicy
+
+    db = make_db(tmp_path)
+    assert db.migrator.wait_for_backfills(timeout=10)
+    for i in range(40):
+        db.save_message('alice', 'me', f'm{i:02d}' + 'x' * 500)
+    db.mark_messages_as_read('alice', 'me')
+    db.save_message('alice', 'me', 'unread')
+    db.save_message('me', 'alice', 'not synced')
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("UPDATE chat_messages SET sync_status = 'synced' WHERE content != 'not synced'")
+
+    # 先把较早的消息移到冷库，保留策略需要同时作用于两边
+    db.archive_policy = ArchivePolicy(max_age_days=None, keep_per_conversation=20)
+    assert db.run_maintenance_step()['archived'] == 22
+
+    policy = RetentionPolicy(max_per_conversation=15, batch_size=4, batch_pause=0)
+    report = db.enforce_retention(policy)
+    assert report['deleted'] == 27
+    assert report['batches'] == 7
+    assert report['completed']
+    assert report['freed_bytes'] > 0
+
+    history = db.get_conversation_history('me', 'alice', limit=100)
+    assert len(history) == 15
+    assert [m.content for m in history][-2:] == ['unread', 'not synced']
+    assert db.get_unread_counts('me') == {'alice': 1}
+
+    # 时间限制：只剩未读和未同步的消息
+    report = db.enforce_retention(RetentionPolicy(max_age_days=0, batch_pause=0))
+    assert report['deleted'] == 13
+    assert [m.content for m in db.get_conversation_history('me', 'alice')] == ['unread', 'not synced']
+
+    # 可以被中途打断
+    assert db.enforce_retention(policy, should_continue=lambda: False)['completed'] is False
+
+def test_max_message_id_since(tmp_path):
+    """测试按ID检查会话中的新消息"""
+    db = make_db(tmp_path)
+    assert db.migrator.wait_for_backfills(timeout=10)
+
+    first = db.save_message('alice', 'me', 'a')
+    db.save_message('bob', 'me', 'b')
+    assert db.get_max_message_id_since('me', 'alice', 0) == first
+    assert db.get_max_message_id_since('me', 'alice', first) is None
+
+    latest = db.save_message('me', 'alice', 'c')
+    assert db.get_max_message_id_since('alice', 'me', first) == latest
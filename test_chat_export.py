@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试聊天记录导出/导入
+"""
+
+import sys
+import os
+import gzip
+import json
+import sqlite3
+from datetime import datetime
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chat_database import ChatDatabase
+from chat_export import export_messages, import_file, iter_messages
+from chat_message import to_epoch_ms
+
+def make_db(tmp_path, name) -> ChatDatabase:
+    os.makedirs(tmp_path / name, exist_ok=True)
+    db = ChatDatabase(db_path=str(tmp_path / name / 'chat.db'))
+    assert db.migrator.wait_for_backfills(timeout=10)
+    return db
+
+def test_export_import_roundtrip(tmp_path):
+    """测试压缩导出后导入到新库，重复导入不产生重复记录"""
+    source = make_db(tmp_path, 'source')
+    for i in range(25):
+        source.save_message('alice', 'me', f'a{i}')
+    source.save_message('me', 'bob', '你好')
+    source.mark_messages_as_read('alice', 'me')
+
+    path = str(tmp_path / 'backup.jsonl.gz')
+    assert export_messages(source, path, batch_size=7) == 26
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        assert sum(1 for _ in f) == 26
+
+    target = make_db(tmp_path, 'target')
+    target.save_message('alice', 'me', 'already here')
+    assert import_file(target, path, batch_size=10) == {'read': 26, 'inserted': 26, 'skipped': 0}
+    assert import_file(target, path, batch_size=10) == {'read': 26, 'inserted': 0, 'skipped': 26}
+
+    history = target.get_conversation_history('me', 'alice', limit=100)
+    assert [m.content for m in history[:25]] == [f'a{i}' for i in range(25)]
+    assert target.get_unread_counts('me') == {'alice': 1}
+
+def test_export_single_conversation_includes_archive(tmp_path):
+    """测试按会话导出包含冷库中的消息，导入时与冷库去重"""
+    from chat_archive import ArchivePolicy
+
+    db = make_db(tmp_path, 'db')
+    for i in range(12):
+        db.save_message('alice', 'me', f'm{i}')
+    db.save_message('bob', 'me', 'other')
+    db.mark_messages_as_read('alice', 'me')
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("UPDATE chat_messages SET sync_status = 'synced'")
+    db.archive_policy = ArchivePolicy(max_age_days=None, keep_per_conversation=5)
+    assert db.run_maintenance_step()['archived'] == 7
+
+    exported = [m['content'] for m in iter_messages(db, 'me', 'alice')]
+    assert exported == [f'm{i}' for i in range(12)]
+
+    path = str(tmp_path / 'alice.jsonl')
+    assert export_messages(db, path, 'me', 'alice') == 12
+    assert import_file(db, path) == {'read': 12, 'inserted': 0, 'skipped': 12}
+
+def test_export_legacy_db_waits_for_backfill(tmp_path):
+    """测试旧数据库按会话导出时等待会话键回填，不会漏掉消息"""
+    from test_chat_database import make_legacy_db
+
+    rows = [('a', 'b', f'm{i}', f'2024-01-01T00:00:{i:02d}') for i in range(5)]
+    rows.append(('c', 'b', 'other', '2024-01-01T00:01:00'))
+    db = ChatDatabase(db_path=make_legacy_db(tmp_path, rows))
+
+    path = str(tmp_path / 'ab.jsonl')
+    assert export_messages(db, path, 'a', 'b') == 5
+
+def test_import_null_and_legacy_created_at(tmp_path):
+    """测试导入时间为空或旧ISO格式的消息：转换为毫秒时间戳，空值沿用前一条消息的时间"""
+    path = str(tmp_path / 'legacy.jsonl')
+    lines = [
+        {'message_uid': 'u1', 'sender_id': 'alice', 'receiver_id': 'me', 'content': 'first',
+         'created_at': '2024-01-01T00:00:00'},
+        {'message_uid': 'u2', 'sender_id': 'alice', 'receiver_id': 'me', 'content': 'broken',
+         'created_at': None},
+        {'message_uid': 'u3', 'sender_id': 'alice', 'receiver_id': 'me', 'content': 'last',
+         'created_at': 1704067260000},
+    ]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(line) + '\n' for line in lines)
+
+    db = make_db(tmp_path, 'db')
+    assert import_file(db, path) == {'read': 3, 'inserted': 3, 'skipped': 0}
+    history = db.get_conversation_history('me', 'alice')
+    assert [m.content for m in history] == ['first', 'broken', 'last']
+    assert history[0].created_at == history[1].created_at == to_epoch_ms(datetime(2024, 1, 1))
+    assert import_file(db, path) == {'read': 3, 'inserted': 0, 'skipped': 3}
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试聊天数据变更通知
+"""
+
+import sys
+import os
+import sqlite3
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chat_database import ChatDatabase
+from chat_cache import ConversationCache
+from chat_notify import ChatChangeNotifier
+
+def make_notifier(tmp_path):
+    db = ChatDatabase(db_path=str(tmp_path / 'chat.db'))
+    assert db.migrator.wait_for_backfills(timeout=10)
+    cache = ConversationCache(db)
+    return db, cache, ChatChangeNotifier(db, cache)
+
+def test_subscribers_receive_own_conversation_only(tmp_path):
+    """测试本进程的写入只通知对应会话的订阅者"""
+    db, cache, notifier = make_notifier(tmp_path)
+    calls = []
+    notifier.subscribe('alice|me', calls.append)
+    cache.get_recent('me', 'alice')
+    cache.get_recent('me', 'bob')
+
+    db.save_message('alice', 'me', 'hi')
+    db.save_message('bob', 'me', 'yo')
+    assert calls == ['alice|me']
+
+    notifier.unsubscribe('alice|me', calls.append)
+    db.save_message('alice', 'me', 'again')
+    assert calls == ['alice|me']
+    assert db.close(timeout=2)
+
+def test_detects_writes_from_other_processes(tmp_path):
+    """测试通过 data_version 发现其他连接的写入，本进程的写入不触发"""
+    db, cache, notifier = make_notifier(tmp_path)
+    calls = []
+    notifier.subscribe('alice|me', calls.append)
+    db.save_message('alice', 'me', 'hi')
+    assert [m.content for m in cache.get_recent('me', 'alice')] == ['hi']
+
+    assert not notifier.check_external_changes()
+    db.save_message('alice', 'me', 'local')
+    db.mark_messages_as_read('alice', 'me')
+    assert not notifier.check_external_changes()
+    calls.clear()
+
+    # 模拟另一个进程直接写入数据库
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("""
+            INSERT INTO chat_messages (sender_id, receiver_id, content, created_at, conversation_key, message_uid)
+            VALUES ('alice', 'me', 'external', 9999999999999, 'alice|me', 'external-uid')
+        """)
+    assert notifier.check_external_changes()
+    assert calls == ['alice|me']
+    assert [m.content for m in cache.get_recent('me', 'alice')] == ['hi', 'local', 'external']
+    assert cache.get_unread_counts('me') == {'alice': 1}
+
+    assert not notifier.check_external_changes()
+    notifier.stop()
+    assert db.close(timeout=2)
+
+def test_external_write_followed_by_local_write_is_not_lost(tmp_path):
+    """测试其他进程写入后、下一轮轮询前发生本地写入时，外部写入仍会被发现"""
+    db, cache, notifier = make_notifier(tmp_path)
+    calls = []
+    notifier.subscribe('alice|me', calls.append)
+    db.save_message('alice', 'me', 'hi')
+    cache.get_recent('me', 'alice')
+    assert not notifier.check_external_changes()
+
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("""
+            INSERT INTO chat_messages (sender_id, receiver_id, content, created_at, conversation_key, message_uid)
+            VALUES ('alice', 'me', 'external', 9999999999999, 'alice|me', 'external-uid')
+        """)
+    db.save_message('me', 'alice', 'local')
+    calls.clear()
+
+    assert notifier.check_external_changes()
+    assert calls == ['alice|me']
+    assert [m.content for m in cache.get_recent('me', 'alice')] == ['hi', 'local', 'external']
+    assert not notifier.check_external_changes()
+    notifier.stop()
+    assert db.close(timeout=2)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试聊天数据服务
+"""
+
+import sys
+import os
+import sqlite3
+import threading
+import time
+from PyQt5.QtWidgets import QApplication
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chat_database import ChatDatabase
+from chat_cache import ConversationCache
+from chat_service import (ChatDataService, ReadReceiptBatcher, UnreadCountService,
+                          disable_gui_thread_check, enable_gui_thread_check)
+
+def wait_for(app, condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+    return condition()
+
+def test_tasks_run_on_database_thread(tmp_path):
+    """测试读写在数据库线程中执行，结果在界面线程中回调"""
+    app = QApplication.instance() or QApplication([])
+    db = ChatDatabase(db_path=str(tmp_path / 'chat.db'))
+    service = ChatDataService(db, ConversationCache(db))
+    results = {}
+
+    def record(name):
+        return lambda result: results.setdefault(name, (result, threading.current_thread()))
+
+    enable_gui_thread_check()
+    try:
+        service.send_message('me', 'alice', 'hi', 1000, 'uid-1', callback=record('send'))
+        assert wait_for(app, lambda: 'send' in results)
+        service.load_recent('me', 'alice', 10, record('recent'))
+        service.load_page('me', 'alice', 2000, 0, True, 10, record('page'))
+        service.mark_read('me', 'alice', record('read'))
+        assert wait_for(app, lambda: len(results) == 4)
+    finally:
+        disable_gui_thread_check()
+
+    message_id, thread = results['send']
+    assert message_id and thread is threading.main_thread()
+    assert [m.id for m in results['recent'][0]] == [message_id]
+    assert [m.content for m in results['page'][0]] == ['hi']
+    assert results['read'][0] is True
+    assert service.stop(timeout=2)
+    assert db.close(timeout=2)
+
+def test_read_receipts_are_coalesced(tmp_path):
+    """测试已读水位合并为一次写入，水位之后的消息仍为未读"""
+    app = QApplication.instance() or QApplication([])
+    db = ChatDatabase(db_path=str(tmp_path / 'chat.db'))
+    cache = ConversationCache(db)
+    service = ChatDataService(db, cache)
+    receipts = ReadReceiptBatcher(service, delay_ms=50)
+    ids = [db.save_message('alice', 'me', f'm{i}') for i in range(4)]
+    db.save_message('bob', 'me', 'yo')
+    assert cache.get_unread_counts('me') == {'alice': 4, 'bob': 1}
+    assert db.migrator.wait_for_backfills(timeout=10)
+
+    writes = []
+    db.add_write_observer(lambda: writes.append(1))
+    for message_id in ids[:3]:
+        receipts.mark_read('alice', 'me', message_id)
+    receipts.mark_read('alice', 'me', ids[0])
+    assert wait_for(app, lambda: writes)
+    assert service.flush(timeout=2)
+
+    assert len(writes) == 1
+    assert cache.get_unread_counts('me') == {'alice': 1, 'bob': 1}
+    assert db.get_unread_counts('me') == {'alice': 1, 'bob': 1}
+    assert [m.is_read for m in cache.get_recent('me', 'alice')] == [True, True, True, False]
+
+    # 立即写入（如窗口隐藏时）
+    receipts.mark_read('alice', 'me', ids[3])
+    receipts.flush()
+    assert service.flush(timeout=2)
+    assert cache.get_unread_counts('me') == {'bob': 1}
+    assert service.stop(timeout=2)
+    assert db.close(timeout=2)
+
+def test_gui_thread_check(tmp_path):
+    """测试调试模式下界面线程中访问SQLite会触发断言"""
+    path = str(tmp_path / 'check.db')
+    enable_gui_thread_check()
+    try:
+        try:
+            sqlite3.connect(path)
+            assert False, "界面线程中打开连接应当触发断言"
+        except AssertionError as e:
+            assert 'SQLite' in str(e)
+
+        rows = []
+        thread = threading.Thread(
+            target=lambda: rows.append(sqlite3.connect(path).execute("SELECT 1").fetchone()))
+        thread.start()
+        thread.join()
+        assert rows == [(1,)]
+    finally:
+        disable_gui_thread_check()
+    sqlite3.connect(path).close()
+
+def test_unread_count_service(tmp_path):
+    """测试未读总数随消息到达和已读事件更新"""
+    app = QApplication.instance() or QApplication([])
+    db = ChatDatabase(db_path=str(tmp_path / 'chat.db'))
+    service = ChatDataService(db, ConversationCache(db))
+    counter = UnreadCountService(service)
+    changes = []
+    counter.count_changed.connect(changes.append)
+
+    db.save_message('alice', 'me', 'hi')
+    counter.watch('me')
+    assert wait_for(app, lambda: counter.count == 1)
+
+    db.save_message('bob', 'me', 'yo')
+    db.save_message('bob', 'me', 'yo2')
+    db.save_message('me', 'bob', 'sent')
+    assert wait_for(app, lambda: counter.count == 3)
+
+    db.mark_messages_as_read('bob', 'me')
+    assert wait_for(app, lambda: counter.count == 1)
+    counter.clear()
+    assert counter.count == 0 and changes[-1] == 0
+    assert service.stop(timeout=2)
+    assert db.close(timeout=2)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试聊天消息云端同步（使用本地 PostgREST 替身）
+"""
+
+import sys
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+import pytest
+from postgrest import SyncPostgrestClient
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chat_database import ChatDatabase
+from chat_sync import ChatSyncEngine
+from local_postgrest import LocalPostgrest
+
+def stamp_received_at(method, rows):
+    """模拟迁移 007 的触发器：新写入的消息记录服务端写入时间，合并时保持原值"""
+    for row in rows:
+        if not row.get('server_received_at'):
+            row['server_received_at'] = datetime.now(timezone.utc).isoformat()
+
+@pytest.fixture
+def server():
+    srv = LocalPostgrest(unique={'chat_messages': ['client_key']}).start()
+    srv.triggers['chat_messages'] = stamp_received_at
+    yield srv
+    srv.stop()
+
+def make_engine(tmp_path, server, user_id, name='chat.db', batch_size=200):
+    db = ChatDatabase(db_path=str(tmp_path / name))
+    client = SyncPostgrestClient(server.url)
+    engine = ChatSyncEngine(db, client, lambda: {'id': user_id}, batch_size=batch_size)
+    return db, engine
+
+def test_push_is_idempotent(tmp_path, server):
+    """测试重复上传不会在服务器产生重复消息"""
+    db, engine = make_engine(tmp_path, server, 'alice', batch_size=3)
+    for i in range(7):
+        db.save_message('alice', 'bob', f'm{i}')
+
+    assert engine.sync_once()['pushed'] == 7
+    assert len(server.tables['chat_messages']) == 7
+    assert db.get_unsynced_messages('alice') == []
+
+    # 模拟上传成功但本地标记丢失后的重试
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("UPDATE chat_messages SET sync_status = 'local', server_id = NULL")
+    assert engine.sync_once()['pushed'] == 7
+    assert len(server.tables['chat_messages']) == 7
+
+    with sqlite3.connect(db.db_path) as conn:
+        server_ids = [row[0] for row in conn.execute("SELECT server_id FROM chat_messages ORDER BY id")]
+    assert server_ids == [row['id'] for row in server.tables['chat_messages']]
+
+def test_pull_advances_cursor(tmp_path, server):
+    """测试按游标增量拉取，重复拉取不产生重复消息"""
+    sender_db, sender = make_engine(tmp_path, server, 'alice', name='alice.db')
+    receiver_db, receiver = make_engine(tmp_path, server, 'bob', name='bob.db', batch_size=4)
+
+    for i in range(10):
+        sender_db.save_message('alice', 'bob', f'm{i}')
+    sender.sync_once()
+
+    assert receiver.sync_once() == {'pushed': 0, 'pulled': 10}
+    assert receiver_db.get_sync_value('pull_since:bob') == server.tables['chat_messages'][-1]['server_received_at']
+    assert receiver_db.get_unread_counts('bob') == {'alice': 10}
+
+    history = receiver_db.get_conversation_history('bob', 'alice', limit=20)
+    assert [m['content'] for m in history] == [f'm{i}' for i in range(10)]
+    # 拉取到的消息不会再被上传
+    assert receiver_db.get_unsynced_messages('bob') == []
+
+    receiver_db.set_sync_value('pull_since:bob', '2000-01-01T00:00:00+00:00')
+    assert receiver.sync_once()['pulled'] == 0
+    assert len(receiver_db.get_conversation_history('bob', 'alice', limit=20)) == 10
+
+def test_pull_catches_late_commits(tmp_path, server):
+    """测试较小ID的消息晚于较大ID提交时，重叠窗口仍能拉取到"""
+    receiver_db, receiver = make_engine(tmp_path, server, 'bob')
+    now = datetime.now(timezone.utc)
+
+    def insert(message_id, received_at):
+        server.insert_rows('chat_messages', [{
+            'id': message_id, 'client_key': f'k{message_id}', 'sender_id': 'alice', 'receiver_id': 'bob',
+            'content': f'm{message_id}', 'message_type': 'text', 'created_at': received_at.isoformat(),
+            'server_received_at': received_at.isoformat(),
+        }])
+
+    # id 2 先提交并被拉取；id 1 写入更早、提交更晚
+    insert(2, now)
+    assert receiver.sync_once()['pulled'] == 1
+    insert(1, now - timedelta(seconds=1))
+    assert receiver.sync_once()['pulled'] == 1
+    assert receiver.sync_once()['pulled'] == 0
+    history = receiver_db.get_conversation_history('bob', 'alice', limit=10)
+    assert sorted(m['content'] for m in history) == ['m1', 'm2']
+
+def test_pull_resumes_from_legacy_id_cursor(tmp_path, server):
+    """测试从旧版本的 id 游标升级后从游标所在消息接着拉取"""
+    sender_db, sender = make_engine(tmp_path, server, 'alice', name='alice.db')
+    receiver_db, receiver = make_engine(tmp_path, server, 'bob', name='bob.db')
+    for i in range(3):
+        sender_db.save_message('alice', 'bob', f'm{i}')
+    sender.sync_once()
+    receiver.sync_once()
+
+    # 迁移 007 用创建时间回填旧消息；本地只有旧版本按 id 的游标
+    for i, row in enumerate(server.tables['chat_messages']):
+        row['server_received_at'] = f'2000-01-0{i + 1}T00:00:00+00:00'
+    with sqlite3.connect(receiver_db.db_path) as conn:
+        conn.execute("DELETE FROM sync_state WHERE key = 'pull_since:bob'")
+    receiver_db.set_sync_value('pull_cursor:bob', '3')
+    sender_db.save_message('alice', 'bob', 'm3')
+    sender.sync_once()
+
+    requests = server.request_count
+    assert receiver.sync_once()['pulled'] == 1
+    # 查游标所在消息的写入时间 + 一页拉取
+    assert server.request_count - requests == 2
+    assert len(receiver_db.get_conversation_history('bob', 'alice', limit=10)) == 4
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试聊天消息列表模型
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chat_message import ChatMessage
+from chat_view import MessageListModel
+
+def make_messages(ids, is_read=False):
+    return [ChatMessage(i, 'alice', 'me', f'm{i}', created_at=i, is_read=is_read, message_uid=f'u{i}')
+            for i in ids]
+
+def test_set_messages_applies_minimal_changes():
+    """测试模型按消息身份增量更新"""
+    model = MessageListModel()
+    events = []
+    model.rowsInserted.connect(lambda parent, first, last: events.append(('insert', first, last)))
+    model.rowsRemoved.connect(lambda parent, first, last: events.append(('remove', first, last)))
+    model.dataChanged.connect(lambda first, last, roles: events.append(('change', first.row(), last.row())))
+
+    model.set_messages(make_messages(range(1, 6)))
+    assert model.rowCount() == 5
+
+    # 同一批消息对象再次设置时没有任何变化
+    messages = [model.message_at(row) for row in range(5)]
+    model.set_messages(messages)
+    assert events == []
+
+    # 最早的两条移出、末尾追加三条、中间的已读状态变化
+    updated = make_messages(range(3, 9))
+    updated[1] = make_messages([4], is_read=True)[0]
+    model.set_messages(updated[:1] + [updated[1]] + updated[2:])
+    assert events == [('remove', 0, 1), ('insert', 3, 5), ('change', 0, 2)]
+    assert [model.message_at(row).content for row in range(model.rowCount())] == \
+        ['m3', 'm4', 'm5', 'm6', 'm7', 'm8']
+    assert model.message_at(1).is_read
+
+def test_optimistic_message_is_replaced_in_place():
+    """测试发送时显示的临时消息在写入后原地替换，不产生重复行"""
+    model = MessageListModel()
+    model.set_messages(make_messages([1, 2]))
+
+    pending = ChatMessage(None, 'me', 'alice', 'hi', created_at=3, message_uid='sent')
+    model.add_message(pending)
+    assert model.last_key() == 'sent'
+
+    saved = ChatMessage(3, 'me', 'alice', 'hi', created_at=3, message_uid='sent')
+    model.set_messages(make_messages([1, 2]) + [saved])
+    assert model.rowCount() == 3
+    assert model.message_at(2) is saved
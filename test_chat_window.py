@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试聊天窗口向上翻页：预取、保持滚动位置、丢弃过期结果与页数上限
+"""
+
+import sys
+import os
+from types import SimpleNamespace
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtWidgets import QApplication
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import chat_window
+from chat_message import ChatMessage
+from chat_view import MessageRole
+from chat_window import ChatWindow
+from user_auth import user_auth
+
+# 会话中共有的消息：ID与创建时间都是 1..TOTAL
+TOTAL = 1000
+MESSAGES = [ChatMessage(i, 'alice', 'me', f'm{i}', created_at=i, is_read=True, message_uid=f'u{i}')
+            for i in range(1, TOTAL + 1)]
+
+class FakeCache:
+    """会话未预取，窗口总是经服务读取"""
+    capacity = 200
+
+    def peek_recent(self, user1_id, user2_id, limit=50):
+        return None
+
+class FakeService:
+    """记录窗口提交的读取请求，由测试决定何时完成"""
+
+    def __init__(self):
+        self.recent = []
+        self.pages = []
+
+    def load_recent(self, user1_id, user2_id, limit, callback):
+        self.recent.append(callback)
+
+    def load_page(self, user1_id, user2_id, created_at, message_id, older, limit, callback):
+        self.pages.append(((created_at, message_id), older, limit, callback))
+
+    def complete_page(self):
+        """按数据库的分页语义完成最早提交的一次分页读取"""
+        cursor, older, limit, callback = self.pages.pop(0)
+        if older:
+            page = [m for m in MESSAGES if (m.created_at, m.id) < cursor][-limit:]
+        else:
+            page = [m for m in MESSAGES if (m.created_at, m.id) > cursor][:limit]
+        callback(page)
+
+class FakeMigrator(QObject):
+    progress = pyqtSignal(str, int, int)
+
+class FakeNotifier:
+    def __init__(self):
+        self.subscribers = {}
+
+    def subscribe(self, key, callback):
+        callbacks = self.subscribers.setdefault(key, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+
+    def unsubscribe(self, key, callback):
+        callbacks = self.subscribers.get(key, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+class FakeReceipts:
+    def mark_read(self, sender_id, receiver_id, up_to_id):
+        pass
+
+    def flush(self):
+        pass
+
+def open_window(monkeypatch):
+    app = QApplication.instance() or QApplication([])
+    monkeypatch.setattr(user_auth, 'current_user', {'id': 'me', 'username': 'me'})
+    service = FakeService()
+    monkeypatch.setattr(chat_window, 'chat_service', service)
+    monkeypatch.setattr(chat_window, 'conversation_cache', FakeCache())
+    notifier = FakeNotifier()
+    monkeypatch.setattr(chat_window, 'chat_notifier', notifier)
+    monkeypatch.setattr(chat_window, 'read_receipts', FakeReceipts())
+    monkeypatch.setattr(chat_window, 'chat_db', SimpleNamespace(migrator=FakeMigrator()))
+    window = ChatWindow('alice', 'Alice')
+    window.resize(400, 500)
+    window.show()
+    app.processEvents()
+    window.notifier = notifier
+    return app, window, service
+
+def row_ids(window):
+    return [m.id for m in window.message_model.messages()]
+
+def top_message_id(window):
+    view = window.message_view
+    return view.indexAt(view.viewport().rect().topLeft()).data(MessageRole).id
+
+def test_scroll_back_prefetches_keeps_anchor_and_trims(monkeypatch):
+    """测试向上翻页使用预取的页、保持视口顶部的消息不动，超过页数上限时卸载最新的消息"""
+    app, window, service = open_window(monkeypatch)
+    scrollbar = window.message_view.verticalScrollBar()
+
+    # 第一次打开：显示最新一页，并预取更早的一页
+    service.recent.pop()(MESSAGES[-FakeCache.capacity:])
+    app.processEvents()
+    assert row_ids(window) == list(range(951, 1001))
+    assert scrollbar.value() == scrollbar.maximum() > window.LOAD_THRESHOLD
+    assert [(cursor, older) for cursor, older, _, _ in service.pages] == [((951, 951), True)]
+    service.complete_page()
+    assert window.prefetched['older'][0] == (951, 951)
+    assert row_ids(window) == list(range(951, 1001))
+
+    # 滚动到顶部：直接接上预取的页，视口顶部仍是原来的消息，并继续预取下一页
+    scrollbar.setValue(0)
+    assert row_ids(window) == list(range(901, 1001))
+    assert top_message_id(window) == 951
+    assert scrollbar.value() > 0
+    assert [(cursor, older) for cursor, older, _, _ in service.pages] == [((901, 901), True)]
+
+    # 继续向上翻页，列表最多保留 MAX_PAGES 页，超出时卸载最新的消息并停止跟随实时消息
+    limit = window.MAX_PAGES * window.PAGE_SIZE
+    for _ in range(window.MAX_PAGES):
+        service.complete_page()
+        window.request_page('older')
+    assert window.message_model.rowCount() == limit
+    assert not window.at_live_end
+    assert row_ids(window) == list(range(601, 601 + limit))
+
+    # 向下翻页接回最新的消息，回到底部后重新读取实时消息
+    for _ in range(window.MAX_PAGES * 2):
+        if window.at_live_end:
+            break
+        window.request_page('newer')
+        while service.pages:
+            service.complete_page()
+    assert window.at_live_end
+    assert row_ids(window)[-1] == TOTAL
+    assert window.message_model.rowCount() <= limit
+    assert service.recent
+
+    window.close()
+    app.processEvents()
+
+def test_stale_page_results_are_dropped(monkeypatch):
+    """测试回到最新消息或关闭窗口后，之前发出的分页读取结果被丢弃"""
+    app, window, service = open_window(monkeypatch)
+    service.recent.pop()(MESSAGES[-FakeCache.capacity:])
+    app.processEvents()
+    service.pages.clear()
+    window.pending_pages.clear()
+
+    window.request_page('older')
+    window.reset_to_latest()
+    service.complete_page()
+    assert window.message_model.rowCount() == 0
+    service.recent.pop()(MESSAGES[-FakeCache.capacity:])
+    assert row_ids(window) == list(range(951, 1001))
+
+    service.pages.clear()
+    window.pending_pages.clear()
+    window.request_page('older')
+    window.close()
+    service.complete_page()
+    assert row_ids(window) == list(range(951, 1001))
+    assert 'older' not in window.prefetched
+    app.processEvents()
+
+def test_hidden_window_stops_receiving_updates(monkeypatch):
+    """测试按Esc隐藏的窗口取消订阅，重新显示时恢复订阅并补读最新的消息"""
+    app, window, service = open_window(monkeypatch)
+    service.recent.pop()(MESSAGES[-FakeCache.capacity:])
+    assert window.notifier.subscribers[window.conversation_key] == [window.on_conversation_updated]
+
+    window.reject()
+    assert not window.isVisible()
+    assert window.notifier.subscribers[window.conversation_key] == []
+
+    window.show()
+    assert window.notifier.subscribers[window.conversation_key] == [window.on_conversation_updated]
+    assert len(service.recent) == 1
+
+    window.close()
+    assert window.notifier.subscribers[window.conversation_key] == []
+    app.processEvents()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试好友接口性能基准（小规模运行）
+"""
+
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from postgrest import SyncPostgrestClient
+from local_postgrest import LocalPostgrest
+from friends_manager import FriendsManager
+from user_auth import user_auth
+from friends_benchmark import install_friend_functions, run, seed_friendships
+
+def test_friends_list_single_request():
+    results = run(users=20, friends=6, latency=0.0, repeat=2)
+    assert results['friends_list']['legacy']['requests'] == 2
+    assert results['friends_list']['current']['requests'] == 1
+    assert 0 < results['friends_list']['current']['min_ms'] <= results['friends_list']['current']['median_ms']
+    assert results['send_request']['legacy']['requests'] == 4
+    assert results['send_request']['current']['requests'] == 1
+
+def test_send_friend_request_status_codes():
+    """测试服务端状态码映射为原有提示信息"""
+    server = LocalPostgrest().start()
+    previous_user = user_auth.current_user
+    try:
+        install_friend_functions(server)
+        me = seed_friendships(server, users=5, friends=2)
+        manager = FriendsManager(SyncPostgrestClient(server.url))
+        user_auth.current_user = {'id': me, 'username': 'user00000'}
+
+        sent = manager.send_friend_request('user00003')
+        assert sent['success'] and sent['message'] == "已向 user00003 发送好友请求" and sent['request_id']
+        assert manager.send_friend_request('user00003')['message'] == "已经发送过好友请求，请等待对方回应"
+        assert manager.send_friend_request('user00001')['message'] == "你们已经是好友了"
+        assert manager.send_friend_request('user00000')['message'] == "不能添加自己为好友"
+        assert manager.send_friend_request('nobody')['message'] == "用户不存在"
+        assert len(server.tables['friend_requests']) == 1
+    finally:
+        user_auth.current_user = previous_user
+        server.stop()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试好友对话框列表按ID增量更新
+"""
+
+import sys
+import os
+from PyQt5.QtWidgets import QApplication, QLabel
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import friends_dialog
+from friends_dialog import FriendItemWidget, FriendRequestWidget, FriendsDialog
+from presence import PresenceService
+from friends_sync import FriendsSyncEngine
+from user_auth import user_auth
+
+def make_friend(friend_id, is_online=False):
+    return {'id': friend_id, 'username': friend_id, 'is_online': is_online, 'last_active': None}
+
+def make_request(request_id):
+    return {'id': request_id, 'sender_username': 'alice', 'message': 'hi', 'created_at': '2024-01-01T00:00:00'}
+
+def layout_widgets(layout):
+    return [layout.itemAt(i).widget() for i in range(layout.count() - 1)]
+
+def test_lists_update_by_key(monkeypatch):
+    """测试刷新时只改动变化的列表项，没有变化时不触碰布局"""
+    app = QApplication.instance() or QApplication([])
+    monkeypatch.setattr(user_auth, 'current_user', {'id': 'me', 'username': 'me'})
+    # 不发起网络请求，加载结果由测试直接提供
+    monkeypatch.setattr(FriendsDialog, 'load_friends_list_async', lambda self: self.set_friends_loading_state(True))
+    monkeypatch.setattr(FriendsDialog, 'load_friend_requests_async', lambda self: self.set_requests_loading_state(True))
+    monkeypatch.setattr(friends_dialog, 'presence_service', PresenceService(None, lambda: None))
+    monkeypatch.setattr(friends_dialog, 'friends_sync', FriendsSyncEngine(None, None, lambda: None))
+    dialog = FriendsDialog()
+
+    dialog.on_friends_loaded({'success': True, 'friends': [make_friend('a'), make_friend('b'), make_friend('c')]})
+    a, b, c = layout_widgets(dialog.friends_layout)
+    assert all(isinstance(w, FriendItemWidget) for w in (a, b, c))
+
+    # 再次刷新得到相同的数据：组件和布局都不变
+    assert not dialog.sync_items(dialog.friends_layout, dialog.friend_items,
+                                 [make_friend('a'), make_friend('b'), make_friend('c')],
+                                 dialog.create_friend_widget, FriendItemWidget.set_friend_data)
+
+    # b 删除，c 上线并移到最前，新增 d
+    dialog.on_friends_loaded({'success': True, 'friends': [make_friend('c', True), make_friend('a'), make_friend('d')]})
+    widgets = layout_widgets(dialog.friends_layout)
+    assert widgets[:2] == [c, a] and widgets[2] not in (a, b, c)
+    assert [w.friend_data['id'] for w in widgets] == ['c', 'a', 'd']
+    assert c.status_label.text() == "在线"
+
+    # 好友请求首次加载为空：加载提示换成空状态，再次刷新不改动
+    dialog.on_requests_loaded({'success': True, 'requests': []})
+    empty, = layout_widgets(dialog.requests_layout)
+    assert isinstance(empty, QLabel) and empty.text() == '暂无好友请求'
+    dialog.on_requests_loaded({'success': True, 'requests': []})
+    assert layout_widgets(dialog.requests_layout) == [empty]
+
+    dialog.on_requests_loaded({'success': True, 'requests': [make_request('r1')]})
+    request_widget, = layout_widgets(dialog.requests_layout)
+    assert isinstance(request_widget, FriendRequestWidget)
+    assert dialog.tab_widget.tabText(1) == "好友请求 (1)"
+    dialog.on_requests_loaded({'success': True, 'requests': [make_request('r1')]})
+    assert layout_widgets(dialog.requests_layout) == [request_widget]
+
+    dialog.close()
+    app.processEvents()
+
+def test_unsynced_replica_waits_for_first_sync(monkeypatch):
+    """测试本地副本从未同步过时保持加载提示，首次同步失败才显示加载失败"""
+    app = QApplication.instance() or QApplication([])
+    monkeypatch.setattr(user_auth, 'current_user', {'id': 'me', 'username': 'me'})
+    monkeypatch.setattr(FriendsDialog, 'load_friends_list_async', lambda self: self.set_friends_loading_state(True))
+    monkeypatch.setattr(FriendsDialog, 'load_friend_requests_async', lambda self: self.set_requests_loading_state(True))
+    monkeypatch.setattr(friends_dialog, 'presence_service', PresenceService(None, lambda: None))
+    monkeypatch.setattr(friends_dialog, 'friends_sync', FriendsSyncEngine(None, None, lambda: None))
+    dialog = FriendsDialog()
+
+    dialog.on_friends_loaded({'success': True, 'friends': [], 'synced': False})
+    loading, = layout_widgets(dialog.friends_layout)
+    assert loading is dialog.friends_loading_label
+
+    # 已同步过的好友请求即使为空也不受同步失败影响
+    dialog.on_requests_loaded({'success': True, 'requests': [], 'synced': True})
+    dialog.on_sync_failed('network down')
+    error, = layout_widgets(dialog.friends_layout)
+    assert '加载失败' in error.text()
+    empty, = layout_widgets(dialog.requests_layout)
+    assert empty.text() == '暂无好友请求'
+
+    # 同步完成后显示本地副本
+    dialog.on_friends_loaded({'success': True, 'friends': [make_friend('a')], 'synced': True})
+    widget, = layout_widgets(dialog.friends_layout)
+    assert isinstance(widget, FriendItemWidget)
+
+    dialog.close()
+    app.processEvents()
+
+class RecordingService:
+    """记录提交的读取任务，由测试决定何时完成"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args, callback=None, default=None, **kwargs):
+        self.submitted.append((func, callback))
+
+def test_changes_during_load_trigger_reload(monkeypatch):
+    """测试读取期间收到的变化通知不会丢失，读取完成后重新读取一次"""
+    app = QApplication.instance() or QApplication([])
+    monkeypatch.setattr(user_auth, 'current_user', {'id': 'me', 'username': 'me'})
+    service = RecordingService()
+    monkeypatch.setattr(friends_dialog, 'chat_service', service)
+    monkeypatch.setattr(friends_dialog, 'presence_service', PresenceService(None, lambda: None))
+    monkeypatch.setattr(friends_dialog, 'friends_sync', FriendsSyncEngine(None, None, lambda: None))
+    dialog = FriendsDialog()
+    assert len(service.submitted) == 2
+
+    # 读取进行中又收到两次变化通知：只记下一次待重读
+    dialog.load_friends_list()
+    dialog.load_friends_list()
+    dialog.load_friend_requests()
+    assert len(service.submitted) == 2
+
+    # 过时的结果被丢弃并重新读取
+    dialog.on_friends_loaded({'success': True, 'friends': [make_friend('a')]})
+    dialog.on_requests_loaded({'success': True, 'requests': []})
+    assert len(service.submitted) == 4
+    assert dialog.friend_items == {}
+    assert dialog.friends_loading and dialog.requests_loading
+
+    dialog.on_friends_loaded({'success': True, 'friends': [make_friend('a'), make_friend('b')]})
+    dialog.on_requests_loaded({'success': True, 'requests': [make_request('r1')]})
+    assert len(service.submitted) == 4
+    assert set(dialog.friend_items) == {'a', 'b'} and set(dialog.request_items) == {'r1'}
+
+    dialog.close()
+    app.processEvents()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试好友数据本地副本：增量同步、离线操作排队和重放（使用本地 PostgREST 替身）
+"""
+
+import sys
+import os
+from datetime import datetime, timezone
+import pytest
+from postgrest import SyncPostgrestClient
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_postgrest import LocalPostgrest
+from friends_benchmark import install_friend_functions
+from friends_manager import FriendsManager
+from friends_store import FriendsStore
+from friends_sync import FriendsSyncEngine
+from user_auth import user_auth
+
+# 没有服务监听的端口：请求立即连接失败
+OFFLINE_URL = 'http://127.0.0.1:9/rest/v1'
+
+def friend_names(store):
+    return [f['username'] for f in store.get_friends('me')]
+
+def test_default_store_opens_on_first_use(tmp_path, monkeypatch):
+    """测试使用默认路径时创建实例不触碰用户数据目录，第一次访问时才建库"""
+    import friends_store
+    data_dir = tmp_path / 'data'
+    monkeypatch.setattr(friends_store.QStandardPaths, 'writableLocation', lambda location: str(data_dir))
+    store = FriendsStore()
+    assert not data_dir.exists()
+
+    assert store.get_friends('me') == []
+    assert os.path.exists(data_dir / 'friends.db')
+
+def test_offline_mutations_replay_and_delta_sync(tmp_path, monkeypatch):
+    """测试离线操作先更新本地副本，联网后重放并与服务器增量同步"""
+    monkeypatch.setattr(user_auth, 'current_user', {'id': 'me', 'username': 'me'})
+    server = LocalPostgrest().start()
+    try:
+        install_friend_functions(server)
+        now = datetime.now(timezone.utc).isoformat()
+        server.insert_rows('users', [
+            {'id': user_id, 'username': user_id, 'is_online': False, 'last_active': now}
+            for user_id in ('me', 'alice', 'bob', 'carol')
+        ])
+        server.insert_rows('friendships', [{'user1_id': 'me', 'user2_id': 'alice', 'created_at': now}])
+        server.insert_rows('friend_requests', [{'id': 'r1', 'sender_id': 'bob', 'receiver_id': 'me',
+                                                'message': 'hi', 'status': 'pending', 'created_at': now}])
+
+        store = FriendsStore(str(tmp_path / 'friends.db'))
+        online = FriendsManager(SyncPostgrestClient(server.url), store)
+        offline = FriendsManager(SyncPostgrestClient(OFFLINE_URL), store)
+        engine = FriendsSyncEngine(store, online, lambda: {'id': 'me'})
+        assert online.get_local_friends_list() == {'success': True, 'friends': [], 'total': 0, 'synced': False}
+
+        # 首次全量同步，一次请求
+        requests = server.request_count
+        assert engine.sync_once() == {'replayed': 0, 'friends': True, 'requests': True}
+        assert server.request_count - requests == 1
+        assert friend_names(store) == ['alice']
+        assert [r['id'] for r in store.get_friend_requests('me')] == ['r1']
+
+        # 没有变化时本地副本不变
+        assert engine.sync_once() == {'replayed': 0, 'friends': False, 'requests': False}
+
+        # 离线：删除好友和接受请求立即反映到本地副本，操作进入队列
+        result = offline.remove_friend('alice')
+        assert result['success'] and result['queued']
+        result = offline.respond_to_friend_request('r1', 'accept')
+        assert result['success'] and result['queued']
+        assert friend_names(store) == ['bob']
+        assert store.get_friend_requests('me') == []
+        with pytest.raises(ConnectionError):
+            FriendsSyncEngine(store, offline, lambda: {'id': 'me'}).sync_once()
+        assert [m['kind'] for m in store.get_pending_mutations('me')] == ['remove_friend',
+                                                                          'respond_to_friend_request']
+
+        # 离线期间 carol 发来好友请求；联网后按顺序重放，再增量同步
+        server.insert_rows('friend_requests', [{'id': 'r2', 'sender_id': 'carol', 'receiver_id': 'me',
+                                                'message': None, 'status': 'pending',
+                                                'created_at': now, 'updated_at': now}])
+        assert engine.sync_once()['replayed'] == 2
+        assert store.get_pending_mutations('me') == []
+        assert [(f['user1_id'], f['user2_id']) for f in server.tables['friendships']] == [('bob', 'me')]
+        assert friend_names(store) == ['bob']
+        assert [r['id'] for r in store.get_friend_requests('me')] == ['r2']
+
+        # 对方删除好友：通过墓碑同步到本地
+        SyncPostgrestClient(server.url).table('friendships').delete().eq('user1_id', 'bob').execute()
+        assert engine.sync_once()['friends']
+        assert friend_names(store) == []
+    finally:
+        server.stop()
+
+def test_rejected_replay_falls_back_to_full_sync(tmp_path, monkeypatch):
+    """测试服务器拒绝重放的操作时丢弃该操作，并用全量同步纠正本地副本"""
+    monkeypatch.setattr(user_auth, 'current_user', {'id': 'me', 'username': 'me'})
+    server = LocalPostgrest().start()
+    try:
+        install_friend_functions(server)
+        now = datetime.now(timezone.utc).isoformat()
+        server.insert_rows('users', [
+            {'id': user_id, 'username': user_id, 'is_online': False, 'last_active': now}
+            for user_id in ('me', 'bob')
+        ])
+        server.insert_rows('friend_requests', [{'id': 'r1', 'sender_id': 'bob', 'receiver_id': 'me',
+                                                'message': None, 'status': 'pending', 'created_at': now}])
+        store = FriendsStore(str(tmp_path / 'friends.db'))
+        engine = FriendsSyncEngine(store, FriendsManager(SyncPostgrestClient(server.url), store),
+                                   lambda: {'id': 'me'})
+        engine.sync_once()
+
+        # 离线时接受了请求，但对方已撤回
+        FriendsManager(SyncPostgrestClient(OFFLINE_URL), store).respond_to_friend_request('r1', 'accept')
+        assert friend_names(store) == ['bob']
+        server.tables['friend_requests'].clear()
+
+        engine.sync_once()
+        assert store.get_pending_mutations('me') == []
+        assert friend_names(store) == [] and store.get_friend_requests('me') == []
+    finally:
+        server.stop()
+
+def test_remove_missing_friendship_keeps_local_replica(tmp_path, monkeypatch):
+    """测试服务器没有删除任何好友关系时不改动本地副本"""
+    monkeypatch.setattr(user_auth, 'current_user', {'id': 'me', 'username': 'me'})
+    server = LocalPostgrest().start()
+    try:
+        install_friend_functions(server)
+        now = datetime.now(timezone.utc).isoformat()
+        server.insert_rows('users', [
+            {'id': user_id, 'username': user_id, 'is_online': False, 'last_active': now}
+            for user_id in ('me', 'alice')
+        ])
+        server.insert_rows('friendships', [{'user1_id': 'me', 'user2_id': 'alice', 'created_at': now}])
+        store = FriendsStore(str(tmp_path / 'friends.db'))
+        manager = FriendsManager(SyncPostgrestClient(server.url), store)
+        FriendsSyncEngine(store, manager, lambda: {'id': 'me'}).sync_once()
+        assert friend_names(store) == ['alice']
+
+        server.tables['friendships'].clear()
+        result = manager.remove_friend('alice')
+        assert not result['success']
+        assert friend_names(store) == ['alice']
+
+        server.insert_rows('friendships', [{'user1_id': 'alice', 'user2_id': 'me', 'created_at': now}])
+        assert manager.remove_friend('alice')['success']
+        assert friend_names(store) == []
+    finally:
+        server.stop()
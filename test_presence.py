@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试在线状态心跳和增量更新（使用本地 PostgREST 替身）
+"""
+
+import sys
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from postgrest import SyncPostgrestClient
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_postgrest import LocalPostgrest
+from friends_benchmark import install_friend_functions
+from presence import PresenceService
+
+def test_presence_heartbeat_and_deltas():
+    """测试心跳合并写入，只推送在线状态真正变化的好友"""
+    server = LocalPostgrest().start()
+    try:
+        install_friend_functions(server)
+        now = datetime.now(timezone.utc)
+        server.insert_rows('users', [
+            {'id': 'me', 'username': 'me', 'is_online': False, 'last_active': (now - timedelta(days=1)).isoformat()},
+            # alice 的心跳 1.5 秒后超时
+            {'id': 'alice', 'username': 'alice', 'is_online': True,
+             'last_active': (now - timedelta(seconds=88.5)).isoformat()},
+            {'id': 'bob', 'username': 'bob', 'is_online': False, 'last_active': (now - timedelta(hours=1)).isoformat()},
+            {'id': 'carol', 'username': 'carol', 'is_online': True, 'last_active': now.isoformat()},
+        ])
+        server.insert_rows('friendships', [
+            {'user1_id': 'me', 'user2_id': 'alice', 'created_at': now.isoformat()},
+            {'user1_id': 'bob', 'user2_id': 'me', 'created_at': now.isoformat()},
+        ])
+        client = SyncPostgrestClient(server.url)
+        service = PresenceService(client, lambda: {'id': 'me'})
+        signals = []
+        service.presence_changed.connect(signals.append)
+
+        # 首次心跳取回全部好友（不含非好友 carol）
+        requests = server.request_count
+        changes = service.sync_once()
+        assert server.request_count - requests == 1
+        assert {k: v['is_online'] for k, v in changes.items()} == {'alice': True, 'bob': False}
+        assert signals == [changes]
+        me = server.tables['users'][0]
+        assert me['is_online']
+        heartbeat_at = me['last_active']
+
+        # 没有变化时不推送；间隔过短的心跳不写表
+        assert service.sync_once() == {}
+        assert len(signals) == 1
+        assert me['last_active'] == heartbeat_at
+
+        # alice 心跳超时，bob 上线
+        time.sleep(1.6)
+        PresenceService(client, lambda: {'id': 'bob'}).sync_once()
+        changes = service.sync_once()
+        assert {k: v['is_online'] for k, v in changes.items()} == {'alice': False, 'bob': True}
+        assert service.get('bob')['is_online'] and not service.get('alice')['is_online']
+
+        service.reset()
+        assert service.get('bob') is None
+    finally:
+        server.stop()